@@ -17,8 +17,8 @@ from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import EmailMessage
-from carts.views import _cart_id
-from carts.models import Cart, CartItem
+from carts.views import _cart_id, _merge_cart_items, _reset_cart_count
+from carts.models import Cart
 import requests
 
 # Create your views here.
@@ -74,42 +74,13 @@ def login(request):
         if user is not None:
             try:
                 cart = Cart.objects.get(cart_id=_cart_id(request)) # get cart ID from session (browser cookie)
-                is_cart_item_exists = CartItem.objects.filter(cart=cart).exists()
-                if is_cart_item_exists: 
-                    cart_item = CartItem.objects.filter(cart=cart)
-
-                    # get product variations by cart ID
-                    product_variation = []
-                    for item in cart_item:
-                        variation = item.variations.all()
-                        product_variation.append(list(variation))
-
-                    #get cart items from user to access their product variations
-                    cart_item = CartItem.objects.filter(user=user)
-                    ex_var_list = []
-                    id = []
-                    for item in cart_item:
-                        existing_variation = item.variations.all()
-                        ex_var_list.append(list(existing_variation))
-                        id.append(item.id)
-
-                    for pr in product_variation:
-                        if pr in ex_var_list:
-                            index = ex_var_list.index(pr)
-                            item_id = id[index]
-                            item = CartItem.objects.get(id=item_id)
-                            item.quantity += 1
-                            item.user = user
-                            item.save()
-                        else:
-                            cart_item = CartItem.objects.filter(cart=cart)
-                            for item in cart_item:
-                                item.user = user
-                                item.save()
-            except:
+                _merge_cart_items(cart, user)
+            except (Cart.DoesNotExist, Cart.MultipleObjectsReturned):
                 pass
-            
+
             auth.login(request, user)
+            # The count of the anonymous cart does not include the items merged from the user's cart
+            _reset_cart_count(request)
             messages.success(request, 'You are now logged in!')
             url = request.META.get('HTTP_REFERER')
             try:
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Set the variation key of the existing lines, and merge the lines of a cart with the same
+    # product and variations into the oldest one, adding up their quantities
+    CartItem = apps.get_model('carts', 'CartItem')
+
+    items = list(CartItem.objects.prefetch_related('variations').order_by('id'))
+    for item in items:
+        item.variation_key = ','.join(str(pk) for pk in sorted({variation.pk for variation in item.variations.all()}))
+        CartItem.objects.filter(pk=item.pk).update(variation_key=item.variation_key)
+
+    merged = set()
+    for owner in ('user_id', 'cart_id'):
+        lines = {}
+        for item in items:
+            if item.pk in merged or getattr(item, owner) is None:
+                continue
+            line = lines.setdefault((getattr(item, owner), item.product_id, item.variation_key), item)
+            if line is not item:
+                line.quantity += item.quantity
+                CartItem.objects.filter(pk=line.pk).update(quantity=line.quantity)
+                CartItem.objects.filter(pk=item.pk).delete()
+                merged.add(item.pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='variation_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0002, so the indexes are not created in the transaction that merged the duplicate lines
+
+    dependencies = [
+        ('carts', '0002_cartitem_variation_key'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'product', 'variation_key'), name='carts_cartitem_user_line_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('cart__isnull', False)), fields=('cart', 'product', 'variation_key'), name='carts_cartitem_cart_line_unique'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from store.models import Product, Variation
 from django.contrib.auth.models import User
 from accounts.models import Account
@@ -10,7 +11,12 @@ class Cart(models.Model):
 
     def __str__(self):
         return self.cart_id
-    
+
+
+def variation_signature(variations):
+    # Sorted ids of the variations, the same for any order in which they were chosen
+    return ','.join(str(pk) for pk in sorted({variation.pk for variation in variations}))
+
 class CartItem(models.Model):
     user = models.ForeignKey(Account, on_delete=models.CASCADE, null=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -18,6 +24,16 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, null=True)
     quantity = models.IntegerField()
     is_active = models.BooleanField(default=True)
+    # variation_signature() of the variations, so a product with the same variations is one line of a cart
+    variation_key = models.CharField(max_length=255, blank=True, default='', editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product', 'variation_key'], condition=Q(user__isnull=False),
+                                    name='carts_cartitem_user_line_unique'),
+            models.UniqueConstraint(fields=['cart', 'product', 'variation_key'], condition=Q(cart__isnull=False),
+                                    name='carts_cartitem_cart_line_unique'),
+        ]
 
     def sub_total(self):
         return self.product.price * self.quantity
@@ -0,0 +1,23 @@
+"""Cart totals and tax, shared by the cart, checkout and order pages.
+
+cart_totals() computes the subtotal and quantity of a cart in one aggregate query, without
+loading the items or their products, and applies TAX_RATE (default 0.02). The order is placed
+with the same totals, so the cart and checkout pages show the amount that is charged.
+"""
+from decouple import config
+from django.db.models import F, Sum
+
+TAX_RATE = config('TAX_RATE', default=0.02, cast=float)
+
+
+def cart_totals(cart_items):
+    """{'total', 'quantity', 'tax', 'grand_total'} of a CartItem queryset"""
+    totals = cart_items.aggregate(total=Sum(F('product__price') * F('quantity')), quantity=Sum('quantity'))
+    total = totals['total'] or 0
+    tax = round(total * TAX_RATE, 2)
+    return {
+        'total': total,
+        'quantity': totals['quantity'] or 0,
+        'tax': tax,
+        'grand_total': total + tax,
+    }
@@ -1,3 +1,65 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from category.models import Category
+from store.models import Product, Variation
+from .models import Cart, CartItem, variation_signature
+from .pricing import TAX_RATE, cart_totals
+
+
+class CartPageTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Jackets', slug='jackets')
+        session = self.client.session
+        session.save()
+        self.cart = Cart.objects.create(cart_id=session.session_key)
+        self.products = 0
+
+    def add_items(self, count):
+        for _ in range(count):
+            self.products += 1
+            product = Product.objects.create(product_name='Jacket %d' % self.products, slug='jacket-%d' % self.products,
+                                             price=10 * self.products, images='photos/products/jacket.jpg', stock=10,
+                                             category=self.category)
+            variations = [Variation.objects.create(product=product, variation_category='color', variation_value='blue'),
+                          Variation.objects.create(product=product, variation_category='size', variation_value='m')]
+            item = CartItem.objects.create(product=product, cart=self.cart, quantity=2,
+                                           variation_key=variation_signature(variations))
+            item.variations.add(*variations)
+
+    def test_totals_in_one_query(self):
+        self.add_items(3)
+        with self.assertNumQueries(1):
+            totals = cart_totals(CartItem.objects.filter(cart=self.cart))
+        self.assertEqual(totals['total'], (10 + 20 + 30) * 2)
+        self.assertEqual(totals['quantity'], 6)
+        self.assertEqual(totals['tax'], round(120 * TAX_RATE, 2))
+        self.assertEqual(totals['grand_total'], 120 + totals['tax'])
+
+    def test_cart_queries_do_not_depend_on_the_number_of_items(self):
+        self.add_items(1)
+        # The first request fills the caches of the page, e.g. the category menu and the cart count
+        self.client.get(reverse('cart'))
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(reverse('cart'))
+
+        self.add_items(5)
+        with self.assertNumQueries(len(one_item)):
+            response = self.client.get(reverse('cart'))
+        self.assertEqual(len(response.context['cart_items']), 6)
+        self.assertEqual(response.context['quantity'], 12)
+        self.assertContains(response, 'Jacket 6')
+
+    def test_adding_the_same_variations_increments_one_line(self):
+        self.add_items(1)
+        product = Product.objects.get(slug='jacket-1')
+        url = reverse('add_cart', args=[product.id])
+        self.client.post(url, {'csrfmiddlewaretoken': 'token', 'size': 'M', 'color': 'Blue'})
+        with self.assertNumQueries(5):
+            self.client.post(url, {'color': 'blue', 'size': 'm'})
+
+        cart_item = CartItem.objects.get(cart=self.cart, product=product)
+        self.assertEqual(cart_item.quantity, 4)
+        self.assertEqual(cart_item.variation_key, variation_signature(cart_item.variations.all()))
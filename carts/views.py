@@ -1,10 +1,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from . import views
-from .models import Product, Cart, CartItem
+from .models import Product, Cart, CartItem, variation_signature
 from django.http import HttpResponse
-from django.core.exceptions import ObjectDoesNotExist
-from store.models import Product, Variation
+from store.models import Product, Variation, variation_category_choice
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from .pricing import cart_totals
 
 # Create your views here.
 def _cart_id(request):
@@ -13,133 +15,97 @@ def _cart_id(request):
         cart = request.session.create()
     return cart
 
-def add_cart(request, product_id):
-    current_user = request.user
-    product = Product.objects.get(id=product_id) # get the product
-
-    # if the user is authenticated
-    if current_user.is_authenticated:
-        product_variation = []
-        if request.method == 'POST':
-            for item in request.POST:
-                key = item
-                value = request.POST[key]
-                
-                try:
-                    variation = Variation.objects.get(product=product, variation_category__iexact=key, variation_value__iexact=value)
-                    product_variation.append(variation)
-                except: 
-                    pass 
-
-
-        is_cart_item_exists = CartItem.objects.filter(product=product, user=current_user).exists()
-        if is_cart_item_exists:
-            cart_item = CartItem.objects.filter(product=product, user=current_user)
-            # existing_variations -> database
-            # current variation -> product_variation
-            # item_id -> database
-            ex_var_list = []
-            id = []
-            for item in cart_item:
-                existing_variation = item.variations.all()
-                ex_var_list.append(list(existing_variation))
-                id.append(item.id)
-
-            if product_variation in ex_var_list:
-                # increase the quantity
-                index = ex_var_list.index(product_variation)
-                item_id = id[index]
-                item = CartItem.objects.get(product=product, id=item_id)
-                item.quantity += 1
-                item.save()
-            
-            else:
-                # add new item
-                item = CartItem.objects.create(product=product, quantity=1, user=current_user)
-                if len(product_variation) > 0:
-                    item.variations.clear()  # clear any existing variations
-                    item.variations.add(*product_variation)
-                item.save()
+# The number of items in the cart is kept in the session, so the navbar counter needs no query
+CART_COUNT_SESSION_KEY = 'cart_count'
 
+def _cart_count(request):
+    if not request.user.is_authenticated and not request.session.session_key:
+        # A visitor without a session has an empty cart; do not create a session just to say so
+        return 0
+    count = request.session.get(CART_COUNT_SESSION_KEY)
+    if count is None:
+        if request.user.is_authenticated:
+            cart_items = CartItem.objects.filter(user=request.user)
         else:
-            cart_item = CartItem.objects.create(
-                product = product,
-                quantity = 1,
-                user = current_user
-                )
-            if len(product_variation) > 0:
-                cart_item.variations.clear()  # clear any existing variations
-                cart_item.variations.add(*product_variation)
-            cart_item.save()
-
-        #return HttpResponse(cart_item.product)
-        return redirect('cart')
-    
-    # if user is not authenticated
+            cart_items = CartItem.objects.filter(cart__cart_id=request.session.session_key)
+        count = cart_items.aggregate(count=Sum('quantity'))['count'] or 0
+        request.session[CART_COUNT_SESSION_KEY] = count
+    return count
+
+def _adjust_cart_count(request, delta):
+    # Items added or removed by a cart view; without a stored count, the next page computes it
+    if CART_COUNT_SESSION_KEY in request.session:
+        request.session[CART_COUNT_SESSION_KEY] = max(0, request.session[CART_COUNT_SESSION_KEY] + delta)
+
+def _reset_cart_count(request):
+    # The cart changed in a way that is not a simple adjustment (login merge, order placed)
+    request.session.pop(CART_COUNT_SESSION_KEY, None)
+
+def _cart_items(request):
+    # The active items of the visitor's cart, with their product, category (for the product URL)
+    # and variations loaded in two queries whatever the number of items
+    if request.user.is_authenticated:
+        cart_items = CartItem.objects.filter(user=request.user, is_active=True)
+    elif request.session.session_key:
+        cart_items = CartItem.objects.filter(cart__cart_id=request.session.session_key, is_active=True)
     else:
-        product_variation = []
-        if request.method == 'POST':
-            for item in request.POST:
-                key = item
-                value = request.POST[key]
-                
-                try:
-                    variation = Variation.objects.get(product=product, variation_category__iexact=key, variation_value__iexact=value)
-                    product_variation.append(variation)
-                except: 
-                    pass 
-
-        try:
-            cart = Cart.objects.get(cart_id=_cart_id(request)) # get cart ID from session (browser cookie)
-        
-        except Cart.DoesNotExist:
-            cart = Cart.objects.create(
-                cart_id = _cart_id(request)
-                )
-            cart.save()
-
-        is_cart_item_exists = CartItem.objects.filter(product=product, cart=cart).exists()
-        if is_cart_item_exists:
-            cart_item = CartItem.objects.filter(product=product, cart=cart)
-            # existing_variations -> database
-            # current variation -> product_variation
-            # item_id -> database
-            ex_var_list = []
-            id = []
-            for item in cart_item:
-                existing_variation = item.variations.all()
-                ex_var_list.append(list(existing_variation))
-                id.append(item.id)
-
-            if product_variation in ex_var_list:
-                # increase the quantity
-                index = ex_var_list.index(product_variation)
-                item_id = id[index]
-                item = CartItem.objects.get(product=product, id=item_id)
-                item.quantity += 1
-                item.save()
-            
+        cart_items = CartItem.objects.none()
+    return (cart_items.select_related('product__category').defer('product__search_vector')
+            .prefetch_related('variations').order_by('id'))
+
+def _selected_variations(product, data):
+    # The variations chosen in the product form, in one query. Other fields, like the CSRF token, are ignored.
+    chosen = Q()
+    for category, _ in variation_category_choice:
+        if data.get(category):
+            chosen |= Q(variation_category__iexact=category, variation_value__iexact=data[category])
+    if not chosen:
+        return []
+    variations = {}
+    for variation in Variation.objects.filter(chosen, product=product).order_by('id'):
+        variations.setdefault(variation.variation_category.lower(), variation)
+    return list(variations.values())
+
+def _add_cart_item(product, variations, **owner):
+    # Add one to the cart line of the product with these variations, or create it. The quantity is
+    # incremented in the database, so concurrent clicks neither lose an increment nor create two lines.
+    key = variation_signature(variations)
+    cart_items = CartItem.objects.filter(product=product, variation_key=key, **owner)
+    if cart_items.update(quantity=F('quantity') + 1):
+        return
+    try:
+        with transaction.atomic():
+            cart_item = CartItem.objects.create(product=product, quantity=1, variation_key=key, **owner)
+            cart_item.variations.set(variations)
+    except IntegrityError:
+        # Another request created the line since the update
+        cart_items.update(quantity=F('quantity') + 1)
+
+def _merge_cart_items(cart, user):
+    # Move the items of an anonymous cart to the user signing in, adding their quantity to the
+    # user's line for the same product and variations if there is one
+    with transaction.atomic():
+        for cart_item in CartItem.objects.filter(cart=cart).exclude(user=user):
+            merged = (CartItem.objects.filter(user=user, product_id=cart_item.product_id, variation_key=cart_item.variation_key)
+                      .update(quantity=F('quantity') + cart_item.quantity))
+            if merged:
+                cart_item.delete()
             else:
-                # add new item
-                item = CartItem.objects.create(product=product, quantity=1, cart=cart)
-                if len(product_variation) > 0:
-                    item.variations.clear()  # clear any existing variations
-                    item.variations.add(*product_variation)
-                item.save()
+                cart_item.user = user
+                cart_item.save(update_fields=['user'])
 
-        else:
-            cart_item = CartItem.objects.create(
-                product = product,
-                quantity = 1,
-                cart = cart
-                )
-            if len(product_variation) > 0:
-                cart_item.variations.clear()  # clear any existing variations
-                cart_item.variations.add(*product_variation)
-            cart_item.save()
+def add_cart(request, product_id):
+    product = Product.objects.get(id=product_id) # get the product
+    product_variation = _selected_variations(product, request.POST) if request.method == 'POST' else []
 
-        #return HttpResponse(cart_item.product)
-        return redirect('cart')
+    if request.user.is_authenticated:
+        _add_cart_item(product, product_variation, user=request.user)
+    else:
+        cart, _ = Cart.objects.get_or_create(cart_id=_cart_id(request)) # get cart ID from session (browser cookie)
+        _add_cart_item(product, product_variation, cart=cart)
+
+    _adjust_cart_count(request, 1)
+    return redirect('cart')
 
 def remove_cart(request, product_id, cart_item_id):
     product = Product.objects.get(id=product_id)
@@ -154,6 +120,7 @@ def remove_cart(request, product_id, cart_item_id):
             cart_item.save()
         else:
             cart_item.delete()
+        _adjust_cart_count(request, -1)
     except:
         pass
     return redirect('cart')
@@ -167,59 +134,17 @@ def remove_cart_item(request, product_id, cart_item_id):
         cart_item = CartItem.objects.get(product=product, cart=cart, id=cart_item_id)
     
     cart_item.delete()
+    _adjust_cart_count(request, -cart_item.quantity)
     return redirect('cart')
 
 #@login_required(login_url='login')
-def cart(request, total=0, quantity=0, cart_items=None):
-    try:
-        tax = 0
-        grand_total = 0
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user, is_active=True)
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_items = CartItem.objects.filter(cart=cart, is_active=True)
-        for cart_item in cart_items: 
-            total += (cart_item.product.price * cart_item.quantity)
-            quantity += cart_item.quantity
-        tax = total * 0.05
-        grand_total = total + tax
-    except ObjectDoesNotExist:
-        pass #ignore 
-
-    context = {
-        'total': total,
-        'quantity': quantity,
-        'cart_items': cart_items,
-        'tax': tax,
-        'grand_total': grand_total,
-    }
-
+def cart(request):
+    cart_items = _cart_items(request)
+    context = dict(cart_totals(cart_items), cart_items=cart_items)
     return render(request, 'store/cart.html', context)
 
 @login_required(login_url='login')
-def checkout(request, total=0, quantity=0, cart_items=None):
-    try:
-        tax = 0
-        grand_total = 0
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user, is_active=True)
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_items = CartItem.objects.filter(cart=cart, is_active=True)
-        for cart_item in cart_items:
-            total += (cart_item.product.price * cart_item.quantity)
-            quantity += cart_item.quantity
-        tax = total * 0.05
-        grand_total = total + tax
-    except ObjectDoesNotExist:
-        pass #just ignore
-
-    context = {
-        'total': total,
-        'quantity': quantity,
-        'cart_items': cart_items,
-        'tax'       : tax,
-        'grand_total': grand_total,
-    }
-    return render(request, 'store/checkout.html', context)
\ No newline at end of file
+def checkout(request):
+    cart_items = _cart_items(request)
+    context = dict(cart_totals(cart_items), cart_items=cart_items)
+    return render(request, 'store/checkout.html', context)
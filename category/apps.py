@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class CategoryConfig(AppConfig):
     name = 'category'
+
+    def ready(self):
+        from .context_processors import invalidate_menu_links
+        from .models import Category
+        post_save.connect(invalidate_menu_links, sender=Category, dispatch_uid='category_invalidate_menu_links')
+        post_delete.connect(invalidate_menu_links, sender=Category, dispatch_uid='category_invalidate_menu_links')
@@ -1,5 +1,21 @@
+from decouple import config
+from django.core.cache import cache
+from django.db import transaction
+
 from .models import Category
 
+MENU_CACHE_KEY = 'category_menu_links'
+# Backstop for workers that do not share the cache with the worker that changed a category
+MENU_CACHE_TIMEOUT = config('CATEGORY_MENU_CACHE_TIMEOUT', default=300, cast=int)
+
 def menu_links(request):
-    links = Category.objects.all().order_by('category_name')
-    return dict(links=links)
\ No newline at end of file
+    # Cached until a category is saved or deleted, so pages render the menu without a query
+    links = cache.get(MENU_CACHE_KEY)
+    if links is None:
+        links = list(Category.objects.all().order_by('category_name'))
+        cache.set(MENU_CACHE_KEY, links, MENU_CACHE_TIMEOUT)
+    return dict(links=links)
+
+def invalidate_menu_links(sender, **kwargs):
+    """post_save / post_delete handler for Category"""
+    transaction.on_commit(lambda: cache.delete(MENU_CACHE_KEY))
@@ -6,6 +6,7 @@ urlpatterns = [
     path('category/<slug:category_slug>/', views.store, name='products_by_category'),
     path('category/<slug:category_slug>/<slug:product_slug>/', views.product_detail, name='product_detail'), 
     path('search/', views.search, name='search'),
+    path('suggest/', views.suggest, name='suggest'),
     path('submit_review/<int:product_id>/', views.submit_review, name='submit_review'),
     path('generate_description/<int:product_id>/', views.generate_description, name='generate_description'),
     path('save_product_description/<int:product_id>/', views.save_product_description, name='save_product_description'),
@@ -14,6 +15,7 @@ urlpatterns = [
     path('save_review_response/<int:product_id>/<int:review_id>/', views.save_review_response, name='save_review_response'),
     path('generate_summary/<int:product_id>/', views.generate_summary, name='generate_summary'),
     path('save_summary/<int:product_id>/', views.save_summary, name='save_summary'),
+    path('use_generation/<int:generation_id>/', views.use_generation, name='use_generation'),
     
     #### REGISTER GENAI URLS BELOW ####
     path('create_review_response/<int:product_id>/<int:review_id>/', views.create_review_response, name='create_review_response'),
@@ -4,15 +4,21 @@ from .forms import ReviewForm
 from category.models import Category
 from django.shortcuts import get_object_or_404
 from carts.models import CartItem
-from carts.views import _cart_id
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
+from .conditional import catalog_page, has_session_cookie, listing_etag, product_detail_etag
+from .facets import facet_counts, facet_selection, filter_products, selection_query
+from .generations import (available_generations, current_generation, forget_generation, forget_generations, measure_generation,
+                          previous_generations, save_generation, show_generation, track_token_usage)
+from .pagination import KeysetPaginator, approximate_count
+from .search import search_products
+from .suggestions import suggestion_index
+from django.http import JsonResponse
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from orders.models import OrderProduct
 import os
 from utils import bedrock, print_ww
+from utils.tag_stream import extract_tags
 from langchain.llms.bedrock import Bedrock
-from langchain.embeddings import BedrockEmbeddings
 from langchain import PromptTemplate
 import warnings
 from PIL import Image
@@ -26,10 +32,11 @@ import string
 import numpy as np
 import requests
 import psycopg2
-from pgvector.psycopg2 import register_vector
 
 # Initialize Bedrock client 
 boto3_bedrock = bedrock.get_bedrock_client(assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None), region=config("AWS_DEFAULT_REGION"))
+# Record the token counts Bedrock reports for each generation
+track_token_usage(boto3_bedrock)
 
 # Initialize S3 client
 s3 = boto3.client('s3', region_name=config("AWS_DEFAULT_REGION"))
@@ -47,43 +54,48 @@ secrets = boto3.client('secretsmanager', region_name=config("AWS_DEFAULT_REGION"
 ## This section can be safely ignored
 ## Please don't modify anything in this section
 
+@catalog_page(listing_etag)
 def store(request, category_slug=None):
     categories = None
     products = None
 
     if category_slug != None:
        categories = get_object_or_404(Category, slug=category_slug)
-       products = Product.objects.filter(category=categories, is_available=True).order_by('category')
-       paginator = Paginator(products, 6)
-       page = request.GET.get('page')
-       paged_products = paginator.get_page(page)
-       product_count = products.count()
+       products = Product.objects.filter(category=categories, is_available=True)
     else:
-        products = Product.objects.all().filter(is_available=True).order_by('category')
-        paginator = Paginator(products, 6)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
-        product_count = products.count()
+        products = Product.objects.all().filter(is_available=True)
+
+    # Brand, color, size and price filters, with the number of products for each of their values
+    selection = facet_selection(request.GET)
+    products = filter_products(products, selection)
+    facets = facet_counts.facets(selection, category_id=categories.id if categories else None)
+
+    # Keyset pagination on the (category_id, id) index, so deep pages are as fast as the first
+    paginator = KeysetPaginator(products, ('category', 'id'), 6)
+    paged_products = paginator.get_page(request.GET.get('cursor'))
+    product_count, exact_count = approximate_count(products)
 
     context = {
         'products': paged_products,
         'product_count': product_count,
+        'exact_count': exact_count,
+        'facets': facets,
+        'facet_query': selection_query(selection),
     }
     return render(request, 'store/store.html', context)
 
+@catalog_page(product_detail_etag, shared=False)
 def product_detail(request, category_slug, product_slug):
-    request.session['product_description_flag'] = False
-    request.session['product_details'] = None
-    request.session['draft_flag'] = False
-    request.session['summary_flag'] = False
-    request.session['image_flag'] = False
-    request.session['change_prompt'] = None
-    request.session['negative_prompt'] = None
-    request.session.modified = True
+    # Viewing a product again starts its GenAI feature pages over. Anonymous visitors have no
+    # session, and the page must not create one.
+    if has_session_cookie(request):
+        forget_generations(request)
 
     try:
         single_product = Product.objects.get(category__slug=category_slug, slug=product_slug)
-        in_cart = CartItem.objects.filter(cart__cart_id=_cart_id(request), product=single_product).exists()
+        in_cart = False
+        if request.session.session_key:
+            in_cart = CartItem.objects.filter(cart__cart_id=request.session.session_key, product=single_product).exists()
     except Exception as e:
         raise e
 
@@ -111,18 +123,33 @@ def product_detail(request, category_slug, product_slug):
     #print("user ->" +reviews[0].user.full_name())
     return render(request, 'store/product_detail.html', context)
 
+@catalog_page(listing_etag)
 def search(request):
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        if keyword:
-            products = Product.objects.order_by('-created_date').filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
-            product_count = products.count()
+    keyword = request.GET.get('keyword', '')
+    products, ordering = Product.objects.none(), ('-created_date', '-id')
+    if keyword:
+        # Full-text search ranked by relevance, or fuzzy matching of the product names if nothing matches
+        products, ordering, _ = search_products(Product.objects.all(), keyword)
+
+    paginator = KeysetPaginator(products, ordering, 6)
+    paged_products = paginator.get_page(request.GET.get('cursor'))
+    product_count, exact_count = approximate_count(products)
+
     context = {
-        'products': products,
+        'products': paged_products,
         'product_count': product_count,
+        'exact_count': exact_count,
+        'keyword': keyword,
     }
     return render(request, 'store/store.html', context)
 
+def suggest(request):
+    # Search-as-you-type suggestions, answered from the in-memory prefix index without a database query
+    suggestions = suggestion_index.suggest(request.GET.get('q', '')[:100])
+    response = JsonResponse({'suggestions': [suggestion.as_dict() for suggestion in suggestions]})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
 def submit_review(request, product_id):
     url = request.META.get('HTTP_REFERER')
     first_name=request.POST.get('first_name')
@@ -201,9 +228,11 @@ def generate_description(request, product_id):
    except Exception as e:
         raise e
    
-   # pass product object to context (to be used in generate_description.html)
+   # pass product object, and the generated descriptions to show, to context (to be used in generate_description.html)
    context = {
         'single_product': single_product,
+        'generation': current_generation(request, 'description', single_product),
+        'previous_generations': previous_generations('description', single_product),
     }
    
    # render HTML page generate_description.html
@@ -223,8 +252,7 @@ def save_product_description(request, product_id):
             return redirect('product_detail', single_product.category.slug, single_product.slug)
         # If user input is to regenerate
         elif 'regenerate' in request.POST:
-            request.session['product_description_flag'] = False
-            request.session.modified = True
+            forget_generation(request, 'description')
             return redirect('generate_description', single_product.id)
         else:
             # do nothing
@@ -249,6 +277,8 @@ def create_response(request, product_id, review_id):
     context = {
             'single_product': single_product,
             'review': review,
+            'generation': current_generation(request, 'review_response', single_product, review),
+            'previous_generations': previous_generations('review_response', single_product, review),
         }
     # render HTML page create_response.html
     return render(request, 'store/create_response.html', context)
@@ -257,14 +287,15 @@ def create_response(request, product_id, review_id):
 def save_review_response(request, product_id, review_id):
     try:
         # get single product review using product ID and review ID 
-        request.session['draft_flag'] = False
         single_product = Product.objects.get(id=product_id)
         review = ReviewRating.objects.get(product=single_product, id=review_id)
+        generation = current_generation(request, 'review_response', single_product, review)
+        forget_generation(request, 'review_response')
 
         # If user input is to save response
         if 'save_response' in request.POST:
             review.generated_response = request.POST.get('generated_response')
-            review.prompt = request.session.get('draft_prompt')
+            review.prompt = generation.prompt if generation else None
             review.save()
             success_message = "The response for the review of " + single_product.product_name + " has been updated successfully. "
             messages.success(request, success_message)
@@ -272,7 +303,6 @@ def save_review_response(request, product_id, review_id):
         
         # If user input is to regenerate review response
         elif 'regenerate' in request.POST:
-            request.session.modified = True
             return redirect('create_response', single_product.id, review.id)
         else:
             # do nothing
@@ -297,6 +327,8 @@ def generate_summary(request, product_id):
     context = {
             'single_product': single_product,
             'reviews': product_reviews,
+            'generation': current_generation(request, 'review_summary', single_product),
+            'previous_generations': previous_generations('review_summary', single_product),
         }
     
     # render HTML page generate_summary.html
@@ -307,18 +339,22 @@ def save_summary(request, product_id):
     try:
         # get single product review using product ID and review ID 
         single_product = Product.objects.get(id=product_id)
-        request.session['summary_flag'] = False
+        generation = current_generation(request, 'review_summary', single_product)
+        forget_generation(request, 'review_summary')
 
         # If user input is to save review summary
         if 'save_summary' in request.POST:
-            single_product.review_summary = request.session['generated_summary']
+            if generation is None:
+                # The summary is no longer shown in this session, e.g. the product page was opened in another tab
+                messages.error(request, "The review summary to save was not found. Please generate it again.")
+                return redirect('generate_summary', single_product.id)
+            single_product.review_summary = generation.output
             single_product.save()
             success_message = "The summary for the review of " + single_product.product_name + " has been updated successfully. "
             messages.success(request, success_message)
             return redirect('product_detail', single_product.category.slug, single_product.slug)
         # If user input is to regenerate review summary
         elif 'regenerate' in request.POST:
-            request.session.modified = True
             return redirect('generate_summary', single_product.id)
         else:
             # do nothing
@@ -333,9 +369,31 @@ def design_studio(request, product_id):
     single_product = Product.objects.get(id=product_id)
     context = {
         'single_product': single_product,
+        'generation': current_generation(request, 'design_idea', single_product),
+        'previous_generations': previous_generations('design_idea', single_product),
     }
     return render(request, 'store/studio.html', context)
 
+#### HANDLER FUNCTIONS FOR REUSING PREVIOUS GENERATIONS ####
+
+# This function is used for showing a previous generation again on its feature page, instead of paying for a new one
+@login_required(login_url='login')
+def use_generation(request, generation_id):
+    generation = get_object_or_404(available_generations().select_related('product__category'), id=generation_id)
+    product = generation.product
+    if request.user.role != 'Manager':
+        messages.error(request, "Only managers can use previous generations")
+        return redirect('product_detail', product.category.slug, product.slug)
+    show_generation(request, generation)
+    if generation.feature == 'review_response':
+        return redirect('create_response', product.id, generation.review_id)
+    feature_pages = {
+        'description': 'generate_description',
+        'design_idea': 'design_studio',
+        'review_summary': 'generate_summary',
+    }
+    return redirect(feature_pages[generation.feature], product.id)
+
 # Handy function to convert an image to base64 string
 # Stabile Diffusion LLM expects the input image to be in base64 string format
 def image_to_base64(img) -> str:
@@ -356,22 +414,9 @@ def image_to_base64(img) -> str:
 #### HANDLER FUNCTIONS FOR QUESTION ANSWERING FEATURE ####
 
 # This function is used for extracting string within a tag. For example, get string embedded within <query></query>
+# The text is scanned once from start to end, without slicing or recursion (see utils/tag_stream.py)
 def extract_strings_recursive(test_str, tag):
-    # finding the index of the first occurrence of the opening tag
-    start_idx = test_str.find("<" + tag + ">")
- 
-    # base case
-    if start_idx == -1:
-        return []
- 
-    # extracting the string between the opening and closing tags
-    end_idx = test_str.find("</" + tag + ">", start_idx)
-    res = [test_str[start_idx+len(tag)+2:end_idx]]
- 
-    # recursive call to extract strings after the current tag
-    res += extract_strings_recursive(test_str[end_idx+len(tag)+3:], tag)
- 
-    return res
+    return extract_tags(test_str, tag)
 
 ####################### END SECTION - HANDLER FUNCTIONS GENAI FEATURES ##########################
 
@@ -465,19 +510,19 @@ def generate_product_description(request, product_id):
                                          details=product_details)
         
         # STEP 7 - Retrieve the generated product description from Bedrock.
-        response = textgen_llm(prompt)
+        with measure_generation() as usage:
+            response = textgen_llm(prompt)
         # get the second paragraph i.e, only the product description 
         generated_description = response[response.index('\n')+1:]
 
     except Exception as e:
         raise e
     
-    # STEP 8 - Set Django session variables which will be used in the HTML template to display the results. 
-    request.session['product_details'] = product_details
-    request.session['generated_description'] = generated_description
-    request.session['prompt'] = prompt
-    request.session['product_description_flag'] = True
-    request.session.modified = True
+    # STEP 8 - Save the generated product description with the prompt and inference parameters used.
+    # The session only keeps the id of the result, which the HTML template displays.
+    save_generation(request, 'description', single_product, textgen_llm.model_id,
+                    output=generated_description, prompt=prompt, parameters=inference_modifier,
+                    inputs={'product_details': product_details, 'wordrange': max_length}, usage=usage)
 
     # STEP 9 - Re-direct to the same page. 
     # Now the page will display the generated product description from Bedrock. 
@@ -575,7 +620,8 @@ def create_review_response(request, product_id, review_id):
                                          review=review_text)
         
         # STEP 7 - Call the LLM from Bedrock and retrieve the generated response to customer review.
-        response = textgen_llm(prompt)
+        with measure_generation() as usage:
+            response = textgen_llm(prompt)
 
         # Get the second paragraph i.e, only the response to customer review
         generated_response = response[response.index('\n')+1:]
@@ -583,11 +629,11 @@ def create_review_response(request, product_id, review_id):
     except Exception as e:
         raise e
 
-    # STEP 8 - Set Django session variables which will be used in the HTML template to display the results.
-    request.session['generated_response'] = generated_response
-    request.session['draft_prompt'] = prompt
-    request.session['draft_flag'] = True
-    request.session.modified = True
+    # STEP 8 - Save the generated response with the prompt and inference parameters used.
+    # The session only keeps the id of the result, which the HTML template displays.
+    save_generation(request, 'review_response', product, textgen_llm.model_id, review=review,
+                    output=generated_response, prompt=prompt, parameters=inference_modifier,
+                    inputs={'wordrange': max_length}, usage=usage)
 
     # STEP 9 - Re-direct to the same page. Now the page will display the generated response to customer review from Bedrock.
     url = request.META.get('HTTP_REFERER')
@@ -4,15 +4,21 @@ from .forms import ReviewForm
 from category.models import Category
 from django.shortcuts import get_object_or_404
 from carts.models import CartItem
-from carts.views import _cart_id
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
+from .conditional import catalog_page, has_session_cookie, listing_etag, product_detail_etag
+from .facets import facet_counts, facet_selection, filter_products, selection_query
+from .generations import (available_generations, current_generation, forget_generation, forget_generations, measure_generation,
+                          previous_generations, save_generation, show_generation, track_token_usage)
+from .pagination import KeysetPaginator, approximate_count
+from .search import search_products
+from .suggestions import suggestion_index
+from django.http import JsonResponse
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from orders.models import OrderProduct
 import os
 from utils import bedrock, print_ww
+from utils.tag_stream import extract_tags
 from langchain.llms.bedrock import Bedrock
-from langchain.embeddings import BedrockEmbeddings
 from langchain import PromptTemplate
 import warnings
 from PIL import Image
@@ -26,10 +32,11 @@ import string
 import numpy as np
 import requests
 import psycopg2
-from pgvector.psycopg2 import register_vector
 
 # Initialize Bedrock client 
 boto3_bedrock = bedrock.get_bedrock_client(assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None), region=config("AWS_DEFAULT_REGION"))
+# Record the token counts Bedrock reports for each generation
+track_token_usage(boto3_bedrock)
 
 # Initialize S3 client
 s3 = boto3.client('s3', region_name=config("AWS_DEFAULT_REGION"))
@@ -47,43 +54,48 @@ secrets = boto3.client('secretsmanager', region_name=config("AWS_DEFAULT_REGION"
 ## This section can be safely ignored
 ## Please don't modify anything in this section
 
+@catalog_page(listing_etag)
 def store(request, category_slug=None):
     categories = None
     products = None
 
     if category_slug != None:
        categories = get_object_or_404(Category, slug=category_slug)
-       products = Product.objects.filter(category=categories, is_available=True).order_by('category')
-       paginator = Paginator(products, 6)
-       page = request.GET.get('page')
-       paged_products = paginator.get_page(page)
-       product_count = products.count()
+       products = Product.objects.filter(category=categories, is_available=True)
     else:
-        products = Product.objects.all().filter(is_available=True).order_by('category')
-        paginator = Paginator(products, 6)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
-        product_count = products.count()
+        products = Product.objects.all().filter(is_available=True)
+
+    # Brand, color, size and price filters, with the number of products for each of their values
+    selection = facet_selection(request.GET)
+    products = filter_products(products, selection)
+    facets = facet_counts.facets(selection, category_id=categories.id if categories else None)
+
+    # Keyset pagination on the (category_id, id) index, so deep pages are as fast as the first
+    paginator = KeysetPaginator(products, ('category', 'id'), 6)
+    paged_products = paginator.get_page(request.GET.get('cursor'))
+    product_count, exact_count = approximate_count(products)
 
     context = {
         'products': paged_products,
         'product_count': product_count,
+        'exact_count': exact_count,
+        'facets': facets,
+        'facet_query': selection_query(selection),
     }
     return render(request, 'store/store.html', context)
 
+@catalog_page(product_detail_etag, shared=False)
 def product_detail(request, category_slug, product_slug):
-    request.session['product_description_flag'] = False
-    request.session['product_details'] = None
-    request.session['draft_flag'] = False
-    request.session['summary_flag'] = False
-    request.session['image_flag'] = False
-    request.session['change_prompt'] = None
-    request.session['negative_prompt'] = None
-    request.session.modified = True
+    # Viewing a product again starts its GenAI feature pages over. Anonymous visitors have no
+    # session, and the page must not create one.
+    if has_session_cookie(request):
+        forget_generations(request)
 
     try:
         single_product = Product.objects.get(category__slug=category_slug, slug=product_slug)
-        in_cart = CartItem.objects.filter(cart__cart_id=_cart_id(request), product=single_product).exists()
+        in_cart = False
+        if request.session.session_key:
+            in_cart = CartItem.objects.filter(cart__cart_id=request.session.session_key, product=single_product).exists()
     except Exception as e:
         raise e
 
@@ -111,18 +123,33 @@ def product_detail(request, category_slug, product_slug):
     #print("user ->" +reviews[0].user.full_name())
     return render(request, 'store/product_detail.html', context)
 
+@catalog_page(listing_etag)
 def search(request):
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        if keyword:
-            products = Product.objects.order_by('-created_date').filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
-            product_count = products.count()
+    keyword = request.GET.get('keyword', '')
+    products, ordering = Product.objects.none(), ('-created_date', '-id')
+    if keyword:
+        # Full-text search ranked by relevance, or fuzzy matching of the product names if nothing matches
+        products, ordering, _ = search_products(Product.objects.all(), keyword)
+
+    paginator = KeysetPaginator(products, ordering, 6)
+    paged_products = paginator.get_page(request.GET.get('cursor'))
+    product_count, exact_count = approximate_count(products)
+
     context = {
-        'products': products,
+        'products': paged_products,
         'product_count': product_count,
+        'exact_count': exact_count,
+        'keyword': keyword,
     }
     return render(request, 'store/store.html', context)
 
+def suggest(request):
+    # Search-as-you-type suggestions, answered from the in-memory prefix index without a database query
+    suggestions = suggestion_index.suggest(request.GET.get('q', '')[:100])
+    response = JsonResponse({'suggestions': [suggestion.as_dict() for suggestion in suggestions]})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
 def submit_review(request, product_id):
     url = request.META.get('HTTP_REFERER')
     first_name=request.POST.get('first_name')
@@ -201,9 +228,11 @@ def generate_description(request, product_id):
    except Exception as e:
         raise e
    
-   # pass product object to context (to be used in generate_description.html)
+   # pass product object, and the generated descriptions to show, to context (to be used in generate_description.html)
    context = {
         'single_product': single_product,
+        'generation': current_generation(request, 'description', single_product),
+        'previous_generations': previous_generations('description', single_product),
     }
    
    # render HTML page generate_description.html
@@ -223,8 +252,7 @@ def save_product_description(request, product_id):
             return redirect('product_detail', single_product.category.slug, single_product.slug)
         # If user input is to regenerate
         elif 'regenerate' in request.POST:
-            request.session['product_description_flag'] = False
-            request.session.modified = True
+            forget_generation(request, 'description')
             return redirect('generate_description', single_product.id)
         else:
             # do nothing
@@ -249,6 +277,8 @@ def create_response(request, product_id, review_id):
     context = {
             'single_product': single_product,
             'review': review,
+            'generation': current_generation(request, 'review_response', single_product, review),
+            'previous_generations': previous_generations('review_response', single_product, review),
         }
     # render HTML page create_response.html
     return render(request, 'store/create_response.html', context)
@@ -257,14 +287,15 @@ def create_response(request, product_id, review_id):
 def save_review_response(request, product_id, review_id):
     try:
         # get single product review using product ID and review ID 
-        request.session['draft_flag'] = False
         single_product = Product.objects.get(id=product_id)
         review = ReviewRating.objects.get(product=single_product, id=review_id)
+        generation = current_generation(request, 'review_response', single_product, review)
+        forget_generation(request, 'review_response')
 
         # If user input is to save response
         if 'save_response' in request.POST:
             review.generated_response = request.POST.get('generated_response')
-            review.prompt = request.session.get('draft_prompt')
+            review.prompt = generation.prompt if generation else None
             review.save()
             success_message = "The response for the review of " + single_product.product_name + " has been updated successfully. "
             messages.success(request, success_message)
@@ -272,7 +303,6 @@ def save_review_response(request, product_id, review_id):
         
         # If user input is to regenerate review response
         elif 'regenerate' in request.POST:
-            request.session.modified = True
             return redirect('create_response', single_product.id, review.id)
         else:
             # do nothing
@@ -297,6 +327,8 @@ def generate_summary(request, product_id):
     context = {
             'single_product': single_product,
             'reviews': product_reviews,
+            'generation': current_generation(request, 'review_summary', single_product),
+            'previous_generations': previous_generations('review_summary', single_product),
         }
     
     # render HTML page generate_summary.html
@@ -307,18 +339,22 @@ def save_summary(request, product_id):
     try:
         # get single product review using product ID and review ID 
         single_product = Product.objects.get(id=product_id)
-        request.session['summary_flag'] = False
+        generation = current_generation(request, 'review_summary', single_product)
+        forget_generation(request, 'review_summary')
 
         # If user input is to save review summary
         if 'save_summary' in request.POST:
-            single_product.review_summary = request.session['generated_summary']
+            if generation is None:
+                # The summary is no longer shown in this session, e.g. the product page was opened in another tab
+                messages.error(request, "The review summary to save was not found. Please generate it again.")
+                return redirect('generate_summary', single_product.id)
+            single_product.review_summary = generation.output
             single_product.save()
             success_message = "The summary for the review of " + single_product.product_name + " has been updated successfully. "
             messages.success(request, success_message)
             return redirect('product_detail', single_product.category.slug, single_product.slug)
         # If user input is to regenerate review summary
         elif 'regenerate' in request.POST:
-            request.session.modified = True
             return redirect('generate_summary', single_product.id)
         else:
             # do nothing
@@ -333,9 +369,31 @@ def design_studio(request, product_id):
     single_product = Product.objects.get(id=product_id)
     context = {
         'single_product': single_product,
+        'generation': current_generation(request, 'design_idea', single_product),
+        'previous_generations': previous_generations('design_idea', single_product),
     }
     return render(request, 'store/studio.html', context)
 
+#### HANDLER FUNCTIONS FOR REUSING PREVIOUS GENERATIONS ####
+
+# This function is used for showing a previous generation again on its feature page, instead of paying for a new one
+@login_required(login_url='login')
+def use_generation(request, generation_id):
+    generation = get_object_or_404(available_generations().select_related('product__category'), id=generation_id)
+    product = generation.product
+    if request.user.role != 'Manager':
+        messages.error(request, "Only managers can use previous generations")
+        return redirect('product_detail', product.category.slug, product.slug)
+    show_generation(request, generation)
+    if generation.feature == 'review_response':
+        return redirect('create_response', product.id, generation.review_id)
+    feature_pages = {
+        'description': 'generate_description',
+        'design_idea': 'design_studio',
+        'review_summary': 'generate_summary',
+    }
+    return redirect(feature_pages[generation.feature], product.id)
+
 # Handy function to convert an image to base64 string
 # Stabile Diffusion LLM expects the input image to be in base64 string format
 def image_to_base64(img) -> str:
@@ -356,22 +414,9 @@ def image_to_base64(img) -> str:
 #### HANDLER FUNCTIONS FOR QUESTION ANSWERING FEATURE ####
 
 # This function is used for extracting string within a tag. For example, get string embedded within <query></query>
+# The text is scanned once from start to end, without slicing or recursion (see utils/tag_stream.py)
 def extract_strings_recursive(test_str, tag):
-    # finding the index of the first occurrence of the opening tag
-    start_idx = test_str.find("<" + tag + ">")
- 
-    # base case
-    if start_idx == -1:
-        return []
- 
-    # extracting the string between the opening and closing tags
-    end_idx = test_str.find("</" + tag + ">", start_idx)
-    res = [test_str[start_idx+len(tag)+2:end_idx]]
- 
-    # recursive call to extract strings after the current tag
-    res += extract_strings_recursive(test_str[end_idx+len(tag)+3:], tag)
- 
-    return res
+    return extract_tags(test_str, tag)
 
 ####################### END SECTION - HANDLER FUNCTIONS GENAI FEATURES ##########################
 
@@ -465,19 +510,19 @@ def generate_product_description(request, product_id):
                                          details=product_details)
         
         # STEP 7 - Retrieve the generated product description from Bedrock.
-        response = textgen_llm(prompt)
+        with measure_generation() as usage:
+            response = textgen_llm(prompt)
         # get the second paragraph i.e, only the product description 
         generated_description = response[response.index('\n')+1:]
 
     except Exception as e:
         raise e
     
-    # STEP 8 - Set Django session variables which will be used in the HTML template to display the results. 
-    request.session['product_details'] = product_details
-    request.session['generated_description'] = generated_description
-    request.session['prompt'] = prompt
-    request.session['product_description_flag'] = True
-    request.session.modified = True
+    # STEP 8 - Save the generated product description with the prompt and inference parameters used.
+    # The session only keeps the id of the result, which the HTML template displays.
+    save_generation(request, 'description', single_product, textgen_llm.model_id,
+                    output=generated_description, prompt=prompt, parameters=inference_modifier,
+                    inputs={'product_details': product_details, 'wordrange': max_length}, usage=usage)
 
     # STEP 9 - Re-direct to the same page. 
     # Now the page will display the generated product description from Bedrock. 
@@ -575,7 +620,8 @@ def create_review_response(request, product_id, review_id):
                                          review=review_text)
         
         # STEP 7 - Call the LLM from Bedrock and retrieve the generated response to customer review.
-        response = textgen_llm(prompt)
+        with measure_generation() as usage:
+            response = textgen_llm(prompt)
 
         # Get the second paragraph i.e, only the response to customer review
         generated_response = response[response.index('\n')+1:]
@@ -583,11 +629,11 @@ def create_review_response(request, product_id, review_id):
     except Exception as e:
         raise e
 
-    # STEP 8 - Set Django session variables which will be used in the HTML template to display the results.
-    request.session['generated_response'] = generated_response
-    request.session['draft_prompt'] = prompt
-    request.session['draft_flag'] = True
-    request.session.modified = True
+    # STEP 8 - Save the generated response with the prompt and inference parameters used.
+    # The session only keeps the id of the result, which the HTML template displays.
+    save_generation(request, 'review_response', product, textgen_llm.model_id, review=review,
+                    output=generated_response, prompt=prompt, parameters=inference_modifier,
+                    inputs={'wordrange': max_length}, usage=usage)
 
     # STEP 9 - Re-direct to the same page. Now the page will display the generated response to customer review from Bedrock.
     url = request.META.get('HTTP_REFERER')
@@ -608,13 +654,15 @@ def create_design_ideas(request, product_id):
         # If user chose to delete previously generated image from Stable Diffusion model 
         if 'delete_previous' in request.GET:
             # delete previously generated image  
-            product_gallery_del = ProductGallery.objects.filter(product=single_product, image=request.session['image_file_path'])
+            generation = current_generation(request, 'design_idea', single_product)
+            product_gallery_del = ProductGallery.objects.filter(product=single_product, image=generation.image.name) if generation else None
             if product_gallery_del:
                 # Delete previously generated image from S3
-                s3.delete_object(Bucket=bucket_name, Key=request.session['image_file_path'])
-                # Delete this image in product image gallery in Django
+                s3.delete_object(Bucket=bucket_name, Key=generation.image.name)
+                # Delete this image in product image gallery in Django, and the result that generated it
                 product_gallery_del.delete()
-                request.session['image_flag'] = False
+                generation.delete()
+                forget_generation(request, 'design_idea')
             # redirect to design studio
             messages.info(request, "Deleted previously generated design idea. You can now create a new design idea.")
             return redirect('design_studio', single_product.id)
@@ -622,13 +670,14 @@ def create_design_ideas(request, product_id):
         # If user chose to delete all generated images from Stable Diffusion model
         if 'delete_all' in request.GET:
             # delete existing image gallery 
-            request.session['image_flag'] = False
+            forget_generation(request, 'design_idea')
             product_gallery_del = ProductGallery.objects.filter(product=single_product)
             if product_gallery_del:
                  # Delete all generated images from S3
                 for x in product_gallery_del:
                     s3.delete_object(Bucket=bucket_name, Key="media/"+str(x.image))
-                # Delete product image gallery in Django
+                # Delete product image gallery in Django, and the results that generated these images
+                single_product.generationresult_set.filter(image__in=[x.image.name for x in product_gallery_del]).delete()
                 product_gallery_del.delete()
             # redirect to product page
             messages.info(request, "Deleted all generated designs")
@@ -682,7 +731,8 @@ def create_design_ideas(request, product_id):
                     })
             
             # STEP 4 - Invoke the Stable Diffusion model from Bedrock passing all the inference parameters 
-            response = boto3_bedrock.invoke_model(body=sd_request, modelId="stability.stable-diffusion-xl")
+            with measure_generation() as usage:
+                response = boto3_bedrock.invoke_model(body=sd_request, modelId="stability.stable-diffusion-xl")
 
             # STEP 5 - Extract image from the API response
             # Save the image to S3 bucket and the product's image gallery
@@ -710,13 +760,14 @@ def create_design_ideas(request, product_id):
             product_gallery.image = 'store/products/' + image_file_path
             product_gallery.save()
 
-            # STEP 6 - Set Django session variables which will be used in the HTML template to display the generated image. 
-            request.session['change_prompt'] = change_prompt
-            request.session['negative_prompt'] = negprompts
-            request.session['image_file_path'] = 'store/products/' + image_file_path
-            request.session['image_flag'] = True
-            request.session['image_url'] = product_gallery.image.url
-            request.session.modified = True
+            # STEP 6 - Save the generated image with the prompts and inference parameters used.
+            # The session only keeps the id of the result, which the HTML template displays.
+            sd_parameters = json.loads(sd_request)
+            del sd_parameters['init_image']
+            save_generation(request, 'design_idea', single_product, "stability.stable-diffusion-xl",
+                            prompt=change_prompt, parameters=sd_parameters,
+                            inputs={'change_prompt': change_prompt, 'negative_prompt': negprompts},
+                            image='store/products/' + image_file_path, usage=usage)
 
             # Signal success message to user
             messages.success(request, "Design idea generated. Scroll down to check it out!")
@@ -856,16 +907,18 @@ def generate_review_summary(request, product_id):
         )
 
         # STEP 7 - Pass in the input variables to the prompt template and invoke the summary chain using Bedrock LLM 
-        summary=summary_chain.run({
-                "product_name": single_product.product_name,
-                "input_documents": customer_reviews
-                })
+        with measure_generation() as usage:
+            summary=summary_chain.run({
+                    "product_name": single_product.product_name,
+                    "input_documents": customer_reviews
+                    })
 
-        # STEP 8 - Set session parameters to use in HTML template
-        request.session['generated_summary'] = summary
-        request.session['summary_prompt'] = summary_prompt_string
-        request.session['summary_flag'] = True
-        request.session.modified = True
+        # STEP 8 - Save the summary with the prompt and inference parameters used.
+        # The session only keeps the id of the result, which the HTML template displays.
+        save_generation(request, 'review_summary', single_product, textsumm_llm.model_id,
+                        output=summary, prompt=summary_prompt_string,
+                        parameters=dict(inference_modifier, chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+                        usage=usage)
 
     except Exception as e: 
         raise e
@@ -877,6 +930,25 @@ def generate_review_summary(request, product_id):
 
 
 #### FEATURE 5 - QUESTION ANSWERING WITH SQL GENERATION ####
+from .schema_context import get_schema_context
+from .sql_guard import UnsafeQueryError
+from .result_serializer import serialize_resultset
+from .result_cache import cached_query_result
+from .answer_templates import ANSWERS, mask_pii, read_result, template_answer
+from .question_cache import QuestionCache
+from .schema_pruning import SchemaIndex
+from .sql_examples import ExampleIndex, format_examples, record_generation
+from utils.tag_stream import read_until_tag
+from utils.embeddings import get_embedding_backend
+
+# Questions are embedded with the backend selected by EMBEDDING_BACKEND, the same one vector search uses.
+question_embeddings = get_embedding_backend(config('EMBEDDING_BACKEND', default='bedrock'), client=boto3_bedrock)
+# SQL queries that ran successfully are cached by question, and reused for the same or similar questions (see store/question_cache.py)
+question_cache = QuestionCache(question_embeddings)
+# Index of the schema tables, used to send only the tables relevant to a question to the LLM (see store/schema_pruning.py)
+schema_index = SchemaIndex(question_embeddings)
+# Verified question and SQL query pairs, the most similar of which are shown to the LLM as examples (see store/sql_examples.py)
+sql_examples = ExampleIndex(question_embeddings)
 
 # This function is used for answering user questions in natural language using SQL generation and result interpretation by LLM
 def ask_question(request):
@@ -889,10 +961,9 @@ def ask_question(request):
         # STEP 1 - Get the user question asked in natural language from the retail web application 
         question = request.GET.get('question')
 
-        # STEP 2 - Get the schema file from S3 that has information about the tables storing the retail web application data 
-        s3 = boto3.client('s3')
-        resp = s3.get_object(Bucket=config('AWS_STORAGE_BUCKET_NAME'), Key="data/schema-postgres.sql")
-        schema = resp['Body'].read().decode("utf-8")
+        # STEP 2 - Get the schema context that has information about the tables storing the retail web application data 
+        # It is generated from the Django models once per process and rebuilt only after migrations (see store/schema_context.py)
+        schema_context = get_schema_context()
 
         # STEP 3 - Create a prompt template to generate an SQL query based on the question and the database schema. 
         # We are passing PostgresQL documentation to help with the SQL generation. 
@@ -913,6 +984,11 @@ def ask_question(request):
                 {schema}
             </schema>
 
+            These are correct queries for similar questions:
+            <examples>
+                {examples}
+            </examples>
+
             Question: {question}
 
             Assistant:
@@ -920,21 +996,34 @@ def ask_question(request):
             """
 
         # Prompt template variables
-        prompt_vars = PromptTemplate(template=prompt_template, input_variables=["question","schema"])
+        prompt_vars = PromptTemplate(template=prompt_template, input_variables=["question","schema","examples"])
             
         # Initialize LLM
         llm = Bedrock(model_id="anthropic.claude-instant-v1", client=boto3_bedrock)
-        
-        # Initialize prompt template with the question and database schema
-        prompt = prompt_vars.format(question=question, schema=schema)
 
+        cached = None
+        examples = None
         try: 
             # STEP 4 - Call the LLM from Bedrock to generate the SQL query based on the question and the database schema. 
-            llm_response = llm(prompt)
+            # If the same or a similar question was answered before for this schema version, its SQL query is reused instead
+            cached = question_cache.lookup(question, schema_context.version)
+            if cached.query:
+                print("Query found in the " + cached.tier + " question cache")
+                llm_response = "<query>" + cached.query + "</query>"
+            else:
+                # Initialize prompt template with the question and the part of the database schema relevant to it
+                schema = schema_index.schema_for(question, schema_context, cached.embedding)
+                # and the verified queries of the most similar questions as examples
+                examples = sql_examples.similar_examples(question, cached.embedding)
+                prompt = prompt_vars.format(question=question, schema=schema, examples=format_examples(examples))
+                # Stream the response and stop reading as soon as </query> arrives, so the query runs without
+                # waiting for the explanation the model often writes after it, and the rest of the generation is cancelled
+                llm_response = read_until_tag(llm.stream(prompt), "query")
 
             # Check if query is generated under <query></query> tags as instructed in our prompt
             if "<query>".upper() not in llm_response.upper():
                 print("no query generated")
+                record_generation('no_query', examples)
                 is_query_generated  = False
                 describe_query_result = llm_response
                 resultset=''
@@ -947,76 +1036,82 @@ def ask_question(request):
                 query = extract_strings_recursive(llm_response, "query")[0]
                 print("Query generated by LLM: " +query)
 
-                # Get database connection details from Secrets Manager
-                response = secrets.get_secret_value(SecretId=config('AWS_DATABASE_SECRET_ID'))
-                database_secrets = json.loads(response['SecretString'])
-
-                # Connect to PostgreSQL database
-                dbhost = database_secrets['host']
-                dbport = database_secrets['port']
-                dbuser = database_secrets['username']
-                dbpass = database_secrets['password']
-                dbname = database_secrets['name']
-
-                dbconn = psycopg2.connect(host=dbhost, user=dbuser, password=dbpass, port=dbport, database=dbname, connect_timeout=10)
-                dbconn.set_session(autocommit=True)
-                cursor = dbconn.cursor()
-
-                # Execute the extracted query
-                cursor.execute(query)
-                query_result = cursor.fetchall()
-
-                # Close database connection
-                cursor.close()
-                dbconn.close()
-                
-                # get query result
-                resultset = ''
-                if len(query_result) > 0:
-                    for x in query_result:
-                        resultset = resultset + ''.join(str(x)) + "\n"
+                # Execute the extracted query on a pooled read-only connection (see store/sql_guard.py)
+                # It must be a single SELECT within the cost budget, and it runs with a statement timeout and a row limit
+                # The result of a query that ran before is served from the cache until one of its tables is written to (see store/result_cache.py)
+                with cached_query_result(query) as query_result:
+                    # get query result, streamed from the database in batches (at most QA_MAX_ROWS rows)
+                    # Phone numbers, emails and addresses are masked before the result goes anywhere (see store/answer_templates.py)
+                    result_table = read_result(query_result)
+
+                # Render the result as tab-separated values for the prompt
+                # Rows over the token budget are replaced with a summary, so the next prompt stays small (see store/result_serializer.py)
+                resultset = serialize_resultset(result_table)
+
+                # The query ran successfully, so it can answer this question (and similar ones) next time
+                if cached.query:
+                    question_cache.record_hit(cached)
+                else:
+                    question_cache.store(question, query, schema_context.version, cached.embedding)
+                    sql_examples.add_generated(question, query)
+                    record_generation('success', examples)
 
                 print("Query result: \n" +resultset)
 
-                # STEP 6 - Invoke the Bedrock LLM once again to interpret the query results 
-                # This prompt template defines rules while describing query result. 
-                # This is the final result that will be seen by the user as an answer to their question. 
-                # Idea is to derive natural language answer for a natural language question. 
-                prompt_template = """
-
-                Human: This is a Q&A application. We need to answer questions asked by the customer at an e-commerce store. 
-                The question asked by the customer is {question}
-                We ran an SQL query in our database to get the following result. 
-
-                <resultset>
-                {resultset}
-                </resultset>
+                # STEP 6 - Describe the query result to the user
+                # Simple results, like a count, a price or a short list of names, are answered from templates without calling the LLM again
+                describe_query_result = template_answer(result_table)
+                if describe_query_result is not None:
+                    ANSWERS.labels('template').inc()
+                    print("describe_query_result (template) " + describe_query_result)
+                else:
+                    # Otherwise invoke the Bedrock LLM once again to interpret the query results 
+                    # This prompt template defines rules while describing query result. 
+                    # This is the final result that will be seen by the user as an answer to their question. 
+                    # Idea is to derive natural language answer for a natural language question. 
+                    prompt_template = """
+
+                    Human: This is a Q&A application. We need to answer questions asked by the customer at an e-commerce store. 
+                    The question asked by the customer is {question}
+                    We ran an SQL query in our database to get the following result. 
+
+                    <resultset>
+                    {resultset}
+                    </resultset>
+
+                    Summarize the above result and answer the question asked by the customer keeping the following rules in mind: 
+                    1. Don't make up answers if <resultset></resultset> is empty or none. Instead, answer that the item is not available based on the question.
+                    2. Mask the PIIs phone, email and address if found the answer with "<PII masked>"
+                    3. Don't say "based on the output" or "based on the query" or "based on the question" or something similar.  
+                    4. Keep the answer concise. 
+                    5. Don't give an impression to the customer that a query was run. Instead, answer naturally. 
 
-                Summarize the above result and answer the question asked by the customer keeping the following rules in mind: 
-                1. Don't make up answers if <resultset></resultset> is empty or none. Instead, answer that the item is not available based on the question.
-                2. Mask the PIIs phone, email and address if found the answer with "<PII masked>"
-                3. Don't say "based on the output" or "based on the query" or "based on the question" or something similar.  
-                4. Keep the answer concise. 
-                5. Don't give an impression to the customer that a query was run. Instead, answer naturally. 
+                    Assistant:
 
-                Assistant:
+                    """
 
-                """
+                    # Pass user question and query result to prompt template
+                    prompt_vars = PromptTemplate(template=prompt_template, input_variables=["question","resultset"])
 
-                # Pass user question and query result to prompt template
-                prompt_vars = PromptTemplate(template=prompt_template, input_variables=["question","resultset"])
+                    prompt = prompt_vars.format(question=question, resultset=resultset)
 
-                prompt = prompt_vars.format(question=question, resultset=resultset)
+                    # Invoke LLM and get response
+                    describe_query_result = mask_pii(llm(prompt))
+                    print("describe_query_result " + describe_query_result)
 
-                # Invoke LLM and get response
-                describe_query_result = llm(prompt)
-                print("describe_query_result " + describe_query_result)
+                    # If length of response is 0, then set response to "Sorry, I could not answer that question."
+                    if len(describe_query_result) == 0:
+                        describe_query_result = "Sorry, I could not answer that question."
 
-                # If length of response is 0, then set response to "Sorry, I could not answer that question."
-                if len(describe_query_result) == 0:
-                    describe_query_result = "Sorry, I could not answer that question."
+                    ANSWERS.labels('llm').inc()
 
         except Exception as e:
+            # A cached query that no longer runs is dropped, so the next question generates a new one
+            if cached is not None and isinstance(e, (UnsafeQueryError, psycopg2.Error)):
+                if cached.query:
+                    question_cache.discard(cached)
+                else:
+                    record_generation('failure', examples)
             query = "Following exception was received. Please try again.\n\n" + str(e)
 
         # STEP 7 - Set Django session variables which will be used in the HTML template to display the answer
@@ -1032,46 +1127,40 @@ def ask_question(request):
 
 
 #### FEATURE 6 - VECTOR SEARCH ####
+from utils.embeddings import get_embedding_backend
+from psycopg2 import sql
+from retailstore.db_pool import get_pool
+
+# Initialize the embeddings backend once per worker, so the model is warm before the first search.
+# EMBEDDING_BACKEND selects Amazon Titan on Bedrock ("bedrock", default) or a local CPU model ("local").
+embedding_backend = get_embedding_backend(config('EMBEDDING_BACKEND', default='bedrock'), client=boto3_bedrock)
+
 # This function is used for searching similar products using vector embeddings
 def vector_search(request):
     if 'keyword' in request.GET:
         # Get search keyword from user 
         keyword = request.GET['keyword']
         if keyword:
-            # STEP 1 - Initialize Titan embeddings model.
-            bedrock_embeddings = BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=boto3_bedrock)
-
+            # STEP 1 - Use the embeddings backend initialized above (Titan on Bedrock or the local CPU model).
             # STEP 2 - Generate vector embeddings for the search keyword. Example "red dress".
-            search_embedding = list(bedrock_embeddings.embed_query(keyword))
-
-            # Get database connection details from Secrets Manager
-            response = secrets.get_secret_value(SecretId=config('AWS_DATABASE_SECRET_ID'))
-            database_secrets = json.loads(response['SecretString'])
-
-            # Connect to PostgreSQL database
-            dbhost = database_secrets['host']
-            dbport = database_secrets['port']
-            dbuser = database_secrets['username']
-            dbpass = database_secrets['password']
-            dbname = database_secrets['vectorDbIdentifier']
-
-            dbconn = psycopg2.connect(host=dbhost, user=dbuser, password=dbpass, port=dbport, database=dbname, connect_timeout=10)
-            dbconn.set_session(autocommit=True)
-
-            # Register vector db
-            register_vector(dbconn)
-            cur = dbconn.cursor()
-
-            # STEP 3 - Search for similar products using the vector embeddings stored in RDS Postgres database
-            # Please note that in order to save time, all the 8500+ vector embeddings are pre-populated into your Amazon RDS database instance 
-            # using pgvector extension
-            cur.execute("""SELECT id, url, description, descriptions_embeddings 
-                        FROM vector_products
-                        ORDER BY descriptions_embeddings <-> %s limit 10;""", 
-                        (np.array(search_embedding),))
-
-            # Get search results
-            r = cur.fetchall()
+            search_embedding = embedding_backend.embed_query(keyword)
+
+            # Borrow a connection to the vector database from the shared pool (see retailstore/db_pool.py)
+            # The pool registers the pgvector type once per connection
+            with get_pool('vector').connection() as dbconn:
+                cur = dbconn.cursor()
+
+                # STEP 3 - Search for similar products using the vector embeddings stored in RDS Postgres database
+                # Please note that in order to save time, all the 8500+ vector embeddings are pre-populated into your Amazon RDS database instance 
+                # using pgvector extension. Each embeddings backend has its own table (see the embed_products command).
+                cur.execute(sql.SQL("""SELECT id, url, description, descriptions_embeddings 
+                            FROM {}
+                            ORDER BY descriptions_embeddings <-> %s limit 10;""").format(sql.Identifier(embedding_backend.index_table)), 
+                            (np.array(search_embedding),))
+
+                # Get search results
+                r = cur.fetchall()
+                cur.close()
             product_count = len(r)
 
             # STEP 4 - Fetch the similarity search results
@@ -1095,10 +1184,6 @@ def vector_search(request):
                 c['product_item_id'] = product_item_id   
                 combined.append(c)
 
-            # Close database connection
-            cur.close()
-            dbconn.close()
-
             # STEP 5 - Set context variables for HTML template to display the similarity search results
             context = {
                 'keyword': keyword,
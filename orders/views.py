@@ -1,11 +1,12 @@
 from django.shortcuts import render, redirect
 from django.http import HttpResponse, JsonResponse
 from carts.models import CartItem
+from carts.pricing import cart_totals
+from carts.views import _cart_items, _reset_cart_count
 from .forms import OrderForm
 import datetime
 from .models import Order, Payment, OrderProduct
 import json
-from store.models import Product
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 
@@ -29,8 +30,8 @@ def payments(request):
     order.is_ordered = True
     order.save()
 
-    # Move the cart items to Order Product table
-    cart_items = CartItem.objects.filter(user=request.user)
+    # Move the cart items to Order Product table, the same items place_order totalled
+    cart_items = _cart_items(request)
 
     for item in cart_items:
         orderproduct = OrderProduct()
@@ -39,24 +40,19 @@ def payments(request):
         orderproduct.user_id = request.user.id
         orderproduct.product_id = item.product_id
         orderproduct.quantity = item.quantity
-        orderproduct.product_price = item.product.price
+        product = item.product
+        orderproduct.product_price = product.price
         orderproduct.ordered = True
         orderproduct.save()
-
-        cart_item = CartItem.objects.get(id=item.id)
-        product_variation = cart_item.variations.all()
-        orderproduct = OrderProduct.objects.get(id=orderproduct.id)
-        orderproduct.variations.set(product_variation)
-        orderproduct.save()
-
+        orderproduct.variations.set(item.variations.all())
 
         # Reduce the quantity of the sold products
-        product = Product.objects.get(id=item.product_id)
         product.stock -= item.quantity
         product.save()
 
     # Clear cart
-    CartItem.objects.filter(user=request.user).delete()
+    CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
+    _reset_cart_count(request)
 
     # Send order recieved email to customer
     # mail_subject = 'Thank you for your order!'
@@ -75,23 +71,15 @@ def payments(request):
     }
     return JsonResponse(data)
 
-def place_order(request, total=0, quantity=0,):
+def place_order(request):
     current_user = request.user
 
     # If the cart count is less than or equal to 0, then redirect back to shop
-    cart_items = CartItem.objects.filter(user=current_user)
-    cart_count = cart_items.count()
-    if cart_count <= 0:
+    cart_items = _cart_items(request)
+    totals = cart_totals(cart_items)
+    if totals['quantity'] <= 0:
         return redirect('store')
 
-    grand_total = 0
-    tax = 0
-    for cart_item in cart_items:
-        total += (cart_item.product.price * cart_item.quantity)
-        quantity += cart_item.quantity
-    tax = (2 * total)/100
-    grand_total = total + tax
-
     if request.method == 'POST':
         form = OrderForm(request.POST)
         if form.is_valid():
@@ -108,8 +96,8 @@ def place_order(request, total=0, quantity=0,):
             data.state = form.cleaned_data['state']
             data.city = form.cleaned_data['city']
             data.order_note = form.cleaned_data['order_note']
-            data.order_total = grand_total
-            data.tax = tax
+            data.order_total = totals['grand_total']
+            data.tax = totals['tax']
             data.ip = request.META.get('REMOTE_ADDR')
             data.save()
             # Generate order number
@@ -123,13 +111,7 @@ def place_order(request, total=0, quantity=0,):
             data.save()
 
             order = Order.objects.get(user=current_user, is_ordered=False, order_number=order_number)
-            context = {
-                'order': order,
-                'cart_items': cart_items,
-                'total': total,
-                'tax': tax,
-                'grand_total': grand_total,
-            }
+            context = dict(totals, order=order, cart_items=cart_items)
             return render(request, 'orders/payments.html', context)
     else:
         return redirect('checkout')
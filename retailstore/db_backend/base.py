@@ -0,0 +1,36 @@
+"""PostgreSQL backend that reads its credentials from the cached secrets provider.
+
+Set SECRET_ID in the DATABASES entry. Host, port, user and password are taken from that secret
+every time a connection is opened, and a rejected login forces a refresh of the secret and one
+retry, so password rotation does not require a restart.
+"""
+from django.db.backends.postgresql import base
+
+from retailstore.secrets_provider import get_secret, is_authentication_error
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _apply_secret(self, conn_params, force_refresh=False):
+        secret = get_secret(self.settings_dict['SECRET_ID'], force_refresh=force_refresh)
+        conn_params.update({
+            'host': secret['host'],
+            'port': secret['port'],
+            'user': secret['username'],
+            'password': secret['password'],
+        })
+        return conn_params
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        if self.settings_dict.get('SECRET_ID'):
+            self._apply_secret(conn_params)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        try:
+            return super().get_new_connection(conn_params)
+        except base.Database.OperationalError as e:
+            if not self.settings_dict.get('SECRET_ID') or not is_authentication_error(e):
+                raise
+            return super().get_new_connection(self._apply_secret(dict(conn_params), force_refresh=True))
@@ -0,0 +1,259 @@
+"""Shared psycopg2 connection pools for the raw SQL paths (question answering and vector search).
+
+One pool is kept per database and role:
+
+* ``default``  - the application database, used by the management commands
+* ``readonly`` - the application database with a read-only session, used for LLM-generated SQL.
+  AWS_READONLY_DATABASE_SECRET_ID selects the credentials of a dedicated read-only login
+  and QA_DATABASE_ROLE an optional role switched to with SET ROLE (see schema/qa-readonly-role.sql).
+* ``vector``   - the pgvector database (``vectorDbIdentifier``), with the vector type
+  registered once per connection
+
+Connections are health checked after being idle, retired after a maximum lifetime, and the
+checkout count and wait time are exported as Prometheus metrics.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from decouple import config
+from pgvector.psycopg2 import register_vector
+from prometheus_client import Counter, Gauge, Histogram
+
+from retailstore.secrets_provider import get_secret, is_authentication_error
+
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Connections checked out of the pool', ['pool'])
+POOL_CONNECTS = Counter('db_pool_connects_total', 'New database connections opened by the pool', ['pool'])
+POOL_DISCARDS = Counter('db_pool_discards_total', 'Connections closed because they were broken, expired or failed a health check', ['pool', 'reason'])
+POOL_WAIT = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection', ['pool'],
+                      buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Connections currently checked out', ['pool'])
+POOL_IDLE = Gauge('db_pool_connections_idle', 'Open connections waiting in the pool', ['pool'])
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """A small thread-safe pool of psycopg2 connections.
+
+    `connect_kwargs` is a callable returning the keyword arguments for psycopg2.connect, so
+    credentials are looked up when a connection is opened rather than when the pool is created.
+    After an authentication failure it is called again with force_refresh=True to pick up a
+    rotated password.
+    `on_connect` runs once for every new connection (for example register_vector).
+    """
+
+    def __init__(self, name, connect_kwargs, maxconn=10, timeout=10, max_lifetime=1800,
+                 health_check_after=30, readonly=False, on_connect=None):
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.readonly = readonly
+        self.on_connect = on_connect
+
+        self._condition = threading.Condition()
+        # idle connections as (connection, created_at, returned_at), most recently used last
+        self._idle = []
+        self._created = {}
+        self._open = 0
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(connect_timeout=10, **self.connect_kwargs())
+        except psycopg2.OperationalError as e:
+            if not is_authentication_error(e):
+                raise
+            # The password was probably rotated: retry once with a freshly fetched secret
+            conn = psycopg2.connect(connect_timeout=10, **self.connect_kwargs(force_refresh=True))
+        conn.set_session(readonly=self.readonly, autocommit=True)
+        if self.on_connect:
+            self.on_connect(conn)
+        self._created[id(conn)] = time.monotonic()
+        POOL_CONNECTS.labels(self.name).inc()
+        return conn
+
+    def _discard(self, conn, reason):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        POOL_DISCARDS.labels(self.name, reason).inc()
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            while True:
+                while self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                    if time.monotonic() - created_at > self.max_lifetime:
+                        self._open -= 1
+                        self._discard(conn, 'expired')
+                    elif not self._is_healthy(conn, returned_at):
+                        self._open -= 1
+                        self._discard(conn, 'unhealthy')
+                    else:
+                        break
+                else:
+                    conn = None
+
+                if conn is None and self._open < self.maxconn:
+                    # Reserve the slot, then connect without holding the lock
+                    self._open += 1
+                    break
+                if conn is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout('No connection available in pool %r after %ss' % (self.name, self.timeout))
+                self._condition.wait(remaining)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._condition:
+                    self._open -= 1
+                    self._condition.notify()
+                raise
+
+        POOL_WAIT.labels(self.name).observe(time.monotonic() - started)
+        POOL_CHECKOUTS.labels(self.name).inc()
+        self._update_gauges()
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        with self._condition:
+            created_at = self._created.get(id(conn), 0)
+            if discard or conn.closed or time.monotonic() - created_at > self.max_lifetime:
+                self._open -= 1
+                self._discard(conn, 'broken' if discard or conn.closed else 'expired')
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._condition.notify()
+        self._update_gauges()
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out for the duration of a `with` block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except psycopg2.errors.QueryCanceled:
+            # statement_timeout or a cancel request; the connection itself is fine
+            self.putconn(conn)
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def close(self):
+        with self._condition:
+            for conn, _, _ in self._idle:
+                self._open -= 1
+                self._discard(conn, 'closed')
+            self._idle = []
+        self._update_gauges()
+
+    def stats(self):
+        with self._condition:
+            return {'open': self._open, 'idle': len(self._idle), 'in_use': self._open - len(self._idle), 'max': self.maxconn}
+
+    def _update_gauges(self):
+        stats = self.stats()
+        POOL_IN_USE.labels(self.name).set(stats['in_use'])
+        POOL_IDLE.labels(self.name).set(stats['idle'])
+
+
+def connect_kwargs(database, force_refresh=False):
+    """psycopg2.connect arguments for one of the pool names described at the top of this module"""
+    if database == 'readonly':
+        secret_id = config('AWS_READONLY_DATABASE_SECRET_ID', default=config('AWS_DATABASE_SECRET_ID'))
+    else:
+        secret_id = config('AWS_DATABASE_SECRET_ID')
+    database_secrets = get_secret(secret_id, force_refresh=force_refresh)
+    return {
+        'host': database_secrets['host'],
+        'port': database_secrets['port'],
+        'user': database_secrets['username'],
+        'password': database_secrets['password'],
+        'database': database_secrets['vectorDbIdentifier'] if database == 'vector' else database_secrets['name'],
+    }
+
+
+def connect(database):
+    """Open a standalone connection, for long-running jobs that should not hold a pooled one"""
+    try:
+        return psycopg2.connect(connect_timeout=10, **connect_kwargs(database))
+    except psycopg2.OperationalError as e:
+        if not is_authentication_error(e):
+            raise
+        return psycopg2.connect(connect_timeout=10, **connect_kwargs(database, force_refresh=True))
+
+
+def _setup_readonly(conn):
+    role = config('QA_DATABASE_ROLE', default='')
+    if role:
+        with conn.cursor() as cur:
+            cur.execute('SET ROLE ' + psycopg2.extensions.quote_ident(role, cur))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database):
+    """Return the process-wide pool for 'default', 'readonly' or 'vector'"""
+    with _pools_lock:
+        if database not in _pools:
+            options = {
+                'maxconn': config('DB_POOL_MAX_CONNECTIONS', default=10, cast=int),
+                'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+                'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800, cast=int),
+            }
+            if database == 'vector':
+                _pools[database] = ConnectionPool(database, functools.partial(connect_kwargs, 'vector'), on_connect=register_vector, **options)
+            elif database == 'readonly':
+                _pools[database] = ConnectionPool(database, functools.partial(connect_kwargs, 'readonly'), readonly=True, on_connect=_setup_readonly, **options)
+            elif database == 'default':
+                _pools[database] = ConnectionPool(database, functools.partial(connect_kwargs, 'default'), **options)
+            else:
+                raise ValueError('Unknown database pool %r' % database)
+        return _pools[database]
@@ -0,0 +1,118 @@
+"""Cached AWS Secrets Manager lookups shared by Django's DATABASES and the raw psycopg2 pools.
+
+Secrets are kept in memory for SECRETS_CACHE_TTL seconds. A background thread refreshes them
+shortly before they expire, so requests never wait on Secrets Manager, and callers that see an
+authentication failure ask for a forced refresh, which picks up a rotated password right away.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import boto3
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+SECRETS_CACHE_TTL = config('SECRETS_CACHE_TTL', default=300, cast=int)
+
+# Error text psycopg2 reports when a login is rejected (the SQLSTATE is not available before the connection exists)
+AUTHENTICATION_ERRORS = (
+    'password authentication failed',
+    'pam authentication failed',
+    'no password supplied',
+    'invalid_password',
+    '28p01',
+)
+
+
+def is_authentication_error(exc):
+    """True if a database error means the credentials were rejected, for example after a rotation"""
+    if getattr(exc, 'pgcode', None) in ('28P01', '28000'):
+        return True
+    message = str(exc).lower()
+    return any(text in message for text in AUTHENTICATION_ERRORS)
+
+
+class SecretsProvider:
+    def __init__(self, ttl=SECRETS_CACHE_TTL, refresh_ahead=None):
+        self.ttl = ttl
+        # Refresh this many seconds before expiry, so readers always find a fresh value
+        self.refresh_ahead = refresh_ahead if refresh_ahead is not None else max(ttl // 5, 1)
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+        self._secrets = {}
+        self._thread = None
+        self._thread_pid = None
+        self._client = None
+        self._client_pid = None
+
+    def _get_client(self):
+        # boto3 clients must not be shared across a fork, so each worker process gets its own
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = boto3.client('secretsmanager', region_name=config("AWS_DEFAULT_REGION"))
+            self._client_pid = os.getpid()
+        return self._client
+
+    def _fetch(self, secret_id):
+        response = self._get_client().get_secret_value(SecretId=secret_id)
+        value = json.loads(response['SecretString'])
+        with self._lock:
+            self._secrets[secret_id] = (value, time.monotonic() + self.ttl)
+        return value
+
+    def get(self, secret_id, force_refresh=False):
+        """Return the parsed JSON value of a secret, fetching it only when missing, expired or forced"""
+        self._ensure_refresher()
+        with self._lock:
+            cached = self._secrets.get(secret_id)
+            fetch_lock = self._fetch_locks.setdefault(secret_id, threading.Lock())
+        if cached and not force_refresh and cached[1] > time.monotonic():
+            return cached[0]
+
+        # Only one thread fetches a given secret; the others wait for its result
+        with fetch_lock:
+            with self._lock:
+                current = self._secrets.get(secret_id)
+            if current and current is not cached and current[1] > time.monotonic():
+                return current[0]
+            return self._fetch(secret_id)
+
+    def invalidate(self, secret_id=None):
+        with self._lock:
+            if secret_id is None:
+                self._secrets.clear()
+            else:
+                self._secrets.pop(secret_id, None)
+
+    def _ensure_refresher(self):
+        # Threads do not survive a fork, so a worker forked after the first lookup starts its own
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name='secrets-refresh', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(max(self.refresh_ahead / 2, 1))
+            with self._lock:
+                due = [secret_id for secret_id, (_, expires_at) in self._secrets.items()
+                       if expires_at - time.monotonic() <= self.refresh_ahead]
+            for secret_id in due:
+                try:
+                    self._fetch(secret_id)
+                except Exception:
+                    # Keep serving the cached value; the next lookup after expiry retries synchronously
+                    logger.exception('Background refresh of secret %s failed', secret_id)
+
+
+provider = SecretsProvider()
+
+
+def get_secret(secret_id, force_refresh=False):
+    return provider.get(secret_id, force_refresh=force_refresh)
@@ -13,8 +13,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 from pathlib import Path
 import os
 from decouple import config
-import boto3
-import json
+from retailstore.secrets_provider import get_secret
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
@@ -51,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'category',
     'accounts',
     'store',
@@ -96,12 +96,9 @@ AUTH_USER_MODEL = 'accounts.Account'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-# Initialize secrets manager
-secrets = boto3.client('secretsmanager', region_name=config("AWS_DEFAULT_REGION"))
-response = secrets.get_secret_value(
-    SecretId=config('AWS_DATABASE_SECRET_ID')
-)
-database_secrets = json.loads(response['SecretString'])
+# Database secrets are cached in memory and refreshed in the background (see retailstore/secrets_provider.py)
+# The same cached credentials back Django and the raw psycopg2 connection pools (retailstore/db_pool.py)
+database_secrets = get_secret(config('AWS_DATABASE_SECRET_ID'))
 
 dbhost = database_secrets['host']
 dbport = database_secrets['port']
@@ -110,9 +107,12 @@ dbpass = database_secrets['password']
 dbname = database_secrets['name']
 
 # RDS Aurora Postgres Configuration
+# The retailstore.db_backend engine re-reads USER/PASSWORD/HOST/PORT from SECRET_ID for every new
+# connection and retries once with a refreshed secret if the password was rotated
 DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': 'retailstore.db_backend',
+            'SECRET_ID': config('AWS_DATABASE_SECRET_ID'),
             'NAME': dbname,
             'USER': dbuser,
             'PASSWORD': dbpass,
@@ -121,6 +121,18 @@ DATABASES = {
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The default in-memory cache is per process. With several workers, set CACHE_BACKEND and CACHE_LOCATION to a
+# shared cache (for example django.core.cache.backends.db.DatabaseCache and a table created with createcachetable),
+# so that writes in one worker invalidate the Q&A results cached by the others (see store/result_cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -1,19 +1,27 @@
 from django.shortcuts import render
-from store.models import Product, ReviewRating
+from django.http import HttpResponse, HttpResponseForbidden
+from store.models import Product
+from store.conditional import catalog_page, listing_etag
+from decouple import config, Csv
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 
 
 
+@catalog_page(listing_etag)
 def home(request):
+    # The ratings shown on the product cards are stored on the products, so this is the only query
     products = Product.objects.all().filter(is_available=True).order_by('created_date')
 
-    # Get the reviews
-    reviews = None
-    for product in products:
-        reviews = ReviewRating.objects.filter(product_id=product.id, status=True)
-
     context = {
         'products': products,
-        'reviews': reviews,
     }
-    return render(request, 'home.html', context)
\ No newline at end of file
+    return render(request, 'home.html', context)
+
+def metrics(request):
+    # Prometheus metrics of this worker (connection pools, caches, LLM calls)
+    # Only served to staff users and to the addresses listed in METRICS_ALLOWED_IPS
+    allowed_ips = config('METRICS_ALLOWED_IPS', default='127.0.0.1', cast=Csv())
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'retailstore.settings')
 
 application = get_wsgi_application()
+
+# Build the search suggestion index of this worker in the background
+from store.suggestions import suggestion_index
+suggestion_index.start()
+
+# Build the facet index of this worker in the background
+from store.facets import facet_counts
+facet_counts.start()
@@ -0,0 +1,35 @@
+--
+-- Read-only role for the SQL generated by the question answering feature
+--
+-- Run once as the database owner. Then either:
+--   * store the qa_readonly_login credentials in a secret and set AWS_READONLY_DATABASE_SECRET_ID, or
+--   * grant qa_readonly to the application user and set QA_DATABASE_ROLE=qa_readonly
+-- The readonly connection pool (retailstore/db_pool.py) also opens every session as read only.
+--
+
+CREATE ROLE qa_readonly NOLOGIN;
+
+GRANT USAGE ON SCHEMA public TO qa_readonly;
+GRANT SELECT ON
+    accounts_account,
+    category_category,
+    orders_order,
+    orders_orderproduct,
+    orders_orderproduct_variations,
+    orders_payment,
+    store_product,
+    store_reviewrating,
+    store_variation,
+    analytics_daily_product_sales,
+    analytics_product_rating_stats,
+    analytics_category_rating_stats,
+    analytics_product_stock
+TO qa_readonly;
+
+-- Generated SQL must not see password hashes
+REVOKE SELECT ON accounts_account FROM qa_readonly;
+GRANT SELECT (id, first_name, last_name, username, email, phone_number, role, date_joined, last_login) ON accounts_account TO qa_readonly;
+
+-- Optional dedicated login for AWS_READONLY_DATABASE_SECRET_ID
+-- CREATE ROLE qa_readonly_login LOGIN PASSWORD '<password>' IN ROLE qa_readonly;
+-- ALTER ROLE qa_readonly_login SET default_transaction_read_only = on;
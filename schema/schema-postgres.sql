@@ -4,6 +4,78 @@
 
 -- Postgres database version - 15.3
 
+--
+-- Name: analytics_daily_product_sales; Type: MATERIALIZED VIEW;
+-- Precomputed sales of each product per day, from the order items of placed orders that were not cancelled.
+-- Use this view instead of aggregating orders_orderproduct for questions about sales, best-selling products and revenue.
+-- Refreshed after new orders, so it can lag the orders tables by a minute.
+--
+
+CREATE MATERIALIZED VIEW analytics_daily_product_sales (
+    id integer NOT NULL, -- row number, not meaningful
+    sale_date date NOT NULL, -- day the orders were placed, in UTC
+    product_id integer NOT NULL, -- foreign key of store_product.id
+    product_name character varying(200) NOT NULL,
+    category_id integer NOT NULL, -- foreign key of category_category.id
+    category_name character varying(100) NOT NULL, -- possible values: Dress, Pants, Jacket, Jeans, Shoes, Shirts
+    order_count integer NOT NULL, -- number of orders that included the product that day
+    units_sold integer NOT NULL, -- total quantity of the product sold that day
+    revenue double precision NOT NULL -- total of quantity * product_price for the product that day
+);
+
+--
+-- Name: analytics_product_rating_stats; Type: MATERIALIZED VIEW;
+-- Precomputed review statistics of each product, from the published reviews in store_reviewrating.
+-- Use this view instead of aggregating store_reviewrating for questions about ratings of products.
+-- Products without reviews have review_count 0 and null ratings.
+--
+
+CREATE MATERIALIZED VIEW analytics_product_rating_stats (
+    product_id integer NOT NULL, -- primary key, foreign key of store_product.id
+    product_name character varying(200) NOT NULL,
+    category_id integer NOT NULL, -- foreign key of category_category.id
+    category_name character varying(100) NOT NULL, -- possible values: Dress, Pants, Jacket, Jeans, Shoes, Shirts
+    review_count integer NOT NULL, -- number of reviews of the product
+    average_rating double precision, -- average rating of the product, between 1 and 5
+    min_rating double precision, -- lowest rating of the product
+    max_rating double precision, -- highest rating of the product
+    last_review_at timestamp with time zone -- when the product was last reviewed
+);
+
+--
+-- Name: analytics_category_rating_stats; Type: MATERIALIZED VIEW;
+-- Precomputed product and review counts and the average rating of each product category.
+-- Use this view for questions about ratings or number of products by category.
+--
+
+CREATE MATERIALIZED VIEW analytics_category_rating_stats (
+    category_id integer NOT NULL, -- primary key, foreign key of category_category.id
+    category_name character varying(100) NOT NULL, -- possible values: Dress, Pants, Jacket, Jeans, Shoes, Shirts
+    product_count integer NOT NULL, -- number of products in the category
+    reviewed_product_count integer NOT NULL, -- number of products in the category with at least one review
+    review_count integer NOT NULL, -- number of reviews of products in the category
+    average_rating double precision -- average rating of all reviews in the category, between 1 and 5
+);
+
+--
+-- Name: analytics_product_stock; Type: MATERIALIZED VIEW;
+-- Stock level and recent sales of each product.
+-- Use this view for questions about stock, products running low or selling fast.
+--
+
+CREATE MATERIALIZED VIEW analytics_product_stock (
+    product_id integer NOT NULL, -- primary key, foreign key of store_product.id
+    product_name character varying(200) NOT NULL,
+    category_id integer NOT NULL, -- foreign key of category_category.id
+    category_name character varying(100) NOT NULL, -- possible values: Dress, Pants, Jacket, Jeans, Shoes, Shirts
+    price integer NOT NULL, -- price of the product
+    stock integer NOT NULL, -- number of units in stock
+    is_available boolean NOT NULL, -- true if the product is available for sale
+    units_sold_last_30_days integer NOT NULL, -- units sold in the 30 days before refreshed_at
+    last_sold_at timestamp with time zone, -- when the product was last ordered
+    refreshed_at timestamp with time zone NOT NULL -- when the view was last refreshed
+);
+
 --
 -- Name: accounts_account; Type: TABLE;
 -- This table contains details about all accounts in the retail website - both retail managers as well as the customers
@@ -117,7 +189,15 @@ CREATE TABLE store_product (
     images character varying(100) NOT NULL,
     stock integer NOT NULL, -- stock column specifies how many of this product are in stock. 0 would mean the product is out of stock. 
     created_date timestamp with time zone NOT NULL,
-    category_id integer NOT NULL -- foreign key of the category_category.id
+    category_id integer NOT NULL, -- foreign key of the category_category.id
+    rating_count integer NOT NULL, -- number of published reviews of the product
+    rating_sum double precision NOT NULL, -- sum of the ratings of the published reviews
+    rating_average double precision NOT NULL, -- average rating of the published reviews, 0 if there are none
+    rating_1 integer NOT NULL, -- number of reviews rated 1 star or less
+    rating_2 integer NOT NULL, -- number of reviews rated 1.5 or 2 stars
+    rating_3 integer NOT NULL, -- number of reviews rated 2.5 or 3 stars
+    rating_4 integer NOT NULL, -- number of reviews rated 3.5 or 4 stars
+    rating_5 integer NOT NULL -- number of reviews rated 4.5 or 5 stars
 );
 
 --
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import Product
 from .models import Variation
-from .models import Product, ReviewRating, ProductGallery
+from .models import Product, ReviewRating, ProductGallery, DuplicateCluster, DuplicateListing, CachedQuestion, SqlExample, GenerationResult
 import admin_thumbnails
 
 # Register your models here.
@@ -21,7 +21,41 @@ class VariationAdmin(admin.ModelAdmin):
     list_editable = ('is_active',)
     list_filter = ('product','variation_category','variation_value')
 
+class DuplicateListingInline(admin.TabularInline):
+    model = DuplicateListing
+    readonly_fields = ('product_item_id', 'description', 'url', 'similarity')
+    extra = 0
+
+class DuplicateClusterAdmin(admin.ModelAdmin):
+    list_display = ('id', 'size', 'max_similarity', 'threshold', 'status', 'created_date')
+    list_editable = ('status',)
+    list_filter = ('status',)
+    ordering = ('-max_similarity',)
+    inlines = [DuplicateListingInline]
+
+class CachedQuestionAdmin(admin.ModelAdmin):
+    list_display = ('question', 'hit_count', 'embedding_backend', 'schema_version', 'modified_date')
+    search_fields = ('question', 'query')
+    readonly_fields = ('normalized_question', 'embedding', 'embedding_backend', 'schema_version', 'hit_count')
+
+class SqlExampleAdmin(admin.ModelAdmin):
+    list_display = ('question', 'source', 'is_active', 'times_used', 'modified_date')
+    list_editable = ('is_active',)
+    list_filter = ('source', 'is_active')
+    search_fields = ('question', 'query')
+    exclude = ('normalized_question',)
+
+class GenerationResultAdmin(admin.ModelAdmin):
+    list_display = ('product', 'feature', 'model_id', 'user', 'latency_ms', 'input_tokens', 'output_tokens', 'created_date')
+    list_filter = ('feature', 'model_id')
+    search_fields = ('product__product_name', 'output')
+    readonly_fields = ('prompt', 'parameters', 'model_id', 'latency_ms', 'input_tokens', 'output_tokens')
+
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Variation, VariationAdmin)
 admin.site.register(ReviewRating)
 admin.site.register(ProductGallery)
+admin.site.register(DuplicateCluster, DuplicateClusterAdmin)
+admin.site.register(CachedQuestion, CachedQuestionAdmin)
+admin.site.register(SqlExample, SqlExampleAdmin)
+admin.site.register(GenerationResult, GenerationResultAdmin)
@@ -0,0 +1,137 @@
+"""Refreshing the analytics materialized views used by the question answering feature.
+
+Migration 0009 creates materialized views with precomputed aggregates (daily sales per product,
+rating stats per product and per category, stock levels), so generated SQL for typical manager
+questions reads a few small relations instead of aggregating the order and review history. The
+views are described first in the schema context.
+
+Postgres cannot update a materialized view incrementally, so a refresh recomputes a whole view.
+It runs CONCURRENTLY, which keeps the view readable during the refresh, and only the views that
+read a changed table are refreshed:
+
+* After a write: saving or deleting an order, order item, product, category or review queues
+  the views reading that table (the signal handlers are connected in StoreConfig.ready). A
+  background thread refreshes them ANALYTICS_REFRESH_DELAY seconds (default 5) after the first
+  queued write, and at most once per ANALYTICS_MIN_REFRESH_INTERVAL seconds (default 60) per view,
+  so a burst of writes such as placing an order costs one refresh. Set
+  ANALYTICS_REFRESH_AFTER_WRITES=False to rely on the schedule only.
+* On a schedule: `python manage.py refresh_analytics` refreshes all views, for example from cron.
+
+Each refresh bumps the result cache version of the view, so cached Q&A results read from it are
+invalidated.
+"""
+import logging
+import threading
+import time
+
+from decouple import config
+from django.db import connection, transaction
+from prometheus_client import Histogram
+
+from .result_cache import bump_table_versions
+
+logger = logging.getLogger(__name__)
+
+# view -> tables it is computed from, in refresh order
+ANALYTICS_VIEWS = {
+    'analytics_daily_product_sales': {'orders_order', 'orders_orderproduct', 'store_product', 'category_category'},
+    'analytics_product_rating_stats': {'store_reviewrating', 'store_product', 'category_category'},
+    'analytics_category_rating_stats': {'store_reviewrating', 'store_product', 'category_category'},
+    'analytics_product_stock': {'orders_order', 'orders_orderproduct', 'store_product', 'category_category'},
+}
+
+REFRESH_AFTER_WRITES = config('ANALYTICS_REFRESH_AFTER_WRITES', default=True, cast=bool)
+REFRESH_DELAY = config('ANALYTICS_REFRESH_DELAY', default=5, cast=float)
+MIN_REFRESH_INTERVAL = config('ANALYTICS_MIN_REFRESH_INTERVAL', default=60, cast=float)
+
+VIEW_REFRESH = Histogram('analytics_view_refresh_seconds', 'Time to refresh an analytics materialized view', ['view'],
+                         buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+
+
+def source_tables():
+    return set().union(*ANALYTICS_VIEWS.values())
+
+
+def views_reading(tables):
+    """Names of the views computed from any of `tables`, in refresh order"""
+    tables = set(tables)
+    return [view for view, sources in ANALYTICS_VIEWS.items() if sources & tables]
+
+
+def refresh_views(views=None, concurrently=True):
+    """Refresh `views` (all by default). Returns {view: seconds taken}."""
+    views = [view for view in ANALYTICS_VIEWS if views is None or view in views]
+    timings = {}
+    for view in views:
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute('REFRESH MATERIALIZED VIEW ' + ('CONCURRENTLY ' if concurrently else '') + connection.ops.quote_name(view))
+        timings[view] = time.perf_counter() - started
+        VIEW_REFRESH.labels(view).observe(timings[view])
+    if views:
+        bump_table_versions(*views)
+    return timings
+
+
+class RefreshScheduler:
+    """Coalesces refresh requests and runs them on a background thread"""
+
+    def __init__(self, delay=REFRESH_DELAY, min_interval=MIN_REFRESH_INTERVAL):
+        self.delay = delay
+        self.min_interval = min_interval
+        self._condition = threading.Condition()
+        # view -> monotonic time it was first requested since its last refresh
+        self._pending = {}
+        self._refreshed_at = {}
+        self._thread = None
+
+    def request(self, views):
+        if not views:
+            return
+        with self._condition:
+            now = time.monotonic()
+            for view in views:
+                self._pending.setdefault(view, now)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='analytics-refresh', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _due_at(self, view):
+        return max(self._pending[view] + self.delay, self._refreshed_at.get(view, float('-inf')) + self.min_interval)
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._pending:
+                    now = time.monotonic()
+                    due = [view for view in self._pending if self._due_at(view) <= now]
+                    if due:
+                        for view in due:
+                            del self._pending[view]
+                            self._refreshed_at[view] = now
+                        return due
+                    self._condition.wait(min(self._due_at(view) for view in self._pending) - now)
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            views = self._next_batch()
+            try:
+                refresh_views(views)
+            except Exception:
+                logger.exception('Could not refresh the analytics views %s', ', '.join(views))
+            finally:
+                # This thread has its own database connection, which would otherwise stay open while idle
+                connection.close()
+
+
+_scheduler = RefreshScheduler()
+
+
+def schedule_analytics_refresh(sender, **kwargs):
+    """post_save / post_delete handler queueing a refresh of the views reading the sender's table"""
+    if REFRESH_AFTER_WRITES:
+        views = views_reading({sender._meta.db_table})
+        transaction.on_commit(lambda: _scheduler.request(views))
@@ -0,0 +1,121 @@
+"""Deterministic answers and PII masking for the question answering feature.
+
+Many questions have a result that needs no interpretation: one value (a count, a price, an
+average rating) or a short list of names. Those are answered from templates, which saves the
+second LLM call. Any other result falls through to the LLM.
+
+Personal data is masked before any result is shown or sent to the LLM. Values of the phone,
+email, address and IP columns are replaced with "<PII masked>", and so are email addresses,
+phone numbers and street addresses found in any other text.
+"""
+import datetime
+import decimal
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from decouple import config
+from prometheus_client import Counter
+
+PII_MASK = '<PII masked>'
+
+PII_COLUMNS = {'email', 'phone', 'phone_number', 'address_line_1', 'address_line_2', 'ip'}
+
+PII_PATTERNS = [
+    re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'),
+    re.compile(r'(?<![\w+])(?:\+\d{1,3}[\s.-]?)?\(?\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}(?!\w)'),
+    re.compile(r'\b\d{1,5}\s+(?:[A-Z][a-z]+\s+){1,3}(?:Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Lane|Ln|Drive|Dr|Court|Ct|Way|Place|Pl)\b\.?'),
+]
+
+# Lists longer than this are left to the LLM to summarize
+MAX_LIST_ITEMS = config('QA_TEMPLATE_MAX_LIST_ITEMS', default=10, cast=int)
+
+# Column names Postgres gives unnamed expressions, which say nothing about the value
+GENERIC_COLUMNS = {'?column?', 'count', 'sum', 'avg', 'min', 'max', 'round', 'coalesce'}
+
+ANSWERS = Counter('qa_answers_total', 'Answers given by ask_question, by how they were phrased', ['source'])
+
+
+@dataclass
+class ResultTable:
+    """A fully read query result, with the interface of GuardedResult"""
+    columns: List[str]
+    rows: List[tuple] = field(default_factory=list)
+    truncated: bool = False
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def mask_pii(text):
+    for pattern in PII_PATTERNS:
+        text = pattern.sub(PII_MASK, text)
+    return text
+
+
+def read_result(result):
+    """Read a query result into a ResultTable, masking personal data"""
+    pii = [column.lower() in PII_COLUMNS for column in result.columns]
+    rows = []
+    for row in result:
+        rows.append(tuple(
+            PII_MASK if is_pii and value is not None else mask_pii(value) if isinstance(value, str) else value
+            for value, is_pii in zip(row, pii)))
+    # truncated is only known once the rows have been read
+    return ResultTable(columns=list(result.columns), rows=rows, truncated=result.truncated)
+
+
+def format_number(value, decimals=2):
+    if isinstance(value, (float, decimal.Decimal)):
+        value = round(float(value), decimals)
+        if value == int(value):
+            value = int(value)
+    return '{:,}'.format(value) if isinstance(value, int) else str(value)
+
+
+def label(column):
+    return column.replace('_', ' ').strip()
+
+
+def scalar_answer(column, value):
+    name = column.lower()
+    generic = name in GENERIC_COLUMNS
+    if value is None:
+        return 'Sorry, I could not find that information.'
+    if isinstance(value, bool):
+        return 'Yes.' if value else 'No.'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        text = value.strftime('%B %d, %Y')
+        return text + '.' if generic else label(column).capitalize() + ': ' + text + '.'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        # Whole name parts only, so discount or account_id are not counts
+        if name == 'count' or name.endswith('_count') or name.startswith(('count_', 'num_', 'number_')):
+            return ('There is ' if value == 1 else 'There are ') + format_number(value) + '.'
+        if any(word in name for word in ('price', 'amount', 'paid', 'revenue', 'sales', 'order_total', 'tax')):
+            return 'The ' + label(column) + ' is $' + format_number(value) + '.'
+        if generic:
+            return 'The answer is ' + format_number(value) + '.'
+        return 'The ' + label(column) + ' is ' + format_number(value) + '.'
+    return str(value).strip() + '.'
+
+
+def list_answer(values):
+    values = [str(value).strip() for value in values]
+    if len(values) == 1:
+        return values[0] + '.'
+    return 'We have ' + ', '.join(values[:-1]) + ' and ' + values[-1] + '.'
+
+
+def template_answer(result):
+    """Answer for a ResultTable of a simple shape, or None if the LLM should phrase it"""
+    if result.truncated or not result.columns:
+        return None
+    if not result.rows:
+        return 'Sorry, that is not available in our store.'
+    if len(result.rows) == 1 and len(result.columns) == 1:
+        return scalar_answer(result.columns[0], result.rows[0][0])
+    if len(result.columns) == 1 and len(result.rows) <= MAX_LIST_ITEMS:
+        values = [row[0] for row in result.rows]
+        if all(isinstance(value, str) and value.strip() for value in values):
+            return list_answer(values)
+    return None
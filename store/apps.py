@@ -1,5 +1,54 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 
 
 class StoreConfig(AppConfig):
     name = 'store'
+
+    def ready(self):
+        from .schema_context import invalidate_schema_context
+        post_migrate.connect(invalidate_schema_context, dispatch_uid='store_invalidate_schema_context')
+
+        # Writes to the tables used by question answering invalidate the cached query results
+        from .result_cache import invalidate_model_results, tracked_models
+        for model in tracked_models():
+            uid = 'store_invalidate_results_' + model._meta.db_table
+            if model._meta.auto_created:
+                m2m_changed.connect(invalidate_model_results, sender=model, dispatch_uid=uid)
+            else:
+                post_save.connect(invalidate_model_results, sender=model, dispatch_uid=uid)
+                post_delete.connect(invalidate_model_results, sender=model, dispatch_uid=uid)
+
+        # Writes to the tables the analytics views are computed from queue a refresh of those views
+        from .analytics import schedule_analytics_refresh, source_tables
+        for model in tracked_models():
+            if model._meta.db_table in source_tables() and not model._meta.auto_created:
+                uid = 'store_refresh_analytics_' + model._meta.db_table
+                post_save.connect(schedule_analytics_refresh, sender=model, dispatch_uid=uid)
+                post_delete.connect(schedule_analytics_refresh, sender=model, dispatch_uid=uid)
+
+        # Keep the search suggestion index of this worker up to date
+        from .suggestions import category_changed, product_deleted, product_saved
+        post_save.connect(product_saved, sender='store.Product', dispatch_uid='store_suggestions_product_saved')
+        post_delete.connect(product_deleted, sender='store.Product', dispatch_uid='store_suggestions_product_deleted')
+        post_save.connect(category_changed, sender='category.Category', dispatch_uid='store_suggestions_category_saved')
+        post_delete.connect(category_changed, sender='category.Category', dispatch_uid='store_suggestions_category_deleted')
+
+        # Changes to a product or to what its pages show invalidate its cached template fragments
+        from . import fragment_cache
+        post_save.connect(fragment_cache.product_changed, sender='store.Product', dispatch_uid='store_fragments_product_saved')
+        post_delete.connect(fragment_cache.product_changed, sender='store.Product', dispatch_uid='store_fragments_product_deleted')
+        for label in ('store.Variation', 'store.ProductGallery', 'store.ReviewRating'):
+            uid = 'store_fragments_' + label.lower()
+            post_save.connect(fragment_cache.product_part_changed, sender=label, dispatch_uid=uid + '_saved')
+            post_delete.connect(fragment_cache.product_part_changed, sender=label, dispatch_uid=uid + '_deleted')
+        post_save.connect(fragment_cache.category_changed, sender='category.Category', dispatch_uid='store_fragments_category_saved')
+
+        # Keep the facet index of this worker up to date
+        from . import facets
+        post_save.connect(facets.product_saved, sender='store.Product', dispatch_uid='store_facets_product_saved')
+        post_delete.connect(facets.product_saved, sender='store.Product', dispatch_uid='store_facets_product_deleted')
+        post_save.connect(facets.variation_changed, sender='store.Variation', dispatch_uid='store_facets_variation_saved')
+        post_delete.connect(facets.variation_changed, sender='store.Variation', dispatch_uid='store_facets_variation_deleted')
+        post_save.connect(facets.category_changed, sender='category.Category', dispatch_uid='store_facets_category_saved')
+        post_delete.connect(facets.category_changed, sender='category.Category', dispatch_uid='store_facets_category_deleted')
@@ -0,0 +1,87 @@
+"""Conditional GET and HTTP caching for the catalog pages (home, store, search, product detail).
+
+Visitors without a session cookie are anonymous and have an empty cart, so the catalog pages
+they see only depend on the catalog. For them the views compute an ETag from version stamps
+that are already kept in the cache: the write versions of the product, variation and category
+tables for the listings (see store/result_cache.py), which the facet counts also depend on, and
+the product's version for its detail page (see store/fragment_cache.py). A request whose If-None-Match matches is answered 304 Not Modified
+without rendering anything.
+
+Listings served to these visitors are marked `public, max-age=CATALOG_PAGE_MAX_AGE` (default
+60) so CloudFront can cache them. The CloudFront cache policy of these paths must include the
+session cookie in the cache key, so signed-in visitors and visitors with a cart still reach the
+application; their pages are personal and marked `private`. Product detail pages contain forms
+with a CSRF token tied to the visitor's CSRF cookie, so they are only cached by the browser and
+their ETag includes that cookie.
+"""
+import hashlib
+from functools import wraps
+
+from decouple import config
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+CATALOG_PAGE_MAX_AGE = config('CATALOG_PAGE_MAX_AGE', default=60, cast=int)
+
+CATALOG_TABLES = ['category_category', 'store_product', 'store_variation']
+
+
+def has_session_cookie(request):
+    """Whether the visitor may be signed in, or have a cart or pending messages. Does not load the session."""
+    return settings.SESSION_COOKIE_NAME in request.COOKIES or 'messages' in request.COOKIES
+
+
+def _etag(*parts):
+    return hashlib.sha256(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+
+
+def listing_etag(request, *args, **kwargs):
+    """ETag of a product listing for an anonymous visitor, None for other visitors"""
+    from .result_cache import table_versions
+
+    if has_session_cookie(request):
+        return None
+    versions = table_versions(CATALOG_TABLES)
+    return _etag('listing', *[versions[table] for table in CATALOG_TABLES])
+
+
+def product_detail_etag(request, category_slug, product_slug):
+    """ETag of a product detail page for an anonymous visitor, None for other visitors"""
+    from .fragment_cache import product_version
+    from .models import Product
+    from .result_cache import table_versions
+
+    if has_session_cookie(request):
+        return None
+    product_id = Product.objects.filter(category__slug=category_slug, slug=product_slug).values_list('pk', flat=True).first()
+    if product_id is None:
+        return None
+    return _etag('product', product_id, product_version(product_id), table_versions(['category_category'])['category_category'],
+                 request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+
+
+def catalog_page(etag_func, shared=True):
+    """Answer conditional GETs of anonymous visitors with 304 Not Modified, and set Cache-Control
+
+    With shared=False, responses to anonymous visitors may only be cached by the browser.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            anonymous = not has_session_cookie(request)
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                return response
+            if anonymous and shared:
+                patch_cache_control(response, public=True, max_age=CATALOG_PAGE_MAX_AGE)
+            elif anonymous:
+                # Stored by the browser, and revalidated with the ETag on every visit
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
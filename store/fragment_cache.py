@@ -0,0 +1,97 @@
+"""Fragment cache for the product cards and the product detail sections.
+
+Templates wrap the parts of a page that only depend on one product in
+`{% productcache 'fragment name' product [vary_on ...] %}...{% endproductcache %}` (see
+store/templatetags/product_cache.py). The rendered HTML is cached under the fragment name, the
+product id, the product's version number and the optional vary_on values. Saving or deleting the
+product, one of its variations, gallery images or reviews, or renaming its category bumps the
+version (the signal handlers are connected in StoreConfig.ready), so a cached fragment is served
+until the product it shows changes, without rendering it or running the queries inside it.
+
+Writes that bypass model signals (QuerySet.update, bulk_update, raw SQL) must call
+bump_product_versions themselves. Fragments also expire after FRAGMENT_CACHE_TTL seconds
+(default 86400). Lookups are counted by fragment and result in store_fragment_cache_requests_total,
+so the hit ratio of a fragment is its hits over all its lookups, and the time to render a missed
+fragment is recorded in store_fragment_render_seconds. As with the question answering result
+cache, configure a shared cache in CACHES when running several workers.
+"""
+import hashlib
+import time
+
+from decouple import config
+from django.core.cache import cache
+from django.db import transaction
+from prometheus_client import Counter, Histogram
+
+FRAGMENT_CACHE_TTL = config('FRAGMENT_CACHE_TTL', default=86400, cast=int)
+
+FRAGMENT_CACHE_REQUESTS = Counter('store_fragment_cache_requests_total', 'Product fragment cache lookups',
+                                  ['fragment', 'result'])
+FRAGMENT_RENDER_SECONDS = Histogram('store_fragment_render_seconds', 'Time to render a product fragment missing from the cache',
+                                    ['fragment'], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+
+def _version_key(product_id):
+    return 'product-version:%s' % product_id
+
+
+def product_version(product_id):
+    key = _version_key(product_id)
+    version = cache.get(key)
+    if version is None:
+        # A version that was never set or was evicted starts from the clock, never from a value seen before
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_product_versions(*product_ids):
+    """Invalidate the cached fragments of the products, once the current transaction commits"""
+    def bump():
+        for product_id in product_ids:
+            key = _version_key(product_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def fragment_key(fragment, product_id, version, vary_on=()):
+    vary = hashlib.md5(':'.join(str(value) for value in vary_on).encode('utf-8')).hexdigest()
+    return 'product-fragment:%s:%s:%s:%s' % (fragment, product_id, version, vary)
+
+
+def cached_fragment(fragment, product_id, render, vary_on=()):
+    """The cached HTML of a fragment of the product, or the output of render() stored for next time"""
+    # The version is read before rendering, so a write during the render leaves the entry already stale
+    key = fragment_key(fragment, product_id, product_version(product_id), vary_on)
+    html = cache.get(key)
+    if html is not None:
+        FRAGMENT_CACHE_REQUESTS.labels(fragment, 'hit').inc()
+        return html
+
+    FRAGMENT_CACHE_REQUESTS.labels(fragment, 'miss').inc()
+    started = time.perf_counter()
+    html = render()
+    FRAGMENT_RENDER_SECONDS.labels(fragment).observe(time.perf_counter() - started)
+    cache.set(key, html, FRAGMENT_CACHE_TTL)
+    return html
+
+
+def product_changed(sender, instance, **kwargs):
+    """post_save / post_delete handler for Product"""
+    bump_product_versions(instance.pk)
+
+
+def product_part_changed(sender, instance, **kwargs):
+    """post_save / post_delete handler for Variation, ProductGallery and ReviewRating"""
+    bump_product_versions(instance.product_id)
+
+
+def category_changed(sender, instance, created=False, **kwargs):
+    """post_save handler for Category. The category slug is part of the product URLs on the cards."""
+    from .models import Product
+
+    if not created:
+        bump_product_versions(*Product.objects.filter(category=instance).values_list('pk', flat=True))
@@ -0,0 +1,108 @@
+"""Results of the GenAI features, kept in the GenerationResult table instead of the session.
+
+Each generated product description, review response, design idea and review summary is saved
+with the prompt, inference parameters and model it came from, how long the Bedrock call took
+and the token counts Bedrock reported for it. The session only holds the id of the result each
+feature page currently shows, {feature: id} under SESSION_KEY, so it stays a few bytes however
+long the generated text is. A feature page also lists the previous results for the same product
+(and review), and a manager can pick one of them again instead of paying for a new generation.
+Design ideas whose image was deleted from the product gallery are no longer shown or offered.
+
+Token counts are read from the x-amzn-bedrock-*-token-count headers of InvokeModel responses
+by a botocore event handler; track_token_usage() registers it on the Bedrock client.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from decouple import config
+
+SESSION_KEY = 'generations'
+HISTORY_SIZE = config('GENERATION_HISTORY_SIZE', default=10, cast=int)
+
+_usage = threading.local()
+
+
+def record_token_usage(http_response, **kwargs):
+    """botocore after-call handler for InvokeModel, adding up the token counts of the calls in measure_generation()"""
+    usage = getattr(_usage, 'current', None)
+    if usage is None:
+        return
+    for header, name in (('x-amzn-bedrock-input-token-count', 'input_tokens'),
+                         ('x-amzn-bedrock-output-token-count', 'output_tokens')):
+        count = http_response.headers.get(header)
+        if count is not None:
+            usage[name] = (usage[name] or 0) + int(count)
+
+
+def track_token_usage(client):
+    client.meta.events.register('after-call.bedrock-runtime.InvokeModel', record_token_usage,
+                                unique_id='store-generation-token-usage')
+
+
+@contextmanager
+def measure_generation():
+    """Measure the latency and token counts of the Bedrock calls made in the block, for save_generation()"""
+    usage = {'latency_ms': None, 'input_tokens': None, 'output_tokens': None}
+    _usage.current = usage
+    started = time.perf_counter()
+    try:
+        yield usage
+    finally:
+        usage['latency_ms'] = int((time.perf_counter() - started) * 1000)
+        _usage.current = None
+
+
+def save_generation(request, feature, product, model_id, output='', prompt='', parameters=None, inputs=None,
+                    review=None, image=None, usage=None):
+    """Save a result and make it the one the feature page shows"""
+    from .models import GenerationResult
+
+    generation = GenerationResult.objects.create(
+        product=product, review=review, feature=feature, model_id=model_id, output=output, prompt=prompt,
+        parameters=parameters or {}, inputs=inputs or {}, image=image or '',
+        user=request.user if request.user.is_authenticated else None, **(usage or {}))
+    show_generation(request, generation)
+    return generation
+
+
+def available_generations():
+    """GenerationResult rows that can be shown: text results, and images still in the product gallery"""
+    from django.db.models import Exists, OuterRef, Q
+
+    from .models import GenerationResult, ProductGallery
+
+    in_gallery = ProductGallery.objects.filter(product=OuterRef('product'), image=OuterRef('image'))
+    return GenerationResult.objects.filter(Q(image='') | Q(image__isnull=True) | Exists(in_gallery))
+
+
+def show_generation(request, generation):
+    shown = request.session.get(SESSION_KEY, {})
+    shown[generation.feature] = generation.id
+    request.session[SESSION_KEY] = shown
+
+
+def current_generation(request, feature, product, review=None):
+    """The result the feature page for `product` (and `review`) shows, or None"""
+    generation_id = request.session.get(SESSION_KEY, {}).get(feature)
+    if generation_id is None:
+        return None
+    return available_generations().filter(id=generation_id, feature=feature, product=product, review=review).first()
+
+
+def forget_generation(request, feature):
+    """Stop showing a result on the feature page, so it offers a new generation"""
+    shown = request.session.get(SESSION_KEY, {})
+    if feature in shown:
+        del shown[feature]
+        request.session[SESSION_KEY] = shown
+
+
+def forget_generations(request):
+    if SESSION_KEY in request.session:
+        del request.session[SESSION_KEY]
+
+
+def previous_generations(feature, product, review=None, limit=HISTORY_SIZE):
+    return (available_generations().filter(feature=feature, product=product, review=review)
+            .select_related('user').order_by('-created_date')[:limit])
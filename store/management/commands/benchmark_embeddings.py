@@ -0,0 +1,58 @@
+import os
+import time
+
+import numpy as np
+from decouple import config
+from django.core.management.base import BaseCommand
+
+from utils import bedrock
+from utils.embeddings import available_backends, get_embedding_backend
+
+SAMPLE_QUERIES = [
+    "red dress for a wedding",
+    "floral prints",
+    "black leather jacket",
+    "slim fit blue jeans",
+    "white sneakers",
+    "summer dress with short sleeves",
+    "warm winter coat with hood",
+    "striped cotton shirt",
+    "high waisted pants",
+    "elegant evening gown",
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare load time, query latency and batch throughput of the embedding backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', choices=available_backends(), default=available_backends())
+        parser.add_argument('--queries', type=int, default=50, help='Single-query calls timed per backend')
+        parser.add_argument('--documents', type=int, default=1000, help='Texts embedded in the throughput test')
+
+    def handle(self, *args, **options):
+        boto3_bedrock = None
+        if 'bedrock' in options['backends']:
+            boto3_bedrock = bedrock.get_bedrock_client(assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None), region=config("AWS_DEFAULT_REGION"))
+
+        documents = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] + " " + str(i) for i in range(options['documents'])]
+
+        self.stdout.write('%-10s %10s %10s %10s %10s %14s' % ('backend', 'load s', 'p50 ms', 'p95 ms', 'p99 ms', 'docs/second'))
+        for name in options['backends']:
+            started = time.perf_counter()
+            backend = get_embedding_backend(name, client=boto3_bedrock)
+            backend.embed_query("warm up")
+            load_time = time.perf_counter() - started
+
+            latencies = []
+            for i in range(options['queries']):
+                started = time.perf_counter()
+                backend.embed_query(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)])
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            backend.embed_documents(documents)
+            throughput = len(documents) / (time.perf_counter() - started)
+
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            self.stdout.write('%-10s %10.2f %10.2f %10.2f %10.2f %14.1f' % (name, load_time, p50, p95, p99, throughput))
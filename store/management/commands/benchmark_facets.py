@@ -0,0 +1,138 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Lower
+
+from category.models import Category
+from store.facets import FACETS, PRICE_RANGES, FacetIndex, filter_products, load_facet_products
+from store.models import Product, Variation
+
+# Synthetic catalog vocabulary
+BRANDS = ['brand %d' % i for i in range(40)]
+COLORS = ['black', 'blue', 'red', 'green', 'white', 'grey', 'navy', 'beige', 'olive', 'pink']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+
+SELECTIONS = [
+    {},
+    {'color': ['blue']},
+    {'color': ['blue', 'red'], 'size': ['m']},
+    {'brand': ['brand 7'], 'price': ['50-100']},
+    {'brand': ['brand 3', 'brand 12'], 'color': ['black', 'navy'], 'size': ['l', 'xl'], 'price': ['100-200']},
+]
+
+INSERT_PRODUCTS = """
+INSERT INTO store_product (product_name, product_brand, slug, description, price, images, stock, is_available,
+                           category_id, created_date, modified_date, review_summary,
+                           rating_count, rating_sum, rating_average, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT 'Benchmark Product ' || i, (%s::text[])[1 + (i * 7) %% %s], 'benchmark-' || i, '',
+       5 + (i * 37) %% 295, 'photos/products/benchmark.jpg', i %% 50, true,
+       %s, now(), now(), '',
+       0, 0, 0, 0, 0, 0, 0, 0
+FROM generate_series(1, %s) AS i
+"""
+
+# One to three colors and two to four sizes per product
+INSERT_VARIATIONS = """
+INSERT INTO store_variation (product_id, variation_category, variation_value, is_active, created_date)
+SELECT p.id, 'color', (%s::text[])[1 + (p.id + n * 3) %% %s], true, now()
+FROM store_product p, generate_series(0, 2) AS n
+WHERE p.category_id = %s AND n <= p.id %% 3
+UNION ALL
+SELECT p.id, 'size', (%s::text[])[1 + (p.id / 5 + n) %% %s], true, now()
+FROM store_product p, generate_series(0, 3) AS n
+WHERE p.category_id = %s AND n <= 1 + p.id %% 3
+"""
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare the facet counts of the in-memory bitset index with GROUP BY queries. '
+            'The synthetic products are inserted in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000, help='Number of synthetic products')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per selection, the median and p95 are reported')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The facet benchmark needs Postgres')
+        try:
+            with transaction.atomic():
+                category = Category.objects.create(category_name='Benchmark', slug='benchmark')
+                self.insert_products(category.id, options['size'])
+                self.stdout.write('%d benchmark products' % options['size'])
+
+                started = time.perf_counter()
+                products, labels = load_facet_products()
+                loaded = time.perf_counter()
+                index = FacetIndex.build(products, labels)
+                built = time.perf_counter()
+                size = index.live.nbytes + sum(matrix.nbytes for matrix in index.matrices.values())
+                self.stdout.write('index: %d products, load %.0f ms, build %.0f ms, %.1f kB of bitsets'
+                                  % (len(index.positions), (loaded - started) * 1000, (built - loaded) * 1000, size / 1024))
+
+                self.stdout.write('')
+                self.stdout.write('%-60s %10s %12s %12s %12s %12s' % ('selection', 'matches', 'sql ms', 'sql p95',
+                                                                      'index ms', 'index p95'))
+                for selection in SELECTIONS:
+                    self.measure(index, selection, options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def insert_products(self, category_id, size):
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_PRODUCTS, [BRANDS, len(BRANDS), category_id, size])
+            cursor.execute(INSERT_VARIATIONS, [COLORS, len(COLORS), category_id, SIZES, len(SIZES), category_id])
+            cursor.execute('ANALYZE store_product')
+            cursor.execute('ANALYZE store_variation')
+
+    def measure(self, index, selection, repeat):
+        sql_counts, matches = self.sql_counts(selection)
+        index_counts, index_matches = index.counts(selection)
+        if (sql_counts, matches) != ({facet: {key: count for key, count in counts.items() if count}
+                                      for facet, counts in index_counts.items()}, index_matches):
+            raise CommandError('The index and the GROUP BY queries disagree for %s' % selection)
+
+        sql = self.timings_ms(lambda: self.sql_counts(selection), max(1, repeat // 4))
+        indexed = self.timings_ms(lambda: index.counts(selection), repeat)
+        name = ' '.join('%s=%s' % (facet, ','.join(keys)) for facet, keys in selection.items()) or '(none)'
+        self.stdout.write('%-60s %10d %12.2f %12.2f %12.3f %12.3f' % (name, matches, statistics.median(sql), self.p95(sql),
+                                                                     statistics.median(indexed), self.p95(indexed)))
+
+    def sql_counts(self, selection):
+        """The counts of FacetIndex.counts, with one GROUP BY query per facet"""
+        products = Product.objects.filter(is_available=True)
+        counts = {}
+        for facet, _ in FACETS:
+            others = filter_products(products, {other: keys for other, keys in selection.items() if other != facet})
+            if facet == 'brand':
+                rows = others.values_list(Lower('product_brand')).annotate(count=Count('id')).order_by()
+            elif facet == 'price':
+                aggregates = {}
+                for low, high in PRICE_RANGES:
+                    prices = Q(price__gte=low) & Q(price__lt=high) if high else Q(price__gte=low)
+                    aggregates['%d-%s' % (low, high or '')] = Count('id', filter=prices)
+                rows = others.aggregate(**aggregates).items()
+            else:
+                rows = (Variation.objects.filter(product__in=others, variation_category=facet, is_active=True)
+                        .values_list(Lower('variation_value')).annotate(count=Count('product_id', distinct=True)).order_by())
+            counts[facet] = {key: count for key, count in rows if count}
+        return counts, filter_products(products, selection).count()
+
+    def timings_ms(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def p95(self, timings):
+        return sorted(timings)[min(len(timings) - 1, int(len(timings) * 0.95))]
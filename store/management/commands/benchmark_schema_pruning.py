@@ -0,0 +1,131 @@
+import os
+import re
+import time
+from decimal import Decimal
+
+from decouple import config
+from django.core.management.base import BaseCommand
+from langchain import PromptTemplate
+from langchain.llms.bedrock import Bedrock
+
+from store.result_serializer import estimate_tokens
+from store.schema_context import get_schema_context
+from store.schema_pruning import SchemaIndex
+from store.sql_guard import run_guarded_query
+from utils import bedrock
+from utils.embeddings import available_backends, get_embedding_backend
+
+# Questions with a hand-written query giving the expected answer
+QUESTIONS = [
+    ("How many products are in stock?",
+     "SELECT count(*) FROM store_product WHERE stock > 0"),
+    ("What is the price of the most expensive product?",
+     "SELECT max(price) FROM store_product"),
+    ("How many product categories are there?",
+     "SELECT count(*) FROM category_category"),
+    ("How many jackets do you have?",
+     "SELECT count(*) FROM store_product p JOIN category_category c ON c.id = p.category_id WHERE upper(c.category_name) LIKE upper('%jacket%')"),
+    ("What is the average rating of all reviews?",
+     "SELECT avg(rating) FROM store_reviewrating"),
+    ("How many orders have been placed?",
+     "SELECT count(*) FROM orders_order WHERE is_ordered"),
+    ("Which sizes are available?",
+     "SELECT DISTINCT variation_value FROM store_variation WHERE variation_category = 'size' AND is_active"),
+    ("How many customers have an account?",
+     "SELECT count(*) FROM accounts_account WHERE role = 'Customer'"),
+    ("What is the total quantity of products ordered?",
+     "SELECT sum(quantity) FROM orders_orderproduct WHERE ordered"),
+    ("Which product has the most reviews?",
+     "SELECT p.product_name FROM store_product p JOIN store_reviewrating r ON r.product_id = p.id GROUP BY p.product_name ORDER BY count(*) DESC LIMIT 1"),
+]
+
+# Same SQL generation prompt as ask_question
+PROMPT_TEMPLATE = """
+            Human: Create an Postgres SQL query for a retail website to answer the question keeping the following rules in mind:
+
+            1. Database is implemented in Postgres SQL.
+            2. Follow the Postgres syntax carefully while generating the query.
+            3. Enclose the query in <query></query>.
+            4. Use "like" and upper() for string comparison on both left hand side and right hand side of the expression. For example, if the query contains "jackets", use "where upper(product_name) like upper('%jacket%')".
+            5. Do not use upper() on integer or non-string or non-varchar table columns!
+            6. If the question is generic, like "where is mount everest" or "who went to the moon first", then do not generate any query in <query></query> and do not answer the question in any form. Instead, mention that the answer is not found in context.
+            7. If the question is not related to the schema, then do not generate any query in <query></query> and do not answer the question in any form. Instead, mention that the answer is not found in context.
+            8. If the question is asked in a language other than English, convert the question into English before constructing the SQL query. The string and varchar table columns in the database are always in English.
+
+            <schema>
+                {schema}
+            </schema>
+
+            Question: {question}
+
+            Assistant:
+
+            """
+
+
+def comparable_rows(rows):
+    """Result rows in a form where equal answers compare equal, whatever the column order or numeric type"""
+    normalized = []
+    for row in rows:
+        values = []
+        for value in row:
+            if isinstance(value, (float, Decimal)):
+                value = round(float(value), 2)
+            values.append(str(value))
+        normalized.append(tuple(sorted(values)))
+    return sorted(normalized)
+
+
+def run_query(query):
+    with run_guarded_query(query) as result:
+        return comparable_rows(result)
+
+
+class Command(BaseCommand):
+    help = 'Compare prompt size, latency and answer accuracy of text-to-SQL prompts with the full and the pruned schema'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=available_backends(), default=config('EMBEDDING_BACKEND', default='bedrock'),
+                            help='Embedding backend used to rank the schema tables')
+        parser.add_argument('--no-llm', action='store_true', help='Only compare prompt sizes, without calling the LLM')
+
+    def handle(self, *args, **options):
+        boto3_bedrock = bedrock.get_bedrock_client(assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None), region=config("AWS_DEFAULT_REGION"))
+        schema_index = SchemaIndex(get_embedding_backend(options['backend'], client=boto3_bedrock))
+        schema_context = get_schema_context()
+        prompt_vars = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["question", "schema"])
+        llm = None if options['no_llm'] else Bedrock(model_id="anthropic.claude-instant-v1", client=boto3_bedrock)
+
+        totals = {mode: {'tokens': 0, 'seconds': 0.0, 'correct': 0} for mode in ('full', 'pruned')}
+        self.stdout.write('%-50s %-6s %8s %8s %8s' % ('question', 'schema', 'tokens', 'llm s', 'correct'))
+        for question, reference_query in QUESTIONS:
+            expected = None if llm is None else run_query(reference_query)
+            for mode in ('full', 'pruned'):
+                schema = schema_context.text if mode == 'full' else schema_index.schema_for(question, schema_context)
+                prompt = prompt_vars.format(question=question, schema=schema)
+                tokens = estimate_tokens(prompt)
+                totals[mode]['tokens'] += tokens
+                if llm is None:
+                    self.stdout.write('%-50s %-6s %8d' % (question[:50], mode, tokens))
+                    continue
+
+                started = time.perf_counter()
+                llm_response = llm(prompt)
+                seconds = time.perf_counter() - started
+                match = re.search(r'<query>(.*?)</query>', llm_response, re.DOTALL | re.IGNORECASE)
+                try:
+                    correct = match is not None and run_query(match.group(1)) == expected
+                except Exception as e:
+                    self.stderr.write('%s (%s): %s' % (question, mode, e))
+                    correct = False
+                totals[mode]['seconds'] += seconds
+                totals[mode]['correct'] += int(correct)
+                self.stdout.write('%-50s %-6s %8d %8.2f %8s' % (question[:50], mode, tokens, seconds, 'yes' if correct else 'no'))
+
+        self.stdout.write('')
+        count = len(QUESTIONS)
+        for mode, total in totals.items():
+            line = '%-6s average prompt tokens %d' % (mode, total['tokens'] / count)
+            if llm is not None:
+                line += ', average LLM latency %.2fs, accuracy %d/%d' % (total['seconds'] / count, total['correct'], count)
+            self.stdout.write(line)
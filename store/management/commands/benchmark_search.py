@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from category.models import Category
+from store.models import Product
+from store.search import search_products
+
+# Synthetic catalog vocabulary
+COLORS = ['black', 'blue', 'red', 'green', 'white', 'grey', 'navy', 'beige', 'olive', 'pink']
+MATERIALS = ['cotton', 'denim', 'leather', 'linen', 'wool', 'silk', 'suede', 'fleece']
+KINDS = ['jacket', 'jeans', 'dress', 'shirt', 'pants', 'shoes', 'sweater', 'skirt', 'coat', 'sneakers']
+FITS = ['slim fit', 'regular fit', 'relaxed fit', 'oversized', 'cropped', 'tailored']
+
+KEYWORDS = ['jacket', 'blue denim jeans', 'leather', 'slim fit shirt', 'jackt', 'sneakrs']
+
+INSERT_PRODUCTS = """
+INSERT INTO store_product (product_name, product_brand, slug, description, price, images, stock, is_available,
+                           category_id, created_date, modified_date, review_summary,
+                           rating_count, rating_sum, rating_average, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT initcap(c.word) || ' ' || initcap(m.word) || ' ' || initcap(k.word) || ' ' || i,
+       'benchmark',
+       'benchmark-' || i,
+       'A ' || f.word || ' ' || k.word || ' in ' || c.word || ' ' || m.word || ', item number ' || i || '.',
+       10 + i %% 190, 'photos/products/benchmark.jpg', i %% 50, true,
+       %s, now() - i * interval '1 minute', now(), '',
+       0, 0, 0, 0, 0, 0, 0, 0
+FROM generate_series(%s, %s) AS i,
+     LATERAL (SELECT (%s::text[])[1 + i %% %s] AS word) c,
+     LATERAL (SELECT (%s::text[])[1 + (i / 7) %% %s] AS word) m,
+     LATERAL (SELECT (%s::text[])[1 + (i / 13) %% %s] AS word) k,
+     LATERAL (SELECT (%s::text[])[1 + (i / 17) %% %s] AS word) f
+"""
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare the substring search with the full-text and trigram search at several catalog sizes. '
+            'The synthetic products are inserted in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='Catalog sizes to measure')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query, the median is reported')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The search benchmark needs Postgres')
+        try:
+            with transaction.atomic():
+                category = Category.objects.create(category_name='Benchmark', slug='benchmark')
+                inserted = 0
+                for size in sorted(options['sizes']):
+                    self.insert_products(category.id, inserted + 1, size)
+                    inserted = size
+                    self.stdout.write('')
+                    self.stdout.write('%d benchmark products' % size)
+                    self.stdout.write('%-20s %-10s %10s %12s %12s' % ('keyword', 'search', 'matches', 'page ms', 'count ms'))
+                    for keyword in KEYWORDS:
+                        self.measure(keyword, options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def insert_products(self, category_id, first, last):
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_PRODUCTS, [category_id, first, last, COLORS, len(COLORS), MATERIALS, len(MATERIALS),
+                                             KINDS, len(KINDS), FITS, len(FITS)])
+            cursor.execute('ANALYZE store_product')
+
+    def measure(self, keyword, repeat):
+        products = Product.objects.all()
+        substring = products.filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
+        indexed, ordering, mode = search_products(products, keyword)
+        for name, queryset, order in (('substring', substring, ('-created_date', '-id')), (mode, indexed, ordering)):
+            page = self.median_ms(lambda: list(queryset.order_by(*order)[:7]), repeat)
+            count_started = time.perf_counter()
+            matches = queryset.count()
+            count = (time.perf_counter() - count_started) * 1000
+            self.stdout.write('%-20s %-10s %10d %12.2f %12.2f' % (keyword, name, matches, page, count))
+
+    def median_ms(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
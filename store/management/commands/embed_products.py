@@ -0,0 +1,84 @@
+import os
+import time
+
+from decouple import config
+from django.core.management.base import BaseCommand
+from pgvector.psycopg2 import register_vector
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from retailstore.db_pool import connect
+from utils import bedrock
+from utils.embeddings import available_backends, get_embedding_backend
+
+
+class Command(BaseCommand):
+    help = 'Embed the vector_products catalog descriptions with an embedding backend and store them in that backend\'s vector table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=available_backends(), default=config('EMBEDDING_BACKEND', default='bedrock'))
+        parser.add_argument('--batch-size', type=int, default=500, help='Listings read, embedded and written per round')
+        parser.add_argument('--only-missing', action='store_true', help='Skip listings that already have an embedding in the backend table')
+
+    def handle(self, *args, **options):
+        boto3_bedrock = None
+        if options['backend'] == 'bedrock':
+            boto3_bedrock = bedrock.get_bedrock_client(assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None), region=config("AWS_DEFAULT_REGION"))
+        backend = get_embedding_backend(options['backend'], client=boto3_bedrock)
+        table = sql.Identifier(backend.index_table)
+
+        # Standalone connections: this job holds them for minutes and should not occupy pooled ones
+        dbconn = connect('vector')
+        dbconn.set_session(autocommit=True)
+        register_vector(dbconn)
+        write_cur = dbconn.cursor()
+
+        in_place = backend.index_table == 'vector_products'
+        if not in_place:
+            write_cur.execute(sql.SQL("""CREATE TABLE IF NOT EXISTS {} (
+                                    id integer PRIMARY KEY,
+                                    url text,
+                                    description text,
+                                    descriptions_embeddings vector({}));""").format(table, sql.Literal(backend.dimension)))
+
+        if options['only_missing'] and in_place:
+            source_query = sql.SQL("SELECT id, url, description FROM vector_products WHERE descriptions_embeddings IS NULL ORDER BY id;")
+        elif options['only_missing']:
+            source_query = sql.SQL("""SELECT p.id, p.url, p.description FROM vector_products p
+                                   WHERE NOT EXISTS (SELECT 1 FROM {} t WHERE t.id = p.id) ORDER BY p.id;""").format(table)
+        else:
+            source_query = sql.SQL("SELECT id, url, description FROM vector_products ORDER BY id;")
+
+        # A separate connection streams the source rows while the first one writes
+        read_conn = connect('vector')
+        started = time.monotonic()
+        total = 0
+        try:
+            with read_conn.cursor(name='embed_products') as read_cur:
+                read_cur.itersize = options['batch_size']
+                read_cur.execute(source_query)
+                while True:
+                    rows = read_cur.fetchmany(options['batch_size'])
+                    if not rows:
+                        break
+                    vectors = backend.embed_documents([description or '' for _, _, description in rows])
+                    if in_place:
+                        execute_values(write_cur,
+                                       """UPDATE vector_products AS p SET descriptions_embeddings = v.embedding
+                                       FROM (VALUES %s) AS v (id, embedding) WHERE p.id = v.id;""",
+                                       [(row[0], vector) for row, vector in zip(rows, vectors)],
+                                       template='(%s, %s::vector)')
+                    else:
+                        execute_values(write_cur,
+                                       sql.SQL("""INSERT INTO {} (id, url, description, descriptions_embeddings) VALUES %s
+                                               ON CONFLICT (id) DO UPDATE SET url = EXCLUDED.url, description = EXCLUDED.description,
+                                               descriptions_embeddings = EXCLUDED.descriptions_embeddings;""").format(table).as_string(write_cur),
+                                       [(row[0], row[1], row[2], vector) for row, vector in zip(rows, vectors)])
+                    total += len(rows)
+                    self.stdout.write('Embedded %d listings (%.1f per second)' % (total, total / (time.monotonic() - started)))
+        finally:
+            read_conn.close()
+            write_cur.close()
+            dbconn.close()
+
+        self.stdout.write(self.style.SUCCESS('Stored %d %s embeddings in %s' % (total, backend.name, backend.index_table)))
@@ -0,0 +1,132 @@
+import time
+
+import numpy as np
+from decouple import config
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from pgvector.psycopg2 import register_vector
+from psycopg2 import sql
+
+from retailstore.db_pool import connect
+from store.models import DuplicateCluster, DuplicateListing
+from utils.embeddings import BACKEND_CLASSES, available_backends
+from utils.similarity import cluster_pairs, iter_similar_pairs, normalize_rows
+
+
+class Command(BaseCommand):
+    help = 'Find near-duplicate listings in the product vector table and save them as duplicate clusters for review in the admin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=available_backends(), default=config('EMBEDDING_BACKEND', default='bedrock'),
+                            help='Embedding backend whose vector table is scanned')
+        parser.add_argument('--threshold', type=float, default=0.95, help='Minimum cosine similarity for two listings to be duplicates')
+        parser.add_argument('--method', choices=['blocked', 'ann'], default='blocked',
+                            help='blocked: exact tiled matrix multiplication in NumPy. ann: self-join through the pgvector index, for very large catalogs')
+        parser.add_argument('--block-size', type=int, default=2048, help='Rows per tile for the blocked method')
+        parser.add_argument('--neighbors', type=int, default=10, help='Nearest neighbors fetched per listing for the ann method')
+        parser.add_argument('--fetch-size', type=int, default=5000, help='Rows fetched per round trip from the vector database')
+        parser.add_argument('--keep-existing', action='store_true', help='Keep clusters that are still New from previous runs')
+
+    def handle(self, *args, **options):
+        threshold = options['threshold']
+        if not 0 < threshold <= 1:
+            raise CommandError('--threshold must be in (0, 1]')
+
+        # A standalone connection: this job holds it for minutes and should not occupy a pooled one
+        dbconn = connect('vector')
+        register_vector(dbconn)
+
+        table = sql.Identifier(BACKEND_CLASSES[options['backend']].index_table)
+        started = time.monotonic()
+        try:
+            ids, descriptions, urls, embeddings = self.load_embeddings(dbconn, table, options['fetch_size'])
+            self.stdout.write('Loaded %d embeddings in %.1fs' % (len(ids), time.monotonic() - started))
+
+            if options['method'] == 'ann':
+                pairs = self.ann_pairs(dbconn, table, ids, threshold, options['neighbors'])
+            else:
+                pairs = self.blocked_pairs(embeddings, threshold, options['block_size'])
+        finally:
+            dbconn.close()
+
+        self.stdout.write('Found %d similar pairs in %.1fs' % (len(pairs), time.monotonic() - started))
+
+        clusters = cluster_pairs(pairs.keys())
+        best_score = {}
+        for (a, b), score in pairs.items():
+            best_score[a] = max(best_score.get(a, 0.0), score)
+            best_score[b] = max(best_score.get(b, 0.0), score)
+
+        with transaction.atomic():
+            if not options['keep_existing']:
+                DuplicateCluster.objects.filter(status='New').delete()
+            listings = []
+            for members in clusters:
+                cluster = DuplicateCluster.objects.create(
+                    threshold=threshold,
+                    max_similarity=max(best_score[i] for i in members),
+                    size=len(members),
+                )
+                for i in members:
+                    listings.append(DuplicateListing(
+                        cluster=cluster,
+                        product_item_id=ids[i],
+                        description=descriptions[i],
+                        url=urls[i],
+                        similarity=best_score[i],
+                    ))
+            DuplicateListing.objects.bulk_create(listings, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS('Saved %d duplicate clusters in %.1fs' % (len(clusters), time.monotonic() - started)))
+
+    def load_embeddings(self, dbconn, table, fetch_size):
+        # Preallocate a single float32 matrix and stream rows into it, so memory stays at n x d x 4 bytes
+        with dbconn.cursor() as cur:
+            cur.execute(sql.SQL("SELECT count(*), max(vector_dims(descriptions_embeddings)) FROM {} WHERE descriptions_embeddings IS NOT NULL;").format(table))
+            count, dims = cur.fetchone()
+        embeddings = np.zeros((count, dims or 0), dtype=np.float32)
+        ids, descriptions, urls = [], [], []
+
+        with dbconn.cursor(name='find_duplicates') as cur:
+            cur.itersize = fetch_size
+            cur.execute(sql.SQL("""SELECT id, description, url, descriptions_embeddings FROM {}
+                        WHERE descriptions_embeddings IS NOT NULL ORDER BY id;""").format(table))
+            for row_number, (product_item_id, description, url, embedding) in enumerate(cur):
+                if row_number >= count:
+                    break
+                ids.append(product_item_id)
+                descriptions.append(description or '')
+                urls.append((url or '').split('?')[0])
+                embeddings[row_number] = embedding
+
+        return ids, descriptions, urls, normalize_rows(embeddings[:len(ids)])
+
+    def blocked_pairs(self, embeddings, threshold, block_size):
+        pairs = {}
+        for rows, cols, scores in iter_similar_pairs(embeddings, threshold, block_size):
+            for a, b, score in zip(rows.tolist(), cols.tolist(), scores.tolist()):
+                pairs[(a, b)] = score
+        return pairs
+
+    def ann_pairs(self, dbconn, table, ids, threshold, neighbors):
+        # Each listing asks the pgvector index for its nearest neighbors by cosine distance,
+        # so the cost grows with n x neighbors instead of n x n
+        position = {product_item_id: i for i, product_item_id in enumerate(ids)}
+        pairs = {}
+        with dbconn.cursor(name='find_duplicates_ann') as cur:
+            cur.itersize = 5000
+            cur.execute(sql.SQL("""SELECT a.id, b.id, 1 - b.distance
+                        FROM {table} a
+                        CROSS JOIN LATERAL (
+                            SELECT n.id, n.descriptions_embeddings <=> a.descriptions_embeddings AS distance
+                            FROM {table} n
+                            WHERE n.id <> a.id
+                            ORDER BY n.descriptions_embeddings <=> a.descriptions_embeddings
+                            LIMIT %s
+                        ) b
+                        WHERE 1 - b.distance >= %s;""").format(table=table), (neighbors, threshold))
+            for left_id, right_id, score in cur:
+                if left_id in position and right_id in position:
+                    a, b = sorted((position[left_id], position[right_id]))
+                    pairs[(a, b)] = max(pairs.get((a, b), 0.0), float(score))
+        return pairs
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating count, average and star histogram of every product from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Products locked and updated per transaction')
+
+    def handle(self, *args, **options):
+        corrected = rebuild_ratings(batch_size=options['batch_size'])
+        self.stdout.write('Corrected the ratings of %d products' % corrected)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.analytics import ANALYTICS_VIEWS, refresh_views
+
+
+class Command(BaseCommand):
+    help = ('Refresh the analytics materialized views used by question answering. '
+            'Run on a schedule, for example every 15 minutes from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*', metavar='view', help='Views to refresh (default: all): ' + ', '.join(ANALYTICS_VIEWS))
+        parser.add_argument('--blocking', action='store_true',
+                            help='Refresh without CONCURRENTLY: faster, but locks out readers of the view while it runs')
+
+    def handle(self, *args, **options):
+        unknown = set(options['views']) - set(ANALYTICS_VIEWS)
+        if unknown:
+            raise CommandError('Unknown views: ' + ', '.join(sorted(unknown)))
+        timings = refresh_views(options['views'] or None, concurrently=not options['blocking'])
+        for view, seconds in timings.items():
+            self.stdout.write('%-35s %8.2fs' % (view, seconds))
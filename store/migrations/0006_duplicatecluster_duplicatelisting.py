@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_remove_reviewrating_user_reviewrating_first_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCluster',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('threshold', models.FloatField()),
+                ('max_similarity', models.FloatField()),
+                ('size', models.IntegerField()),
+                ('status', models.CharField(choices=[('New', 'New'), ('Confirmed', 'Confirmed'), ('Dismissed', 'Dismissed')], default='New', max_length=10)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'duplicate cluster',
+                'verbose_name_plural': 'duplicate clusters',
+            },
+        ),
+        migrations.CreateModel(
+            name='DuplicateListing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_item_id', models.IntegerField()),
+                ('description', models.TextField(blank=True)),
+                ('url', models.URLField(blank=True, max_length=1000)),
+                ('similarity', models.FloatField()),
+                ('cluster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.duplicatecluster')),
+            ],
+        ),
+    ]
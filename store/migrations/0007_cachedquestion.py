@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_duplicatecluster_duplicatelisting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedQuestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField()),
+                ('normalized_question', models.CharField(db_index=True, max_length=500)),
+                ('query', models.TextField()),
+                ('embedding', models.BinaryField(blank=True, null=True)),
+                ('embedding_backend', models.CharField(blank=True, max_length=20)),
+                ('schema_version', models.CharField(db_index=True, max_length=100)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'cached question',
+                'verbose_name_plural': 'cached questions',
+            },
+        ),
+    ]
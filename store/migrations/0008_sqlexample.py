@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_cachedquestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SqlExample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField()),
+                ('normalized_question', models.CharField(max_length=500, unique=True)),
+                ('query', models.TextField()),
+                ('source', models.CharField(choices=[('Generated', 'Generated'), ('Curated', 'Curated')], default='Curated', max_length=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('embedding', models.BinaryField(blank=True, null=True)),
+                ('embedding_backend', models.CharField(blank=True, editable=False, max_length=20)),
+                ('times_used', models.IntegerField(default=0, editable=False)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'SQL example',
+                'verbose_name_plural': 'SQL examples',
+            },
+        ),
+    ]
@@ -0,0 +1,164 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Each view has a unique index so it can be refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE_VIEWS = """
+CREATE MATERIALIZED VIEW analytics_daily_product_sales AS
+SELECT row_number() OVER (ORDER BY sales.sale_date, sales.product_id) AS id, sales.*
+FROM (
+    SELECT (o.created_at AT TIME ZONE 'UTC')::date AS sale_date,
+           p.id AS product_id, p.product_name,
+           c.id AS category_id, c.category_name,
+           count(DISTINCT o.id)::integer AS order_count,
+           sum(op.quantity)::integer AS units_sold,
+           sum(op.quantity * op.product_price) AS revenue
+    FROM orders_orderproduct op
+    JOIN orders_order o ON o.id = op.order_id
+    JOIN store_product p ON p.id = op.product_id
+    JOIN category_category c ON c.id = p.category_id
+    WHERE op.ordered AND o.is_ordered AND o.status <> 'Cancelled'
+    GROUP BY 1, p.id, p.product_name, c.id, c.category_name
+) AS sales;
+CREATE UNIQUE INDEX analytics_daily_product_sales_date_product ON analytics_daily_product_sales (sale_date, product_id);
+CREATE INDEX analytics_daily_product_sales_product ON analytics_daily_product_sales (product_id);
+
+CREATE MATERIALIZED VIEW analytics_product_rating_stats AS
+SELECT p.id AS product_id, p.product_name,
+       c.id AS category_id, c.category_name,
+       count(r.id)::integer AS review_count,
+       avg(r.rating) AS average_rating,
+       min(r.rating) AS min_rating,
+       max(r.rating) AS max_rating,
+       max(r.created_at) AS last_review_at
+FROM store_product p
+JOIN category_category c ON c.id = p.category_id
+LEFT JOIN store_reviewrating r ON r.product_id = p.id AND r.status
+GROUP BY p.id, p.product_name, c.id, c.category_name;
+CREATE UNIQUE INDEX analytics_product_rating_stats_product ON analytics_product_rating_stats (product_id);
+
+CREATE MATERIALIZED VIEW analytics_category_rating_stats AS
+SELECT c.id AS category_id, c.category_name,
+       count(DISTINCT p.id)::integer AS product_count,
+       count(DISTINCT r.product_id)::integer AS reviewed_product_count,
+       count(r.id)::integer AS review_count,
+       avg(r.rating) AS average_rating
+FROM category_category c
+LEFT JOIN store_product p ON p.category_id = c.id
+LEFT JOIN store_reviewrating r ON r.product_id = p.id AND r.status
+GROUP BY c.id, c.category_name;
+CREATE UNIQUE INDEX analytics_category_rating_stats_category ON analytics_category_rating_stats (category_id);
+
+CREATE MATERIALIZED VIEW analytics_product_stock AS
+SELECT p.id AS product_id, p.product_name,
+       c.id AS category_id, c.category_name,
+       p.price, p.stock, p.is_available,
+       coalesce(sum(op.quantity) FILTER (WHERE o.created_at >= now() - interval '30 days'), 0)::integer AS units_sold_last_30_days,
+       max(o.created_at) AS last_sold_at,
+       now() AS refreshed_at
+FROM store_product p
+JOIN category_category c ON c.id = p.category_id
+LEFT JOIN orders_orderproduct op ON op.product_id = p.id AND op.ordered
+LEFT JOIN orders_order o ON o.id = op.order_id AND o.is_ordered AND o.status <> 'Cancelled'
+GROUP BY p.id, p.product_name, c.id, c.category_name, p.price, p.stock, p.is_available;
+CREATE UNIQUE INDEX analytics_product_stock_product ON analytics_product_stock (product_id);
+"""
+
+DROP_VIEWS = """
+DROP MATERIALIZED VIEW IF EXISTS analytics_product_stock;
+DROP MATERIALIZED VIEW IF EXISTS analytics_category_rating_stats;
+DROP MATERIALIZED VIEW IF EXISTS analytics_product_rating_stats;
+DROP MATERIALIZED VIEW IF EXISTS analytics_daily_product_sales;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('category', '0001_initial'),
+        ('orders', '0002_alter_order_status'),
+        ('store', '0008_sqlexample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRatingStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='category.category')),
+                ('category_name', models.CharField(max_length=100)),
+                ('product_count', models.IntegerField()),
+                ('reviewed_product_count', models.IntegerField()),
+                ('review_count', models.IntegerField()),
+                ('average_rating', models.FloatField(null=True)),
+            ],
+            options={
+                'verbose_name': 'category rating stats',
+                'verbose_name_plural': 'category rating stats',
+                'db_table': 'analytics_category_rating_stats',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sale_date', models.DateField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.product')),
+                ('product_name', models.CharField(max_length=200)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='category.category')),
+                ('category_name', models.CharField(max_length=100)),
+                ('order_count', models.IntegerField()),
+                ('units_sold', models.IntegerField()),
+                ('revenue', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'daily product sales',
+                'verbose_name_plural': 'daily product sales',
+                'db_table': 'analytics_daily_product_sales',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRatingStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='store.product')),
+                ('product_name', models.CharField(max_length=200)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='category.category')),
+                ('category_name', models.CharField(max_length=100)),
+                ('review_count', models.IntegerField()),
+                ('average_rating', models.FloatField(null=True)),
+                ('min_rating', models.FloatField(null=True)),
+                ('max_rating', models.FloatField(null=True)),
+                ('last_review_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name': 'product rating stats',
+                'verbose_name_plural': 'product rating stats',
+                'db_table': 'analytics_product_rating_stats',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductStockLevel',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='store.product')),
+                ('product_name', models.CharField(max_length=200)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='category.category')),
+                ('category_name', models.CharField(max_length=100)),
+                ('price', models.IntegerField()),
+                ('stock', models.IntegerField()),
+                ('is_available', models.BooleanField()),
+                ('units_sold_last_30_days', models.IntegerField()),
+                ('last_sold_at', models.DateTimeField(null=True)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'product stock level',
+                'verbose_name_plural': 'product stock levels',
+                'db_table': 'analytics_product_stock',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEWS, DROP_VIEWS),
+    ]
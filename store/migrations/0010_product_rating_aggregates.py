@@ -0,0 +1,74 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:38
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q, Sum
+
+
+def compute_ratings(apps, schema_editor):
+    # The aggregates of store.ratings, computed with the historical models. A half star rounds up,
+    # so rating_2 counts the ratings above 1 up to 2
+    Product = apps.get_model('store', 'Product')
+    ReviewRating = apps.get_model('store', 'ReviewRating')
+    stars = {
+        'rating_1': Count('id', filter=Q(rating__lte=1)),
+        'rating_2': Count('id', filter=Q(rating__gt=1, rating__lte=2)),
+        'rating_3': Count('id', filter=Q(rating__gt=2, rating__lte=3)),
+        'rating_4': Count('id', filter=Q(rating__gt=3, rating__lte=4)),
+        'rating_5': Count('id', filter=Q(rating__gt=4)),
+    }
+    rows = (ReviewRating.objects.filter(status=True).values('product_id')
+            .annotate(rating_count=Count('id'), rating_sum=Sum('rating'), rating_average=Avg('rating'), **stars)
+            .order_by())
+    for row in rows:
+        Product.objects.filter(pk=row.pop('product_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_analytics_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_average',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_ratings, migrations.RunPython.noop),
+    ]
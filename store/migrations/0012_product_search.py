@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:41
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The name weighs most in the ranking, then the brand, then the description
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce({row}product_name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce({row}product_brand, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce({row}description, '')), 'C')"""
+
+CREATE_TRIGGER = """
+CREATE FUNCTION store_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {vector};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER store_product_search_vector_update
+    BEFORE INSERT OR UPDATE OF product_name, product_brand, description ON store_product
+    FOR EACH ROW EXECUTE FUNCTION store_product_search_vector_update();
+
+UPDATE store_product SET search_vector = {existing};
+""".format(vector=SEARCH_VECTOR.format(row='NEW.'), existing=SEARCH_VECTOR.format(row=''))
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS store_product_search_vector_update ON store_product;
+DROP FUNCTION IF EXISTS store_product_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_product_listing_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='store_product_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['product_name'], name='store_product_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_descriptions(apps, schema_editor):
+    # Rows of the former GenerateDescription model are product descriptions
+    GenerationResult = apps.get_model('store', 'GenerationResult')
+    GenerationResult.objects.filter(feature='').update(feature='description')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('store', '0012_product_search'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='GenerateDescription',
+            new_name='GenerationResult',
+        ),
+        migrations.AlterModelOptions(
+            name='generationresult',
+            options={'verbose_name': 'generation result', 'verbose_name_plural': 'generation results'},
+        ),
+        migrations.RenameField(
+            model_name='generationresult',
+            old_name='description',
+            new_name='output',
+        ),
+        migrations.AlterField(
+            model_name='generationresult',
+            name='output',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='feature',
+            field=models.CharField(choices=[('description', 'Product description'), ('review_response', 'Review response'), ('design_idea', 'Design idea'), ('review_summary', 'Review summary')], default='', max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='image',
+            field=models.ImageField(blank=True, max_length=255, upload_to='store/products'),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='input_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='inputs',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='latency_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='model_id',
+            field=models.CharField(default='', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='output_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='prompt',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='review',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.reviewrating'),
+        ),
+        migrations.AddField(
+            model_name='generationresult',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='generationresult',
+            index=models.Index(fields=['product', 'feature', '-created_date'], name='store_generation_product_idx'),
+        ),
+        migrations.RunPython(mark_descriptions, migrations.RunPython.noop),
+    ]
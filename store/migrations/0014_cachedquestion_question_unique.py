@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+def delete_duplicate_questions(apps, schema_editor):
+    # Keep the latest entry of each question, concurrent cache misses may have stored it twice
+    CachedQuestion = apps.get_model('store', 'CachedQuestion')
+    seen = set()
+    for entry in CachedQuestion.objects.order_by('-modified_date', '-id').values('id', 'normalized_question', 'schema_version'):
+        key = (entry['normalized_question'], entry['schema_version'])
+        if key in seen:
+            CachedQuestion.objects.filter(id=entry['id']).delete()
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_generationresult'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_questions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cachedquestion',
+            constraint=models.UniqueConstraint(fields=('normalized_question', 'schema_version'), name='store_cachedquestion_question_unique'),
+        ),
+    ]
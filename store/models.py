@@ -1,11 +1,19 @@
 from django.db import models
+from django.core.exceptions import ValidationError
 from category.models import Category
 from django.urls import reverse
 from accounts.models import Account
-from django.db.models import Avg, Count
+from django.db import transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 
 # Create your models here.
+class ProductManager(models.Manager):
+    def get_queryset(self):
+        # search_vector is only used in the WHERE and ORDER BY clauses of the search, and kept up to date by the trigger
+        return super(ProductManager, self).get_queryset().defer('search_vector')
+
 class Product(models.Model):
     product_name = models.CharField(max_length=200, unique=True)
     product_brand = models.CharField(max_length=200, default="reinvent")
@@ -19,26 +27,58 @@ class Product(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)
     modified_date = models.DateTimeField(auto_now=True)
     review_summary = models.TextField(max_length=10000, blank=True)
+    # Aggregates of the published reviews, maintained by store.ratings
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.FloatField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_1 = models.IntegerField(default=0, editable=False)
+    rating_2 = models.IntegerField(default=0, editable=False)
+    rating_3 = models.IntegerField(default=0, editable=False)
+    rating_4 = models.IntegerField(default=0, editable=False)
+    rating_5 = models.IntegerField(default=0, editable=False)
+    # Weighted tsvector of the name, brand and description, kept up to date by a database trigger (migration 0012)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductManager()
+
+    def save(self, *args, **kwargs):
+        from .ratings import RATING_FIELDS
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # The rating fields of this instance may be older than the row, e.g. when a review was
+            # submitted while an order was being placed, so only store.ratings writes them. The search
+            # vector is computed by a database trigger.
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in RATING_FIELDS and f.name != 'search_vector']
+        super().save(*args, **kwargs)
 
     def get_url(self):
         return reverse('product_detail', args=[self.category.slug, self.slug])
     
     def averageReview(self):
-        reviews = ReviewRating.objects.filter(product=self, status=True).aggregate(average=Avg('rating'))
-        avg = 0
-        if reviews['average'] is not None:
-            avg = float(reviews['average'])
-        return avg
+        return self.rating_average
 
     def countReview(self):
-        reviews = ReviewRating.objects.filter(product=self, status=True).aggregate(count=Count('id'))
-        count = 0
-        if reviews['count'] is not None:
-            count = int(reviews['count'])
-        return count
+        return self.rating_count
+
+    def ratingHistogram(self):
+        # [(stars, number of reviews, percentage of reviews)] from 5 stars down to 1
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, 'rating_' + str(stars))
+            histogram.append((stars, count, round(100 * count / self.rating_count) if self.rating_count else 0))
+        return histogram
 
     def __str__(self):
         return self.product_name
+
+    class Meta:
+        # Sort keys of the keyset paginated store listing and search results
+        indexes = [
+            models.Index(fields=['category', 'id'], name='store_product_category_id_idx'),
+            models.Index(fields=['created_date', 'id'], name='store_product_created_id_idx'),
+            GinIndex(fields=['search_vector'], name='store_product_search_idx'),
+            GinIndex(fields=['product_name'], opclasses=['gin_trgm_ops'], name='store_product_name_trgm_idx'),
+        ]
     
 class VariationManager(models.Manager):
     def colors(self):
@@ -80,6 +120,24 @@ class ReviewRating(models.Model):
     first_name = models.CharField(max_length=100, blank=False, default="John")
     last_name = models.CharField(max_length=100, blank=False, default="Doe")
 
+    def save(self, *args, **kwargs):
+        from .ratings import apply_review_change, review_contribution
+        with transaction.atomic():
+            old = None
+            if not self._state.adding:
+                # Locking the stored review serializes concurrent edits of it
+                old = ReviewRating.objects.select_for_update().filter(pk=self.pk).only('product_id', 'rating', 'status').first()
+            super().save(*args, **kwargs)
+            apply_review_change(review_contribution(old), review_contribution(self))
+
+    def delete(self, *args, **kwargs):
+        from .ratings import apply_review_change, review_contribution
+        with transaction.atomic():
+            old = ReviewRating.objects.select_for_update().filter(pk=self.pk).only('product_id', 'rating', 'status').first()
+            result = super().delete(*args, **kwargs)
+            apply_review_change(review_contribution(old), None)
+        return result
+
     def __str__(self):
         return self.subject
 
@@ -95,15 +153,212 @@ class ProductGallery(models.Model):
         verbose_name_plural = 'product gallery'
 
 # Create your models here.
-class GenerateDescription(models.Model):
+class GenerationResult(models.Model):
+    # Output of one call of a GenAI feature, kept so it can be shown, saved or reused later.
+    # The session only holds the id of the result a feature page currently shows (see store/generations.py).
+    FEATURES = (
+        ('description', 'Product description'),
+        ('review_response', 'Review response'),
+        ('design_idea', 'Design idea'),
+        ('review_summary', 'Review summary'),
+    )
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    description = models.TextField(max_length=500, blank=True)
+    review = models.ForeignKey(ReviewRating, on_delete=models.CASCADE, null=True, blank=True)
+    user = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True, blank=True)
+    feature = models.CharField(max_length=20, choices=FEATURES)
+    # Form inputs that are shown again with the result, such as the product details or image prompts
+    inputs = models.JSONField(default=dict, blank=True)
+    prompt = models.TextField(blank=True)
+    parameters = models.JSONField(default=dict, blank=True)
+    model_id = models.CharField(max_length=100)
+    output = models.TextField(blank=True)
+    image = models.ImageField(upload_to='store/products', max_length=255, blank=True)
+    latency_ms = models.IntegerField(null=True, blank=True)
+    input_tokens = models.IntegerField(null=True, blank=True)
+    output_tokens = models.IntegerField(null=True, blank=True)
     created_date = models.DateTimeField(auto_now_add=True)
     modified_date = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.product.product_name
-    
+        return '%s for %s' % (self.get_feature_display(), self.product.product_name)
+
+    class Meta:
+        verbose_name = 'generation result'
+        verbose_name_plural = 'generation results'
+        indexes = [
+            models.Index(fields=['product', 'feature', '-created_date'], name='store_generation_product_idx'),
+        ]
+
+
+class DuplicateCluster(models.Model):
+    STATUS = (
+        ('New', 'New'),
+        ('Confirmed', 'Confirmed'),
+        ('Dismissed', 'Dismissed'),
+    )
+
+    threshold = models.FloatField()
+    max_similarity = models.FloatField()
+    size = models.IntegerField()
+    status = models.CharField(max_length=10, choices=STATUS, default='New')
+    created_date = models.DateTimeField(auto_now_add=True)
+    modified_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return 'Cluster of ' + str(self.size) + ' listings'
+
+    class Meta:
+        verbose_name = 'duplicate cluster'
+        verbose_name_plural = 'duplicate clusters'
+
+
+class DuplicateListing(models.Model):
+    # product_item_id is the id of the listing in the vector_products table of the vector database
+    cluster = models.ForeignKey(DuplicateCluster, on_delete=models.CASCADE)
+    product_item_id = models.IntegerField()
+    description = models.TextField(blank=True)
+    url = models.URLField(max_length=1000, blank=True)
+    similarity = models.FloatField()
+
+    def __str__(self):
+        return str(self.product_item_id)
+
+
+class CachedQuestion(models.Model):
+    # SQL query that answered a question in ask_question, reused for the same or a similar question.
+    # embedding is the normalized float32 vector of the question from embedding_backend.
+    question = models.TextField()
+    normalized_question = models.CharField(max_length=500, db_index=True)
+    query = models.TextField()
+    embedding = models.BinaryField(null=True, blank=True)
+    embedding_backend = models.CharField(max_length=20, blank=True)
+    schema_version = models.CharField(max_length=100, db_index=True)
+    hit_count = models.IntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True)
+    modified_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.question
+
+    class Meta:
+        verbose_name = 'cached question'
+        verbose_name_plural = 'cached questions'
+        constraints = [
+            models.UniqueConstraint(fields=['normalized_question', 'schema_version'], name='store_cachedquestion_question_unique'),
+        ]
+
+
+class SqlExample(models.Model):
+    # Verified question and SQL query pair, shown to the LLM as an example when generating SQL for similar questions.
+    # Generated examples come from successful ask_question runs, curated ones are written in the admin.
+    SOURCE = (
+        ('Generated', 'Generated'),
+        ('Curated', 'Curated'),
+    )
+
+    question = models.TextField()
+    normalized_question = models.CharField(max_length=500, unique=True)
+    query = models.TextField()
+    source = models.CharField(max_length=10, choices=SOURCE, default='Curated')
+    is_active = models.BooleanField(default=True)
+    embedding = models.BinaryField(null=True, blank=True, editable=False)
+    embedding_backend = models.CharField(max_length=20, blank=True, editable=False)
+    times_used = models.IntegerField(default=0, editable=False)
+    created_date = models.DateTimeField(auto_now_add=True)
+    modified_date = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        # normalized_question is not part of the admin form, so its uniqueness is checked here
+        from .question_cache import normalize_question
+        duplicate = SqlExample.objects.filter(normalized_question=normalize_question(self.question or '')).exclude(pk=self.pk)
+        if duplicate.exists():
+            raise ValidationError({'question': 'An example with the same question already exists.'})
+
+    def save(self, *args, **kwargs):
+        from .question_cache import normalize_question
+        normalized = normalize_question(self.question)
+        if normalized != self.normalized_question:
+            # The embedding is recomputed for the new question text when the example index is next loaded
+            self.normalized_question = normalized
+            self.embedding = None
+            self.embedding_backend = ''
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.question
+
+    class Meta:
+        verbose_name = 'SQL example'
+        verbose_name_plural = 'SQL examples'
+
+
+# Read-only models over the analytics materialized views created in migration 0009. The views are
+# refreshed by store.analytics, never written through these models.
+class DailyProductSales(models.Model):
+    sale_date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, related_name='+')
+    product_name = models.CharField(max_length=200)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, related_name='+')
+    category_name = models.CharField(max_length=100)
+    order_count = models.IntegerField()
+    units_sold = models.IntegerField()
+    revenue = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'analytics_daily_product_sales'
+        verbose_name = 'daily product sales'
+        verbose_name_plural = 'daily product sales'
+
+
+class ProductRatingStats(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, related_name='+')
+    product_name = models.CharField(max_length=200)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, related_name='+')
+    category_name = models.CharField(max_length=100)
+    review_count = models.IntegerField()
+    average_rating = models.FloatField(null=True)
+    min_rating = models.FloatField(null=True)
+    max_rating = models.FloatField(null=True)
+    last_review_at = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'analytics_product_rating_stats'
+        verbose_name = 'product rating stats'
+        verbose_name_plural = 'product rating stats'
+
+
+class CategoryRatingStats(models.Model):
+    category = models.OneToOneField(Category, on_delete=models.DO_NOTHING, primary_key=True, related_name='+')
+    category_name = models.CharField(max_length=100)
+    product_count = models.IntegerField()
+    reviewed_product_count = models.IntegerField()
+    review_count = models.IntegerField()
+    average_rating = models.FloatField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'analytics_category_rating_stats'
+        verbose_name = 'category rating stats'
+        verbose_name_plural = 'category rating stats'
+
+
+class ProductStockLevel(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, related_name='+')
+    product_name = models.CharField(max_length=200)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, related_name='+')
+    category_name = models.CharField(max_length=100)
+    price = models.IntegerField()
+    stock = models.IntegerField()
+    is_available = models.BooleanField()
+    units_sold_last_30_days = models.IntegerField()
+    last_sold_at = models.DateTimeField(null=True)
+    refreshed_at = models.DateTimeField()
+
     class Meta:
-        verbose_name = 'generatedescription'
-        verbose_name_plural = 'generatedescriptions'
+        managed = False
+        db_table = 'analytics_product_stock'
+        verbose_name = 'product stock level'
+        verbose_name_plural = 'product stock levels'
@@ -0,0 +1,169 @@
+"""Keyset pagination for the product listings.
+
+OFFSET pagination reads and discards every row before the page, so deep pages get slower the
+further they are, and it needs a separate COUNT(*). A KeysetPaginator instead filters on the
+sort key of the last row shown, `WHERE (category_id, id) > (%s, %s) ORDER BY category_id, id
+LIMIT n`, which a composite index on the same columns answers with a range scan whatever the
+page. The position is passed between requests as an opaque cursor.
+
+The total shown above a listing is an exact count for small results. Past STORE_EXACT_COUNT_LIMIT
+rows (default 1000) the estimate of the Postgres planner is shown instead, so broad listings do
+not count the whole catalog on every page.
+"""
+import base64
+import binascii
+import json
+
+from decouple import config
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db import connections
+from django.db.models import BooleanField, F, Func, Value
+
+EXACT_COUNT_LIMIT = config('STORE_EXACT_COUNT_LIMIT', default=1000, cast=int)
+
+
+class RowComparison(Func):
+    """SQL row comparison `(field, ...) operator (value, ...)`"""
+    output_field = BooleanField()
+
+    def __init__(self, fields, operator, values):
+        self.operator = operator
+        self.width = len(fields)
+        super().__init__(*[F(name) for name in fields], *[Value(value) for value in values])
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            parts.append(sql)
+            params.extend(expression_params)
+        sql = '(%s) %s (%s)' % (', '.join(parts[:self.width]), self.operator, ', '.join(parts[self.width:]))
+        return sql, params
+
+
+def encode_cursor(values, direction):
+    data = json.dumps({'k': [value.isoformat() if hasattr(value, 'isoformat') else value for value in values], 'd': direction})
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(values, direction) of a cursor from encode_cursor. Raises ValueError if it is not one."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, direction = data['k'], data['d']
+    except (binascii.Error, UnicodeDecodeError, TypeError, KeyError, ValueError):
+        raise ValueError('Invalid cursor')
+    if direction not in ('next', 'previous') or not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values, direction
+
+
+def approximate_count(queryset, limit=EXACT_COUNT_LIMIT):
+    """(count, is_exact): the exact count if the planner expects at most `limit` rows, else its estimate"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count(), True
+    try:
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    except EmptyResultSet:
+        return 0, True
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate <= limit:
+        return queryset.count(), True
+    return estimate, False
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_cursor(self):
+        return self.paginator.cursor_for(self.object_list[-1], 'next') if self._has_next and self.object_list else None
+
+    def previous_cursor(self):
+        return self.paginator.cursor_for(self.object_list[0], 'previous') if self._has_previous and self.object_list else None
+
+
+class KeysetPaginator:
+    """Paginate `queryset` by `ordering`, field or annotation names that together are unique and all ascending or all descending
+
+    For example KeysetPaginator(products, ('category', 'id'), 6) or
+    KeysetPaginator(products, ('-created_date', '-id'), 6).
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        descending = {name.startswith('-') for name in ordering}
+        if len(descending) != 1:
+            raise ValueError('Keyset ordering fields must all sort in the same direction')
+        self.descending = descending.pop()
+        self.fields = [name.lstrip('-') for name in ordering]
+        # Model fields, or the output fields of annotations such as a search rank
+        annotations = queryset.query.annotations
+        self.model_fields = [annotations[name].output_field if name in annotations
+                             else queryset.model._meta.get_field(name) for name in self.fields]
+        self.attributes = [name if name in annotations else field.attname for name, field in zip(self.fields, self.model_fields)]
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+
+    def cursor_for(self, obj, direction):
+        return encode_cursor([getattr(obj, attribute) for attribute in self.attributes], direction)
+
+    def get_page(self, cursor=None):
+        """The page after or before `cursor`, or the first page if there is no valid cursor or no row past it"""
+        values, direction = None, 'next'
+        if cursor:
+            try:
+                values, direction = decode_cursor(cursor)
+                if len(values) != len(self.fields):
+                    raise ValueError('Invalid cursor')
+                values = [field.to_python(value) for field, value in zip(self.model_fields, values)]
+            except (ValueError, ValidationError):
+                values, direction = None, 'next'
+
+        queryset = self.queryset
+        forward = direction == 'next'
+        if values is not None:
+            operator = '>' if forward != self.descending else '<'
+            queryset = queryset.filter(RowComparison(self.fields, operator, values))
+        if forward:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*[name[1:] if name.startswith('-') else '-' + name for name in self.ordering])
+
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not rows and values is not None:
+            # E.g. a bookmarked cursor after the last product, which has since been deleted
+            return self.get_page()
+        if forward:
+            return KeysetPage(rows, self, has_next=more, has_previous=values is not None)
+        rows.reverse()
+        return KeysetPage(rows, self, has_next=bool(rows), has_previous=more)
@@ -0,0 +1,137 @@
+"""Question-to-SQL cache for the question answering feature.
+
+Customers ask the same questions in many phrasings. Once a generated SQL query has run
+successfully, it is saved with its question, and later questions reuse it instead of asking the
+LLM to generate SQL again. There are two tiers:
+
+* exact    - the question matches a cached one after lower-casing and removing punctuation
+* semantic - the embedding of the question has a cosine similarity of at least
+             QA_CACHE_SIMILARITY_THRESHOLD (default 0.92) with a cached one
+
+Every entry records the schema version (see store/schema_context.py) it was generated for.
+Only entries of the current version are used, so a migration invalidates the whole cache.
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from decouple import config
+from django.db import IntegrityError
+from django.db.models import Count, F, Max
+
+from .models import CachedQuestion
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = config('QA_CACHE_SIMILARITY_THRESHOLD', default=0.92, cast=float)
+
+
+def normalize_question(question):
+    words = re.sub(r'[^\w\s]', ' ', question.lower()).split()
+    return ' '.join(words)[:500]
+
+
+@dataclass
+class CacheLookup:
+    query: Optional[str] = None
+    # 'exact' or 'semantic' for a hit
+    tier: Optional[str] = None
+    similarity: float = 0.0
+    entry_id: Optional[int] = None
+    # Embedding of the question, kept so that storing it after a miss does not embed it again
+    embedding: Optional[np.ndarray] = None
+
+
+class QuestionCache:
+    def __init__(self, embedding_backend=None, threshold=SIMILARITY_THRESHOLD):
+        self.embedding_backend = embedding_backend
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # (schema version, stamp) -> entry ids and their embeddings as one normalized matrix
+        self._matrix_key = None
+        self._ids = []
+        self._matrix = None
+
+    def lookup(self, question, schema_version):
+        normalized = normalize_question(question)
+        entry = (CachedQuestion.objects.filter(normalized_question=normalized, schema_version=schema_version)
+                 .order_by('-hit_count').values('id', 'query').first())
+        if entry:
+            return CacheLookup(query=entry['query'], tier='exact', similarity=1.0, entry_id=entry['id'])
+
+        if self.embedding_backend is None:
+            return CacheLookup()
+        try:
+            embedding = self._embed(question)
+        except Exception:
+            # The cache is an optimization; without an embedding the question is simply generated
+            logger.exception('Could not embed question for the semantic cache')
+            return CacheLookup()
+
+        ids, matrix = self._load_matrix(schema_version)
+        if not ids:
+            return CacheLookup(embedding=embedding)
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return CacheLookup(embedding=embedding)
+        entry = CachedQuestion.objects.filter(id=ids[best]).values('id', 'query').first()
+        if entry is None:
+            return CacheLookup(embedding=embedding)
+        return CacheLookup(query=entry['query'], tier='semantic', similarity=float(scores[best]),
+                           entry_id=entry['id'], embedding=embedding)
+
+    def store(self, question, query, schema_version, embedding=None):
+        """Save a query that ran successfully for `question`"""
+        if embedding is None and self.embedding_backend is not None:
+            try:
+                embedding = self._embed(question)
+            except Exception:
+                logger.exception('Could not embed question for the semantic cache')
+        # Entries of older schema versions can never be used again
+        CachedQuestion.objects.exclude(schema_version=schema_version).delete()
+        entry = {
+            'normalized_question': normalize_question(question),
+            'schema_version': schema_version,
+            'defaults': {
+                'question': question,
+                'query': query,
+                'embedding': embedding.astype(np.float32).tobytes() if embedding is not None else None,
+                'embedding_backend': self.embedding_backend.name if embedding is not None else '',
+            },
+        }
+        try:
+            CachedQuestion.objects.update_or_create(**entry)
+        except IntegrityError:
+            # A concurrent request cached the same question between the lookup and the insert
+            CachedQuestion.objects.update_or_create(**entry)
+
+    def record_hit(self, lookup):
+        CachedQuestion.objects.filter(id=lookup.entry_id).update(hit_count=F('hit_count') + 1)
+
+    def discard(self, lookup):
+        """Remove a cached query that failed, so the next question generates a new one"""
+        CachedQuestion.objects.filter(id=lookup.entry_id).delete()
+
+    def _embed(self, question):
+        embedding = np.asarray(self.embedding_backend.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def _load_matrix(self, schema_version):
+        entries = CachedQuestion.objects.filter(schema_version=schema_version, embedding_backend=self.embedding_backend.name,
+                                                embedding__isnull=False)
+        # The matrix is rebuilt only when entries were added or removed since it was loaded
+        stamp = entries.aggregate(count=Count('id'), max_id=Max('id'))
+        key = (schema_version, stamp['count'], stamp['max_id'])
+        with self._lock:
+            if key != self._matrix_key:
+                rows = list(entries.values_list('id', 'embedding'))
+                self._ids = [entry_id for entry_id, _ in rows]
+                self._matrix = (np.stack([np.frombuffer(bytes(embedding), dtype=np.float32) for _, embedding in rows])
+                                if rows else None)
+                self._matrix_key = key
+            return self._ids, self._matrix
@@ -0,0 +1,104 @@
+"""Rating aggregates stored on Product.
+
+Each product keeps the number of published reviews, the sum and average of their ratings and a
+star histogram (rating_1 to rating_5, where a half star rounds up), so listing pages render the
+stars of every product from the product row alone. ReviewRating.save() and delete() apply the
+change of a review to its product with a single UPDATE of F() expressions, which is atomic
+however many reviews are submitted concurrently. Product.save() never writes these fields.
+
+Writes that bypass ReviewRating.save() and delete() (QuerySet.update, bulk_create, raw SQL)
+leave the aggregates stale. `python manage.py rebuild_ratings` recomputes them from the reviews.
+"""
+import math
+
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+
+STAR_FIELDS = ['rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+RATING_FIELDS = ['rating_count', 'rating_sum', 'rating_average'] + STAR_FIELDS
+
+
+def star_field(rating):
+    """Histogram field counting `rating`"""
+    return STAR_FIELDS[min(max(math.ceil(rating), 1), 5) - 1]
+
+
+def review_contribution(review):
+    """(product id, rating) a review adds to the aggregates, or None if it is not published"""
+    if review is None or not review.status or review.rating is None:
+        return None
+    return review.product_id, float(review.rating)
+
+
+def apply_review_change(old, new):
+    """Move the aggregates from the `old` (product id, rating) contribution to `new`. Either may be None."""
+    from .models import Product
+    from .result_cache import bump_table_versions
+
+    if old == new:
+        return
+    changes = {}
+    for contribution, sign in ((old, -1), (new, 1)):
+        if contribution is None:
+            continue
+        product_id, rating = contribution
+        change = changes.setdefault(product_id, {'rating_count': 0, 'rating_sum': 0.0})
+        change['rating_count'] += sign
+        change['rating_sum'] += sign * rating
+        change[star_field(rating)] = change.get(star_field(rating), 0) + sign
+
+    for product_id, change in changes.items():
+        # All F() expressions of an UPDATE read the row before the update, so the average is
+        # computed from the new count and sum in the same statement
+        count = F('rating_count') + change['rating_count']
+        total = F('rating_sum') + change['rating_sum']
+        values = {name: F(name) + delta for name, delta in change.items() if name in STAR_FIELDS and delta}
+        values.update(rating_count=count, rating_sum=total, rating_average=total / Greatest(count, Value(1)))
+        Product.objects.filter(pk=product_id).update(**values)
+    # QuerySet.update sends no signals
+    bump_table_versions(Product._meta.db_table)
+
+
+def rating_totals(reviews):
+    """{product id: {field: value}} for the published reviews in the `reviews` queryset"""
+    totals = {}
+    rows = reviews.filter(status=True).values('product_id', 'rating').annotate(reviews=Count('id')).order_by()
+    for row in rows:
+        values = totals.setdefault(row['product_id'], dict.fromkeys(RATING_FIELDS, 0))
+        values['rating_count'] += row['reviews']
+        values['rating_sum'] += row['rating'] * row['reviews']
+        values[star_field(row['rating'])] += row['reviews']
+    for values in totals.values():
+        values['rating_average'] = values['rating_sum'] / values['rating_count']
+    return totals
+
+
+def rebuild_ratings(batch_size=500):
+    """Recompute the aggregates of every product from its reviews. Returns the number of products corrected."""
+    from .fragment_cache import bump_product_versions
+    from .models import Product, ReviewRating
+    from .result_cache import bump_table_versions
+
+    corrected = 0
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        with transaction.atomic():
+            # Locking the products first makes concurrent review changes wait for the rebuild,
+            # and be applied on top of it, rather than be overwritten by it
+            products = list(Product.objects.select_for_update().filter(pk__in=batch).only('pk', *RATING_FIELDS))
+            totals = rating_totals(ReviewRating.objects.filter(product_id__in=batch))
+            changed = []
+            for product in products:
+                expected = totals.get(product.pk, dict.fromkeys(RATING_FIELDS, 0))
+                if any(getattr(product, name) != value for name, value in expected.items()):
+                    for name, value in expected.items():
+                        setattr(product, name, value)
+                    changed.append(product)
+            Product.objects.bulk_update(changed, RATING_FIELDS)
+            bump_product_versions(*[product.pk for product in changed])
+            corrected += len(changed)
+    if corrected:
+        bump_table_versions(Product._meta.db_table)
+    return corrected
@@ -0,0 +1,177 @@
+"""Result cache for the SQL queries run by the question answering feature.
+
+Results are cached by normalized SQL text in the Django cache. Each entry records the tables
+its query reads, and the write version of each of those tables at the time it ran. Saving or
+deleting a row of a table in SCHEMA_MODELS bumps the table's version (the signal handlers are
+connected in StoreConfig.ready), so a cached result is served only until the data it was read
+from actually changes.
+
+Writes that bypass model signals (QuerySet.update, raw SQL) must call bump_table_versions
+themselves. Entries also expire after QA_RESULT_CACHE_TTL seconds (default 300) as a backstop.
+The default in-memory cache is per process. Configure a shared cache in CACHES when running
+several workers, so that a write in one of them invalidates the results cached by the others.
+"""
+import hashlib
+import time
+from contextlib import contextmanager
+
+import sqlparse
+from decouple import config
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from prometheus_client import Counter
+from sqlparse import tokens as T
+
+from .schema_context import SCHEMA_MODELS
+from .sql_guard import MAX_ROWS, run_guarded_query
+
+RESULT_CACHE_TTL = config('QA_RESULT_CACHE_TTL', default=300, cast=int)
+
+RESULT_CACHE_REQUESTS = Counter('qa_result_cache_requests_total', 'Q&A query result cache lookups', ['result'])
+
+# Results of queries calling these change without any write to the tables
+VOLATILE_FUNCTIONS = {
+    'now', 'random', 'clock_timestamp', 'statement_timestamp', 'transaction_timestamp', 'timeofday',
+    'current_date', 'current_time', 'current_timestamp', 'localtime', 'localtimestamp',
+}
+
+
+def tracked_models():
+    """Models whose tables can appear in generated SQL, including auto-created many-to-many tables"""
+    for label in SCHEMA_MODELS:
+        model = apps.get_model(label)
+        yield model
+        for m2m in model._meta.local_many_to_many:
+            if m2m.remote_field.through._meta.auto_created:
+                yield m2m.remote_field.through
+
+
+def tracked_tables():
+    return {model._meta.db_table for model in tracked_models()}
+
+
+def normalize_sql(query):
+    """SQL text with comments removed, keywords upper-cased and whitespace collapsed outside literals"""
+    parts = []
+    for token in sqlparse.parse(sqlparse.format(query, strip_comments=True))[0].flatten():
+        if token.is_whitespace:
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        elif token.ttype in T.Keyword:
+            parts.append(token.normalized)
+        else:
+            parts.append(token.value)
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def referenced_tables(query, known_tables):
+    """Names in the statement that are known tables. None if the result depends on volatile functions."""
+    tables = set()
+    for token in sqlparse.parse(query)[0].flatten():
+        if token.ttype in T.Name or token.ttype in T.Keyword or token.ttype in T.Literal.String.Symbol:
+            name = token.value.strip('"').lower()
+            if name in VOLATILE_FUNCTIONS:
+                return None
+            if name in known_tables:
+                tables.add(name)
+    return tables
+
+
+def _version_key(table):
+    return 'qa-table-version:' + table
+
+
+def table_versions(tables):
+    keys = [_version_key(table) for table in tables]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A version that was never set or was evicted starts from the clock, never from a value seen before
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return {table: versions[_version_key(table)] for table in tables}
+
+
+def bump_table_versions(*tables):
+    """Invalidate the cached results read from `tables`, once the current transaction commits"""
+    def bump():
+        for table in tables:
+            key = _version_key(table)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def invalidate_model_results(sender, **kwargs):
+    """post_save / post_delete / m2m_changed handler"""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_table_versions(sender._meta.db_table)
+
+
+class CachedResult:
+    """A query result served from the cache, with the interface of GuardedResult"""
+
+    def __init__(self, columns, rows, truncated):
+        self.columns = columns
+        self.rows = rows
+        self.row_count = len(rows)
+        self.truncated = truncated
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class RecordingResult:
+    """Passes the rows of a GuardedResult through while keeping a copy for the cache"""
+
+    def __init__(self, result):
+        self.result = result
+        self.columns = result.columns
+        self.rows = []
+        self.exhausted = False
+
+    @property
+    def truncated(self):
+        return self.result.truncated
+
+    def __iter__(self):
+        for row in self.result:
+            self.rows.append(tuple(row))
+            yield row
+        self.exhausted = True
+
+
+@contextmanager
+def cached_query_result(query, max_rows=MAX_ROWS):
+    """Like run_guarded_query, but serves repeated queries from the cache while their tables are unchanged"""
+    normalized = normalize_sql(query)
+    tables = referenced_tables(normalized, tracked_tables())
+    if not tables:
+        RESULT_CACHE_REQUESTS.labels('uncacheable').inc()
+        with run_guarded_query(query, max_rows=max_rows) as result:
+            yield result
+        return
+
+    key = 'qa-result:' + hashlib.sha256((str(max_rows) + ':' + normalized).encode('utf-8')).hexdigest()
+    # Versions are read before the query runs, so a write during the query leaves the entry already stale
+    versions = table_versions(sorted(tables))
+    entry = cache.get(key)
+    if entry is not None and entry['versions'] == versions:
+        RESULT_CACHE_REQUESTS.labels('hit').inc()
+        yield CachedResult(entry['columns'], entry['rows'], entry['truncated'])
+        return
+
+    RESULT_CACHE_REQUESTS.labels('miss').inc()
+    with run_guarded_query(query, max_rows=max_rows) as result:
+        recording = RecordingResult(result)
+        yield recording
+    if recording.exhausted:
+        cache.set(key, {
+            'versions': versions,
+            'columns': recording.columns,
+            'rows': recording.rows,
+            'truncated': recording.truncated,
+        }, RESULT_CACHE_TTL)
@@ -0,0 +1,99 @@
+"""Compact, token-budgeted text for query results that are passed back to the LLM.
+
+Rows are rendered as tab-separated values under a header line with the column names. Once the
+rendered text would go over the token budget, the remaining rows are not rendered. They are
+still read, and a summary of them is appended instead: how many there were, and the
+min/max/sum/average of every numeric column.
+
+Tokens are estimated at QA_CHARS_PER_TOKEN characters each. The budget is QA_RESULT_TOKEN_BUDGET
+(default 2000 tokens).
+"""
+import datetime
+import decimal
+import numbers
+
+from decouple import config
+
+RESULT_TOKEN_BUDGET = config('QA_RESULT_TOKEN_BUDGET', default=2000, cast=int)
+CHARS_PER_TOKEN = config('QA_CHARS_PER_TOKEN', default=4, cast=int)
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return '%g' % value
+    # Tabs and newlines inside a value would break the table layout
+    return ' '.join(str(value).split())
+
+
+def is_numeric(value):
+    return isinstance(value, (numbers.Number, decimal.Decimal)) and not isinstance(value, bool)
+
+
+class ColumnStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def describe(self):
+        average = self.total / self.count
+        return 'min %s, max %s, sum %s, avg %s' % tuple(
+            format_value(float(v) if isinstance(v, decimal.Decimal) else v)
+            for v in (self.minimum, self.maximum, self.total, round(average, 2)))
+
+
+def serialize_resultset(result, token_budget=RESULT_TOKEN_BUDGET):
+    """Render a query result as TSV, summarizing the rows that do not fit in `token_budget`.
+
+    `result` is iterated once and must have a `columns` list, like the GuardedResult of
+    store/sql_guard.py. If it is `truncated` after iteration, a note says that the query matched
+    more rows than were fetched. An empty result renders as an empty string.
+    """
+    columns = result.columns
+    lines = ['\t'.join(columns)]
+    used = estimate_tokens(lines[0]) + 1
+    dropped = 0
+    stats = {}
+
+    for row in result:
+        if not dropped:
+            line = '\t'.join(format_value(value) for value in row)
+            cost = estimate_tokens(line) + 1
+            if used + cost <= token_budget:
+                lines.append(line)
+                used += cost
+                continue
+        dropped += 1
+        # By position, so columns with the same name (two count columns, ?column?) are summarized separately
+        for position, value in enumerate(row):
+            if is_numeric(value):
+                stats.setdefault(position, ColumnStats()).add(value)
+
+    if len(lines) == 1 and not dropped:
+        return ''
+
+    if dropped:
+        lines.append('... %d more rows not shown' % dropped)
+        for position, column_stats in sorted(stats.items()):
+            name = columns[position] if position < len(columns) else '?column?'
+            if columns.count(name) > 1:
+                name = '%s (column %d)' % (name, position + 1)
+            lines.append('... %s of the rows not shown: %s' % (name, column_stats.describe()))
+    if getattr(result, 'truncated', False):
+        lines.append('... the query matched more rows than were fetched')
+    return '\n'.join(lines)
@@ -0,0 +1,254 @@
+"""Database schema context for the text-to-SQL prompts of the question answering feature.
+
+The schema is generated from the Django models, so it always matches the real tables, and the
+descriptions from schema/schema-postgres.sql are attached to the tables and columns they
+document. The rendered context is built once per process and cached together with a version
+stamp taken from the applied migrations. Running migrations (here or on another instance)
+changes the stamp and the next question rebuilds the context.
+
+Setting SCHEMA_CONTEXT_S3_KEY replaces the generated context with a file from the
+AWS_STORAGE_BUCKET_NAME bucket. That file is revalidated with its ETag, so it is only
+downloaded again after it changes.
+"""
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+from decouple import config
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+
+# Models exposed to the LLM. Sessions, admin logs, carts etc. are deliberately left out.
+# The analytics views come first so the LLM prefers their precomputed aggregates.
+SCHEMA_MODELS = [
+    'store.DailyProductSales',
+    'store.ProductRatingStats',
+    'store.CategoryRatingStats',
+    'store.ProductStockLevel',
+    'accounts.Account',
+    'category.Category',
+    'orders.Order',
+    'orders.OrderProduct',
+    'orders.Payment',
+    'store.Product',
+    'store.ReviewRating',
+    'store.Variation',
+]
+
+# Columns that must never be offered to the LLM
+EXCLUDED_COLUMNS = {
+    'accounts_account': {'password'},
+    'store_product': {'search_vector'},
+}
+
+SCHEMA_HEADER = '--\n-- PostgreSQL schema for the cloth and accessories retail website\n--\n\n'
+
+# How often (in seconds) the cached context checks whether migrations or the S3 override changed
+CHECK_INTERVAL = config('SCHEMA_CONTEXT_CHECK_INTERVAL', default=60, cast=int)
+
+
+@dataclass
+class ColumnSchema:
+    name: str
+    type: str
+    nullable: bool
+    comment: str = ''
+
+
+@dataclass
+class TableSchema:
+    name: str
+    comment: str = ''
+    columns: List[ColumnSchema] = field(default_factory=list)
+    # column name -> referenced table name
+    foreign_keys: Dict[str, str] = field(default_factory=dict)
+    kind: str = 'TABLE'
+
+    def render(self, columns=None):
+        """DDL with comments for the table, limited to the column names in `columns` if given"""
+        selected = [column for column in self.columns if columns is None or column.name in columns]
+        lines = ['--', '-- Name: ' + self.name + '; Type: ' + self.kind + ';']
+        lines += ['-- ' + line for line in self.comment.splitlines()]
+        lines += ['--', '', 'CREATE ' + self.kind + ' ' + self.name + ' (']
+        for i, column in enumerate(selected):
+            line = '    ' + column.name + ' ' + column.type + ('' if column.nullable else ' NOT NULL')
+            if i < len(selected) - 1:
+                line += ','
+            comment_lines = column.comment.splitlines()
+            if comment_lines:
+                line += ' -- ' + comment_lines[0]
+            lines.append(line)
+            lines += ['    -- ' + comment_line for comment_line in comment_lines[1:]]
+        lines += [');', '']
+        return '\n'.join(lines)
+
+
+@dataclass
+class SchemaContext:
+    text: str
+    version: str
+    tables: Dict[str, TableSchema] = field(default_factory=dict)
+    # True if the text was replaced by the S3 override and no longer matches `tables`
+    overridden: bool = False
+
+
+def parse_schema_comments(sql):
+    """Return ({table: comment}, {table: {column: comment}}) from an annotated DDL dump"""
+    table_comments = {}
+    column_comments = {}
+    current_name = None
+    current_table = None
+    last_column = None
+
+    for raw_line in sql.splitlines():
+        line = raw_line.strip()
+        name_match = re.match(r'--\s*Name:\s*(\w+);', line)
+        create_match = re.match(r'CREATE (?:TABLE|MATERIALIZED VIEW) (\w+)', line, re.IGNORECASE)
+        if name_match:
+            current_name = name_match.group(1)
+            table_comments[current_name] = []
+        elif create_match:
+            current_table = create_match.group(1)
+            column_comments.setdefault(current_table, {})
+            last_column = None
+            current_name = None
+        elif current_table and line.startswith(');'):
+            current_table = None
+        elif current_table and line.startswith('--'):
+            # A comment on its own line inside CREATE TABLE continues the previous column's comment
+            if last_column:
+                column_comments[current_table][last_column] += '\n' + line.lstrip('- ').strip()
+        elif current_table and line:
+            definition, _, comment = line.partition('--')
+            last_column = definition.split()[0]
+            column_comments[current_table][last_column] = comment.strip()
+        elif current_name and line.startswith('--'):
+            text = line.lstrip('- ').strip()
+            if text and not text.startswith('Name:'):
+                table_comments[current_name].append(text)
+
+    return {table: '\n'.join(lines) for table, lines in table_comments.items()}, column_comments
+
+
+def build_tables(table_comments=None, column_comments=None):
+    """Introspect SCHEMA_MODELS into TableSchema objects, including auto-created many-to-many tables"""
+    table_comments = table_comments or {}
+    column_comments = column_comments or {}
+    tables = {}
+
+    def add_model(model):
+        # The only unmanaged models in SCHEMA_MODELS are the analytics materialized views
+        table = TableSchema(name=model._meta.db_table, comment=table_comments.get(model._meta.db_table, ''),
+                            kind='TABLE' if model._meta.managed else 'MATERIALIZED VIEW')
+        comments = column_comments.get(table.name, {})
+        excluded = EXCLUDED_COLUMNS.get(table.name, set())
+        for model_field in model._meta.local_fields:
+            column_name = model_field.column
+            if column_name in excluded:
+                continue
+            column_type = model_field.db_type(connection)
+            if column_type is None:
+                continue
+            comment = comments.get(column_name, '')
+            if model_field.primary_key and not comment:
+                comment = 'primary key of the table ' + table.name
+            if model_field.is_relation and model_field.related_model is not None:
+                referenced = model_field.related_model._meta.db_table
+                table.foreign_keys[column_name] = referenced
+                if not comment:
+                    comment = 'foreign key of ' + referenced + '.' + model_field.target_field.column
+            table.columns.append(ColumnSchema(column_name, column_type, model_field.null, comment))
+        tables[table.name] = table
+
+    for label in SCHEMA_MODELS:
+        model = apps.get_model(label)
+        add_model(model)
+        for m2m in model._meta.local_many_to_many:
+            through = m2m.remote_field.through
+            if through._meta.auto_created and m2m.related_model._meta.label in SCHEMA_MODELS:
+                add_model(through)
+
+    return tables
+
+
+def migration_version():
+    """Cheap stamp that changes whenever a migration is applied or unapplied"""
+    recorder = MigrationRecorder(connection)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*), max(id) FROM ' + connection.ops.quote_name(recorder.Migration._meta.db_table))
+        count, max_id = cursor.fetchone()
+    return str(count) + '.' + str(max_id)
+
+
+def generate_schema_context(version):
+    with open(settings.BASE_DIR / 'schema' / 'schema-postgres.sql') as f:
+        table_comments, column_comments = parse_schema_comments(f.read())
+    tables = build_tables(table_comments, column_comments)
+    text = SCHEMA_HEADER + '\n'.join(table.render() for table in tables.values())
+    return SchemaContext(text=text, version=version, tables=tables)
+
+
+class SchemaContextCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._context: Optional[SchemaContext] = None
+        self._checked_at = 0.0
+        self._s3_etag = None
+        self._s3_text = None
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._context is not None and now - self._checked_at < CHECK_INTERVAL:
+                return self._context
+
+            version = migration_version()
+            if self._context is None or self._context.version.split(':')[0] != version:
+                self._context = generate_schema_context(version)
+
+            s3_key = config('SCHEMA_CONTEXT_S3_KEY', default='')
+            if s3_key:
+                self._context = self._apply_s3_override(self._context, s3_key)
+            self._checked_at = now
+            return self._context
+
+    def invalidate(self):
+        with self._lock:
+            self._context = None
+            self._checked_at = 0.0
+
+    def _apply_s3_override(self, context, s3_key):
+        # A conditional GET returns 304 Not Modified while the object still has the cached ETag
+        s3 = boto3.client('s3', region_name=config("AWS_DEFAULT_REGION"))
+        kwargs = {'Bucket': config('AWS_STORAGE_BUCKET_NAME'), 'Key': s3_key}
+        if self._s3_etag:
+            kwargs['IfNoneMatch'] = self._s3_etag
+        try:
+            resp = s3.get_object(**kwargs)
+            self._s3_text = resp['Body'].read().decode('utf-8')
+            self._s3_etag = resp['ETag']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('304', 'NotModified'):
+                raise
+        base_version = context.version.split(':')[0]
+        return SchemaContext(text=self._s3_text, version=base_version + ':' + self._s3_etag.strip('"'),
+                             tables=context.tables, overridden=True)
+
+
+_cache = SchemaContextCache()
+
+
+def get_schema_context():
+    """Return the current SchemaContext, rebuilding it only if the schema version changed"""
+    return _cache.get()
+
+
+def invalidate_schema_context(**kwargs):
+    """Drop the cached context. Connected to post_migrate, so kwargs are the signal arguments."""
+    _cache.invalidate()
@@ -0,0 +1,166 @@
+"""Question-relevant subsets of the schema context for the text-to-SQL prompt.
+
+Every table of the schema context is indexed by keyword (the words of its name, its column
+names and its descriptions) and by the embedding of the same text. For a question, the tables
+are ranked by cosine similarity plus a bonus per matching keyword, and only the top ones go into
+the prompt, in full. The tables they reference through foreign keys, and the many-to-many
+tables between two selected tables, are added with just their key and name columns and the
+columns that match the question, so the generated SQL can still join them.
+
+The full schema is used instead if SCHEMA_PRUNING is off, if no table matches the question, or
+if the schema context comes from the S3 override. SCHEMA_PRUNING_TOP_K sets how many tables are
+selected (default 3).
+"""
+import logging
+import re
+import threading
+
+import numpy as np
+from decouple import config
+
+from .schema_context import SCHEMA_HEADER
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PRUNING = config('SCHEMA_PRUNING', default=True, cast=bool)
+TOP_K = config('SCHEMA_PRUNING_TOP_K', default=3, cast=int)
+# Score added for a question word found in a table's columns or description, weighted by how few
+# tables contain the word. Words of the table name count twice.
+KEYWORD_WEIGHT = 0.1
+# Tables scoring below this fraction of the best table are left out even if within TOP_K
+MIN_RELATIVE_SCORE = 0.6
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from', 'has', 'have', 'how',
+    'i', 'id', 'in', 'is', 'it', 'key', 'many', 'me', 'much', 'of', 'on', 'or', 'primary', 'foreign', 'table',
+    'that', 'the', 'this', 'to', 'was', 'what', 'when', 'where', 'which', 'who', 'with', 'you', 'your',
+}
+
+
+def keywords(text):
+    """Lower-cased words of `text` without stop words, with a trailing plural 's' removed"""
+    words = set()
+    for word in re.findall(r'[a-z0-9]+', text.lower().replace('_', ' ')):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        words.add(word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word)
+    return words
+
+
+def table_document(table):
+    """Text describing a table, used for both its keywords and its embedding"""
+    parts = [table.name.replace('_', ' '), table.comment]
+    for column in table.columns:
+        parts.append(column.name.replace('_', ' ') + ' ' + column.comment)
+    return '\n'.join(parts)
+
+
+class SchemaIndex:
+    def __init__(self, embedding_backend=None, top_k=TOP_K):
+        self.embedding_backend = embedding_backend
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._version = None
+        self._names = []
+        self._keywords = {}
+        self._name_keywords = {}
+        self._idf = {}
+        self._column_keywords = {}
+        self._matrix = None
+
+    def _build(self, context):
+        with self._lock:
+            if self._version == context.version:
+                return
+            names = list(context.tables)
+            self._keywords = {name: keywords(table_document(context.tables[name])) for name in names}
+            self._name_keywords = {name: keywords(name) for name in names}
+            document_frequency = {}
+            for words in self._keywords.values():
+                for word in words:
+                    document_frequency[word] = document_frequency.get(word, 0) + 1
+            self._idf = {word: np.log(1 + len(names) / count) for word, count in document_frequency.items()}
+            self._column_keywords = {
+                name: {column.name: keywords(column.name + ' ' + column.comment) for column in context.tables[name].columns}
+                for name in names
+            }
+            self._matrix = None
+            if self.embedding_backend is not None:
+                try:
+                    matrix = np.asarray(self.embedding_backend.embed_documents(
+                        [table_document(context.tables[name]) for name in names]), dtype=np.float32)
+                    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                    self._matrix = matrix / np.where(norms == 0, 1, norms)
+                except Exception:
+                    logger.exception('Could not embed the schema tables, ranking them by keyword only')
+            self._names = names
+            self._version = context.version
+
+    def rank_tables(self, question, context, embedding=None):
+        """[(table name, score)] for all tables, most relevant first"""
+        self._build(context)
+        question_keywords = keywords(question)
+        scores = np.array([KEYWORD_WEIGHT * self._keyword_score(question_keywords, name) for name in self._names])
+        if self._matrix is not None:
+            if embedding is None:
+                embedding = np.asarray(self.embedding_backend.embed_query(question), dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            if norm:
+                scores = scores + self._matrix @ (embedding / norm)
+        order = np.argsort(-scores, kind='stable')
+        return [(self._names[i], float(scores[i])) for i in order]
+
+    def _keyword_score(self, question_keywords, name):
+        return sum(self._idf[word] * (2 if word in self._name_keywords[name] else 1)
+                   for word in question_keywords & self._keywords[name])
+
+    def select_tables(self, question, context, embedding=None):
+        """Return the names of the tables to include in full, and {table: column names} of their neighbors"""
+        ranked = self.rank_tables(question, context, embedding)
+        if not ranked or ranked[0][1] <= 0:
+            return [], {}
+        best = ranked[0][1]
+        selected = [name for name, score in ranked[:self.top_k] if score >= best * MIN_RELATIVE_SCORE]
+
+        question_keywords = keywords(question)
+        neighbors = {}
+
+        def add_neighbor(name):
+            if name in selected or name in neighbors or name not in context.tables:
+                return
+            table = context.tables[name]
+            columns = {column.name for column in table.columns
+                       if column.name == 'id' or column.name.endswith('name') or column.name in table.foreign_keys
+                       or question_keywords & self._column_keywords[name][column.name]}
+            neighbors[name] = columns
+
+        for name in list(selected):
+            for referenced in context.tables[name].foreign_keys.values():
+                add_neighbor(referenced)
+        # Many-to-many tables whose foreign keys all point at selected tables
+        for name, table in context.tables.items():
+            targets = set(table.foreign_keys.values())
+            if table.foreign_keys and len(targets) > 1 and targets <= set(selected):
+                add_neighbor(name)
+
+        return selected, neighbors
+
+    def schema_for(self, question, context, embedding=None):
+        """Schema text for the prompt of `question`: the relevant tables, or the full schema"""
+        if not SCHEMA_PRUNING or context.overridden or not context.tables:
+            return context.text
+        try:
+            selected, neighbors = self.select_tables(question, context, embedding)
+        except Exception:
+            logger.exception('Schema pruning failed, using the full schema')
+            return context.text
+        if not selected:
+            return context.text
+        # Keep the order of the full schema, so related tables stay next to each other
+        parts = []
+        for name, table in context.tables.items():
+            if name in selected:
+                parts.append(table.render())
+            elif name in neighbors:
+                parts.append(table.render(columns=neighbors[name]))
+        return SCHEMA_HEADER + '\n'.join(parts)
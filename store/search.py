@@ -0,0 +1,35 @@
+"""Product search.
+
+On Postgres the keyword is matched against Product.search_vector, a weighted tsvector of the
+name, brand and description that a trigger keeps up to date, through its GIN index. The
+keyword is parsed like a web search query ("blue jacket", "jeans -black", "\"slim fit\""), and
+results are ordered by ts_rank, with name matches ranking highest.
+
+Keywords without a full-text match, such as misspellings and partial words ("jackt", "jack"),
+fall back to pg_trgm word similarity against the product name, which a trigram GIN index
+answers. Other databases use the substring match the search had before.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'english'
+
+
+def search_products(queryset, keyword):
+    """Return (matching products, keyset ordering for them, mode), mode being 'fulltext', 'trigram' or 'substring'"""
+    if connections[queryset.db].vendor != 'postgresql':
+        matches = queryset.filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
+        return matches, ('-created_date', '-id'), 'substring'
+
+    query = SearchQuery(keyword, search_type='websearch', config=SEARCH_CONFIG)
+    matches = queryset.filter(search_vector=query)
+    if matches.exists():
+        # ts_rank is a float4; as a float8 it round-trips exactly through the pagination cursor
+        matches = matches.annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+        return matches, ('-rank', '-id'), 'fulltext'
+
+    matches = queryset.filter(product_name__trigram_word_similar=keyword).annotate(
+        similarity=Cast(TrigramWordSimilarity(keyword, 'product_name'), FloatField()))
+    return matches, ('-similarity', '-id'), 'trigram'
@@ -0,0 +1,110 @@
+"""Few-shot examples for the SQL generation prompt of the question answering feature.
+
+Verified (question, SQL query) pairs are kept in the SqlExample model. They are added
+automatically when a generated query runs successfully, and can be written or deactivated in
+the admin. The embeddings of the active examples are held in memory as one normalized matrix,
+so retrieving the QA_SQL_EXAMPLES (default 3) most similar examples for a question is a single
+matrix-vector product. The matrix is reloaded only when an example is added or changed, and
+examples without an embedding for the current backend are embedded at that point.
+
+SQL generation outcomes are counted per call in qa_sql_generation_total, labelled with whether
+examples were included in the prompt, so the success rate can be compared on /metrics/.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from decouple import config
+from django.db.models import Count, F, Max
+from prometheus_client import Counter, Histogram
+
+from .models import SqlExample
+from .question_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+EXAMPLE_COUNT = config('QA_SQL_EXAMPLES', default=3, cast=int)
+# Examples less similar than this to the question are not worth the prompt tokens
+MIN_SIMILARITY = config('QA_SQL_EXAMPLE_MIN_SIMILARITY', default=0.5, cast=float)
+
+SQL_GENERATION = Counter('qa_sql_generation_total', 'SQL queries generated by the LLM, by outcome', ['outcome', 'examples'])
+EXAMPLE_RETRIEVAL = Histogram('qa_sql_example_retrieval_seconds', 'Time to retrieve few-shot SQL examples for a question',
+                              buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+
+def record_generation(outcome, examples):
+    """Count a generated query as 'success', 'failure' or 'no_query'"""
+    SQL_GENERATION.labels(outcome, 'with' if examples else 'without').inc()
+
+
+def format_examples(examples):
+    """Examples as text for the prompt"""
+    return '\n\n'.join('Question: ' + example.question + '\n<query>' + example.query + '</query>' for example in examples)
+
+
+class ExampleIndex:
+    def __init__(self, embedding_backend, k=EXAMPLE_COUNT, min_similarity=MIN_SIMILARITY):
+        self.embedding_backend = embedding_backend
+        self.k = k
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._examples = []
+        self._matrix = None
+
+    def _load(self):
+        active = SqlExample.objects.filter(is_active=True)
+        stamp = active.aggregate(count=Count('id'), modified=Max('modified_date'))
+        stamp = (stamp['count'], stamp['modified'])
+        with self._lock:
+            if stamp == self._stamp:
+                return self._examples, self._matrix
+
+            examples = list(active.only('id', 'question', 'query', 'embedding', 'embedding_backend'))
+            missing = [example for example in examples if example.embedding is None or example.embedding_backend != self.embedding_backend.name]
+            if missing:
+                embeddings = self.embedding_backend.embed_documents([example.question for example in missing])
+                for example, embedding in zip(missing, embeddings):
+                    # update() keeps modified_date, so this does not trigger another reload
+                    SqlExample.objects.filter(id=example.id).update(
+                        embedding=np.asarray(embedding, dtype=np.float32).tobytes(), embedding_backend=self.embedding_backend.name)
+                    example.embedding = np.asarray(embedding, dtype=np.float32).tobytes()
+
+            matrix = None
+            if examples:
+                matrix = np.stack([np.frombuffer(bytes(example.embedding), dtype=np.float32) for example in examples])
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix = matrix / np.where(norms == 0, 1, norms)
+            self._examples, self._matrix, self._stamp = examples, matrix, stamp
+            return examples, matrix
+
+    def similar_examples(self, question, embedding=None):
+        """Up to k active examples most similar to `question`, most similar first"""
+        started = time.perf_counter()
+        try:
+            examples, matrix = self._load()
+            if matrix is None or self.k <= 0:
+                return []
+            if embedding is None:
+                embedding = np.asarray(self.embedding_backend.embed_query(question), dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            scores = matrix @ (embedding / norm if norm else embedding)
+            k = min(self.k, len(examples))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            found = [examples[i] for i in top if scores[i] >= self.min_similarity]
+            if found:
+                SqlExample.objects.filter(id__in=[example.id for example in found]).update(times_used=F('times_used') + 1)
+            return found
+        except Exception:
+            # Examples only improve the prompt; without them the query is still generated
+            logger.exception('Could not retrieve SQL examples')
+            return []
+        finally:
+            EXAMPLE_RETRIEVAL.observe(time.perf_counter() - started)
+
+    def add_generated(self, question, query):
+        """Keep a generated query that ran successfully as an example, unless the question already has one"""
+        SqlExample.objects.get_or_create(normalized_question=normalize_question(question),
+                                         defaults={'question': question, 'query': query, 'source': 'Generated'})
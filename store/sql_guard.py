@@ -0,0 +1,141 @@
+"""Guarded execution of the SQL generated by the LLM for the question answering feature.
+
+A generated query is only run if it is a single read-only SELECT. Before it runs, its
+EXPLAIN cost estimate is compared with a budget. It then runs inside a read-only transaction
+with a statement_timeout and an injected LIMIT, and its rows are streamed from a server-side
+cursor in batches, so a runaway query (for example a cross join over orders_orderproduct)
+can neither pin the database nor fill the memory of the web worker.
+
+The limits are read from the environment:
+
+* QA_MAX_ROWS             - rows returned at most (default 200)
+* QA_STATEMENT_TIMEOUT_MS - statement_timeout of the query and of its EXPLAIN (default 5000)
+* QA_MAX_QUERY_COST       - largest accepted planner cost estimate (default 100000)
+* QA_FETCH_SIZE           - rows fetched per round trip (default 100)
+"""
+import json
+from contextlib import contextmanager
+
+import psycopg2
+import sqlparse
+from decouple import config
+from sqlparse import tokens as T
+
+from retailstore.db_pool import get_pool
+
+MAX_ROWS = config('QA_MAX_ROWS', default=200, cast=int)
+STATEMENT_TIMEOUT_MS = config('QA_STATEMENT_TIMEOUT_MS', default=5000, cast=int)
+MAX_QUERY_COST = config('QA_MAX_QUERY_COST', default=100000, cast=float)
+FETCH_SIZE = config('QA_FETCH_SIZE', default=100, cast=int)
+
+# Keywords that make a SELECT write, lock or create something
+FORBIDDEN_KEYWORDS = {'INTO', 'COPY', 'LOCK', 'GRANT', 'REVOKE', 'NOTIFY', 'LISTEN', 'VACUUM', 'CALL', 'DO'}
+
+# Functions with side effects or access outside the application tables
+FORBIDDEN_FUNCTIONS = {
+    'pg_sleep', 'pg_sleep_for', 'pg_sleep_until', 'pg_read_file', 'pg_read_binary_file', 'pg_ls_dir', 'pg_stat_file',
+    'pg_terminate_backend', 'pg_cancel_backend', 'pg_reload_conf', 'pg_advisory_lock', 'pg_advisory_xact_lock',
+    'set_config', 'lo_import', 'lo_export', 'dblink', 'dblink_exec', 'nextval', 'setval', 'query_to_xml',
+}
+
+
+class UnsafeQueryError(Exception):
+    """The generated SQL is not a single read-only SELECT"""
+
+
+class QueryTooExpensiveError(UnsafeQueryError):
+    """The planner estimates the generated SQL to cost more than the budget"""
+
+
+def validate_select(query):
+    """Return the query without comments and trailing semicolon, or raise UnsafeQueryError"""
+    statements = [statement for statement in sqlparse.parse(query)
+                  if statement.token_first(skip_cm=True, skip_ws=True) is not None]
+    if len(statements) != 1:
+        raise UnsafeQueryError('Expected a single SQL statement, got %d' % len(statements))
+    statement = statements[0]
+    if statement.get_type() != 'SELECT':
+        raise UnsafeQueryError('Only SELECT statements are allowed, got ' + statement.get_type())
+
+    for token in statement.flatten():
+        if token.ttype in T.Keyword.DML and token.normalized != 'SELECT':
+            raise UnsafeQueryError(token.normalized + ' is not allowed in a generated query')
+        if token.ttype in T.Keyword.DDL or (token.ttype in T.Keyword and token.normalized in FORBIDDEN_KEYWORDS):
+            raise UnsafeQueryError(token.normalized + ' is not allowed in a generated query')
+        if token.ttype in T.Name and token.value.lower() in FORBIDDEN_FUNCTIONS:
+            raise UnsafeQueryError(token.value + '() is not allowed in a generated query')
+
+    return sqlparse.format(str(statement), strip_comments=True).strip().rstrip(';').strip()
+
+
+def plan_cost(cursor, query):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Total Cost']
+
+
+class GuardedResult:
+    """Iterable over the rows of a guarded query, fetched from the server in batches.
+
+    `columns` holds the column names, `row_count` the rows read so far, and `truncated`
+    becomes True once more than `max_rows` rows were available.
+    """
+
+    def __init__(self, cursor, max_rows, fetch_size):
+        self._cursor = cursor
+        self.max_rows = max_rows
+        self.fetch_size = fetch_size
+        # A named cursor only has a description after its first fetch
+        self._batch = cursor.fetchmany(min(fetch_size, max_rows + 1))
+        self.columns = [column.name for column in cursor.description or []]
+        self.row_count = 0
+        self.truncated = False
+
+    def __iter__(self):
+        while self._batch:
+            batch, self._batch = self._batch, []
+            for row in batch:
+                if self.row_count >= self.max_rows:
+                    self.truncated = True
+                    return
+                self.row_count += 1
+                yield row
+            self._batch = self._cursor.fetchmany(self.fetch_size)
+
+
+@contextmanager
+def run_guarded_query(query, max_rows=MAX_ROWS, statement_timeout=STATEMENT_TIMEOUT_MS,
+                      max_cost=MAX_QUERY_COST, fetch_size=FETCH_SIZE):
+    """Validate, cost-check and run a generated query on the read-only pool.
+
+    Yields a GuardedResult. The rows must be consumed inside the `with` block, because the
+    pooled connection is returned when the block exits.
+    """
+    statement = validate_select(query)
+    # One extra row tells whether the result was cut off by the limit
+    limited = 'SELECT * FROM (\n' + statement + '\n) AS generated_query LIMIT ' + str(int(max_rows) + 1)
+
+    with get_pool('readonly').connection() as dbconn:
+        # Server-side cursors need a transaction; the pool hands out autocommit connections
+        dbconn.autocommit = False
+        try:
+            with dbconn.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', (int(statement_timeout),))
+                cost = plan_cost(cursor, limited)
+            if cost > max_cost:
+                raise QueryTooExpensiveError('Query cost estimate %.0f is over the budget of %.0f' % (cost, max_cost))
+
+            with dbconn.cursor(name='generated_query') as cursor:
+                cursor.itersize = fetch_size
+                cursor.execute(limited)
+                yield GuardedResult(cursor, max_rows, fetch_size)
+        finally:
+            try:
+                dbconn.rollback()
+                # psycopg2 forgets the read-only default when autocommit is switched back on by itself
+                dbconn.set_session(readonly=True, autocommit=True)
+            except psycopg2.Error:
+                # The pool notices the broken connection and discards it
+                pass
@@ -0,0 +1,297 @@
+"""Search-as-you-type suggestions for the navbar search box.
+
+Product names, brands and category names are held in memory in a sorted array of lookup keys,
+so a prefix is answered with two bisections and no database or LLM call. Every word of a name
+starts a key ("blue denim jacket", "denim jacket", "jacket"), so typing any word of a name
+finds it. Matches are ranked by popularity: units sold plus reviews for a product, and the sum
+over their products for brands and categories. Because one or two characters match a large
+part of the catalog, the best suggestions for those prefixes are precomputed.
+
+The index is built in the background when a worker starts (see retailstore/wsgi.py). Saving or
+deleting a product updates it incrementally; a category change rebuilds it, since category
+slugs are part of product URLs. It is also rebuilt every SUGGEST_REBUILD_INTERVAL seconds
+(default 600) to pick up sales and the changes made through other workers. Until the first build
+completes, no suggestions are returned.
+"""
+import bisect
+import copy
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List
+
+from decouple import config
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.urls import reverse
+from django.utils.http import urlencode
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+REBUILD_INTERVAL = config('SUGGEST_REBUILD_INTERVAL', default=600, cast=int)
+SUGGESTION_COUNT = config('SUGGEST_COUNT', default=8, cast=int)
+# Prefixes up to this length have their best suggestions precomputed
+PRECOMPUTED_PREFIX_LENGTH = 2
+# Longer prefixes rank at most this many matching keys
+MAX_CANDIDATES = 1000
+# A name starting with the prefix ranks above an equally popular one that only has a later word starting with it
+LEADING_MATCH_BOOST = 2.0
+MAX_KEY_WORDS = 8
+
+SUGGEST_LATENCY = Histogram('store_suggest_seconds', 'Time to compute search suggestions for a prefix',
+                            buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005))
+
+
+def normalize(text):
+    """Lower-cased words without accents or punctuation, separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def index_keys(label):
+    words = normalize(label).split()[:MAX_KEY_WORDS]
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    label: str
+    kind: str
+    url: str
+    popularity: float
+
+    def as_dict(self):
+        return {'label': self.label, 'kind': self.kind, 'url': self.url}
+
+
+def index_entries(suggestion_id, suggestion):
+    """(key, suggestion id, score) for every key of a suggestion"""
+    for i, key in enumerate(index_keys(suggestion.label)):
+        yield key, suggestion_id, suggestion.popularity * (LEADING_MATCH_BOOST if i == 0 else 1.0)
+
+
+def short_prefixes(keys):
+    return {key[:length] for key in keys for length in range(1, min(PRECOMPUTED_PREFIX_LENGTH, len(key)) + 1)}
+
+
+class PrefixIndex:
+    """Sorted parallel arrays of lookup keys, suggestion ids and scores
+
+    An index is never modified once built: replace() returns a new one, so a request can read
+    the current index without locking while another thread applies a change.
+    """
+
+    def __init__(self, suggestions: Dict[str, Suggestion], keys=None, ids=None, scores=None, top=None):
+        self.suggestions = suggestions
+        if keys is None:
+            entries = sorted(entry for suggestion_id, suggestion in suggestions.items()
+                             for entry in index_entries(suggestion_id, suggestion))
+            keys = [key for key, _, _ in entries]
+            ids = [suggestion_id for _, suggestion_id, _ in entries]
+            scores = [score for _, _, score in entries]
+        self.keys: List[str] = keys
+        self.ids: List[str] = ids
+        self.scores: List[float] = scores
+        self.top: Dict[str, List[str]] = top if top is not None else self._precompute_top()
+
+    def _precompute_top(self):
+        best = {}
+        for key, suggestion_id, score in zip(self.keys, self.ids, self.scores):
+            for prefix in short_prefixes([key]):
+                prefix_scores = best.setdefault(prefix, {})
+                if score > prefix_scores.get(suggestion_id, -1.0):
+                    prefix_scores[suggestion_id] = score
+        return {prefix: heapq.nlargest(SUGGESTION_COUNT, scores, key=scores.get) for prefix, scores in best.items()}
+
+    def _range(self, prefix):
+        start = bisect.bisect_left(self.keys, prefix)
+        return start, bisect.bisect_left(self.keys, prefix + '\uffff', start)
+
+    def _best(self, start, end, limit):
+        scores = {}
+        for i in range(start, end):
+            if self.scores[i] > scores.get(self.ids[i], -1.0):
+                scores[self.ids[i]] = self.scores[i]
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+    def search(self, prefix, limit=SUGGESTION_COUNT):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            found = self.top.get(prefix, [])[:limit]
+        else:
+            start, end = self._range(prefix)
+            found = self._best(start, min(end, start + MAX_CANDIDATES), limit)
+        return [self.suggestions[suggestion_id] for suggestion_id in found]
+
+    def replace(self, removed_ids, added):
+        """A new index without the suggestions in `removed_ids` and with those in `added` ({id: Suggestion})"""
+        index = PrefixIndex(dict(self.suggestions), list(self.keys), list(self.ids), list(self.scores), dict(self.top))
+        changed_keys = []
+        for suggestion_id in set(removed_ids) | set(added):
+            old = index.suggestions.pop(suggestion_id, None)
+            if old is None:
+                continue
+            for key in index_keys(old.label):
+                start = bisect.bisect_left(index.keys, key)
+                end = bisect.bisect_right(index.keys, key, start)
+                for i in range(start, end):
+                    if index.ids[i] == suggestion_id:
+                        del index.keys[i], index.ids[i], index.scores[i]
+                        break
+                changed_keys.append(key)
+        for suggestion_id, suggestion in added.items():
+            index.suggestions[suggestion_id] = suggestion
+            for key, _, score in index_entries(suggestion_id, suggestion):
+                i = bisect.bisect_right(index.keys, key)
+                index.keys.insert(i, key)
+                index.ids.insert(i, suggestion_id)
+                index.scores.insert(i, score)
+                changed_keys.append(key)
+        for prefix in short_prefixes(changed_keys):
+            top = index._best(*index._range(prefix), SUGGESTION_COUNT)
+            if top:
+                index.top[prefix] = top
+            else:
+                index.top.pop(prefix, None)
+        return index
+
+
+def product_suggestion(product_id, name, category_slug, product_slug, popularity):
+    url = reverse('product_detail', args=[category_slug, product_slug])
+    return 'product:' + str(product_id), Suggestion(name, 'product', url, popularity)
+
+
+def brand_suggestion(brand, popularity):
+    url = reverse('search') + '?' + urlencode({'keyword': brand})
+    return 'brand:' + brand.lower(), Suggestion(brand, 'brand', url, popularity)
+
+
+def load_suggestions():
+    """{suggestion id: Suggestion} for the available products, their brands and the categories"""
+    from category.models import Category
+    from store.models import Product
+
+    suggestions = {}
+    brands = {}
+    categories = {}
+    products = (Product.objects.filter(is_available=True)
+                .annotate(units_sold=Sum('orderproduct__quantity', filter=Q(orderproduct__ordered=True)))
+                .values_list('id', 'product_name', 'product_brand', 'slug', 'category_id', 'category__slug',
+                             'rating_count', 'units_sold'))
+    for product_id, name, brand, slug, category_id, category_slug, rating_count, units_sold in products:
+        popularity = 1.0 + (units_sold or 0) + rating_count
+        suggestion_id, suggestion = product_suggestion(product_id, name, category_slug, slug, popularity)
+        suggestions[suggestion_id] = suggestion
+        if brand:
+            brands[brand] = brands.get(brand, 0.0) + popularity
+        categories[category_id] = categories.get(category_id, 0.0) + popularity
+
+    for brand, popularity in brands.items():
+        suggestion_id, suggestion = brand_suggestion(brand, popularity)
+        suggestions[suggestion_id] = suggestion
+    for category in Category.objects.only('id', 'category_name', 'slug'):
+        suggestions['category:' + str(category.id)] = Suggestion(
+            category.category_name, 'category', category.get_url(), categories.get(category.id, 1.0))
+    return suggestions
+
+
+class SuggestionIndex:
+    def __init__(self, rebuild_interval=REBUILD_INTERVAL):
+        self.rebuild_interval = rebuild_interval
+        self._index = None
+        self._write_lock = threading.Lock()
+        self._rebuild_requested = threading.Event()
+        self._thread = None
+        # Number of changes applied, to detect changes made while a rebuild was reading the database
+        self._changes = 0
+
+    def start(self):
+        """Build the index on a background thread, and keep rebuilding it every rebuild_interval seconds"""
+        with self._write_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='search-suggestions', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from django.db import connection
+        while True:
+            self._rebuild_requested.clear()
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('Could not build the search suggestion index')
+            finally:
+                connection.close()
+            self._rebuild_requested.wait(self.rebuild_interval)
+
+    def rebuild(self):
+        changes = self._changes
+        index = PrefixIndex(load_suggestions())
+        with self._write_lock:
+            self._index = index
+            if self._changes != changes:
+                # The database was read before some of the changes applied to the previous index
+                self._rebuild_requested.set()
+
+    def request_rebuild(self):
+        self._rebuild_requested.set()
+
+    def suggest(self, prefix, limit=SUGGESTION_COUNT):
+        started = time.perf_counter()
+        # Readers use whichever index is current; changes swap in a new one
+        index = self._index
+        results = [] if index is None else index.search(prefix, limit)
+        SUGGEST_LATENCY.observe(time.perf_counter() - started)
+        return results
+
+    def product_changed(self, product, deleted=False):
+        with self._write_lock:
+            self._changes += 1
+            index = self._index
+            if index is None:
+                return
+            suggestion_id = 'product:' + str(product.pk)
+            if deleted or not product.is_available:
+                self._index = index.replace([suggestion_id], {})
+                return
+            category = index.suggestions.get('category:' + str(product.category_id))
+            if category is None:
+                # A product of a category the index does not know yet
+                self._rebuild_requested.set()
+                return
+            previous = index.suggestions.get(suggestion_id)
+            category_slug = category.url.rstrip('/').rsplit('/', 1)[-1]
+            added = dict([product_suggestion(product.pk, product.product_name, category_slug, product.slug,
+                                             previous.popularity if previous else 1.0 + product.rating_count)])
+            brand_id, brand = brand_suggestion(product.product_brand, 1.0)
+            if product.product_brand and brand_id not in index.suggestions:
+                added[brand_id] = brand
+            self._index = index.replace([], added)
+
+
+suggestion_index = SuggestionIndex()
+
+
+def product_saved(sender, instance, **kwargs):
+    """post_save handler for Product"""
+    transaction.on_commit(lambda: suggestion_index.product_changed(instance))
+
+
+def product_deleted(sender, instance, **kwargs):
+    """post_delete handler for Product"""
+    # Deleting the product clears instance.pk before the transaction commits
+    product = copy.copy(instance)
+    transaction.on_commit(lambda: suggestion_index.product_changed(product, deleted=True))
+
+
+def category_changed(sender, **kwargs):
+    """post_save / post_delete handler for Category"""
+    transaction.on_commit(suggestion_index.request_rebuild)
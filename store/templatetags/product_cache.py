@@ -0,0 +1,46 @@
+from django import template
+
+from store.fragment_cache import cached_fragment
+
+register = template.Library()
+
+
+class ProductCacheNode(template.Node):
+    def __init__(self, nodelist, fragment, product, vary_on):
+        self.nodelist = nodelist
+        self.fragment = fragment
+        self.product = product
+        self.vary_on = vary_on
+
+    def render(self, context):
+        product = self.product.resolve(context)
+        if product is None:
+            return self.nodelist.render(context)
+        vary_on = [value.resolve(context) for value in self.vary_on]
+        return cached_fragment(self.fragment, product.pk, lambda: self.nodelist.render(context), vary_on)
+
+
+@register.tag('productcache')
+def do_productcache(parser, token):
+    """
+    Cache the enclosed fragment until the product changes (see store/fragment_cache.py).
+
+    Usage::
+
+        {% load product_cache %}
+        {% productcache 'card' product %}
+            .. some expensive processing ..
+        {% endproductcache %}
+
+    Additional arguments are rendered into the cache key, for fragments that differ between users::
+
+        {% productcache 'reviews' single_product request.user.role %}
+    """
+    nodelist = parser.parse(('endproductcache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError("'%r' tag requires at least 2 arguments." % tokens[0])
+    fragment = tokens[1].strip('\'"')
+    return ProductCacheNode(nodelist, fragment, parser.compile_filter(tokens[2]),
+                            [parser.compile_filter(value) for value in tokens[3:]])
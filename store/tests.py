@@ -1,3 +1,40 @@
 from django.test import TestCase
 
-# Create your tests here.
+from category.models import Category
+from .models import Product
+from .pagination import KeysetPaginator, encode_cursor
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(category_name='Jackets', slug='jackets')
+        self.products = [Product.objects.create(product_name='Jacket %d' % number, slug='jacket-%d' % number,
+                                                price=10 * number, images='photos/products/jacket.jpg', stock=10,
+                                                category=category)
+                         for number in range(1, 6)]
+        self.paginator = KeysetPaginator(Product.objects.all(), ('category', 'id'), 2)
+
+    def test_next_and_previous_pages(self):
+        first = self.paginator.get_page()
+        self.assertEqual(list(first), self.products[:2])
+        self.assertFalse(first.has_previous())
+
+        second = self.paginator.get_page(first.next_cursor())
+        self.assertEqual(list(second), self.products[2:4])
+        last = self.paginator.get_page(second.next_cursor())
+        self.assertEqual(list(last), self.products[4:])
+        self.assertFalse(last.has_next())
+        self.assertIsNone(last.next_cursor())
+
+        self.assertEqual(list(self.paginator.get_page(last.previous_cursor())), self.products[2:4])
+
+    def test_cursor_past_the_last_product_shows_the_first_page(self):
+        # E.g. bookmarked before the products at the end of the listing were deleted
+        first, last = self.products[0], self.products[-1]
+        for cursor in (encode_cursor([last.category_id, last.id + 1], 'next'),
+                       encode_cursor([first.category_id, first.id - 1], 'previous')):
+            page = self.paginator.get_page(cursor)
+            self.assertEqual(list(page), self.products[:2])
+            self.assertFalse(page.has_previous())
+            self.assertIsNone(page.previous_cursor())
+            self.assertTrue(page.has_next())
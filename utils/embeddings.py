@@ -0,0 +1,156 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Pluggable text embedding backends used by vector search and the embedding ingestion jobs"""
+# Python Built-Ins:
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Type
+
+# External Dependencies:
+import numpy as np
+
+
+class EmbeddingBackend:
+    """Base class for an embedding model plus the vector table its embeddings are stored in
+
+    Each backend writes to its own table (`index_table`), because vectors from different
+    models live in different spaces and must never be compared with each other.
+    """
+
+    name: str = ""
+    index_table: str = ""
+
+    def __init__(self, batch_size: int = 32, max_workers: int = 4):
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"embed-{self.name}")
+
+    @property
+    def dimension(self) -> int:
+        """Length of the vectors produced by this backend"""
+        raise NotImplementedError
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed one batch of at most `batch_size` texts, returning a float32 array of shape (n, dimension)"""
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single search query"""
+        return self.embed_batch([text])[0]
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed any number of texts, splitting them into batches that run on the thread pool"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(list(self.executor.map(self.embed_batch, batches)))
+
+
+class BedrockEmbeddingBackend(EmbeddingBackend):
+    """Amazon Titan embeddings through Bedrock (one network call per text)"""
+
+    name = "bedrock"
+    index_table = "vector_products"
+
+    def __init__(self, client, model_id: str = "amazon.titan-embed-text-v1", batch_size: int = 1, max_workers: int = 8):
+        from langchain.embeddings import BedrockEmbeddings
+
+        super().__init__(batch_size=batch_size, max_workers=max_workers)
+        self.model = BedrockEmbeddings(model_id=model_id, client=client)
+        self._dimension = None
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = len(self.embed_query("dimension probe"))
+        return self._dimension
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        # Titan accepts a single input per request, so a batch is a sequence of calls
+        return np.array([self.model.embed_query(text) for text in texts], dtype=np.float32)
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """Static token embeddings computed on the local CPU, with no network call per query
+
+    The model is a tokenizer plus a token embedding matrix (the model2vec format), loaded
+    with `tokenizers` and `safetensors` and mean-pooled with NumPy, so it needs no deep
+    learning runtime. `model_name` is either a Hugging Face Hub repository, downloaded once
+    into the local cache, or a local directory holding tokenizer.json and model.safetensors.
+    The model is loaded eagerly when the backend is created, so the first search does not
+    pay for it.
+    """
+
+    name = "local"
+    index_table = "vector_products_local"
+
+    def __init__(self, model_name: str = "minishlab/potion-base-8M", batch_size: int = 256, max_workers: int = 2):
+        from huggingface_hub import hf_hub_download
+        from safetensors.numpy import load_file
+        from tokenizers import Tokenizer
+
+        super().__init__(batch_size=batch_size, max_workers=max_workers)
+        self.model_name = model_name
+        if os.path.isdir(model_name):
+            tokenizer_path = os.path.join(model_name, "tokenizer.json")
+            weights_path = os.path.join(model_name, "model.safetensors")
+        else:
+            tokenizer_path = hf_hub_download(model_name, "tokenizer.json")
+            weights_path = hf_hub_download(model_name, "model.safetensors")
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.no_padding()
+        self.tokenizer.no_truncation()
+        self.embeddings = load_file(weights_path)["embeddings"].astype(np.float32)
+
+    @property
+    def dimension(self) -> int:
+        return self.embeddings.shape[1]
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        vectors = np.zeros((len(encodings), self.dimension), dtype=np.float32)
+        for i, encoding in enumerate(encodings):
+            if encoding.ids:
+                vectors[i] = self.embeddings[encoding.ids].mean(axis=0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+BACKEND_CLASSES: Dict[str, Type[EmbeddingBackend]] = {
+    BedrockEmbeddingBackend.name: BedrockEmbeddingBackend,
+    LocalEmbeddingBackend.name: LocalEmbeddingBackend,
+}
+
+_backends: Dict[str, EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_embedding_backend(name: Optional[str] = None, client=None) -> EmbeddingBackend:
+    """Return the process-wide instance of an embedding backend, creating it on first use
+
+    Parameters
+    ----------
+    name :
+        "bedrock" or "local". If not specified, the EMBEDDING_BACKEND environment variable is
+        used, defaulting to "bedrock".
+    client :
+        boto3 bedrock-runtime client, required the first time the Bedrock backend is created.
+    """
+    name = name or os.environ.get("EMBEDDING_BACKEND", "bedrock")
+    with _backends_lock:
+        if name not in _backends:
+            if name == "bedrock":
+                if client is None:
+                    raise ValueError("A bedrock-runtime client is required for the Bedrock embedding backend")
+                _backends[name] = BedrockEmbeddingBackend(client)
+            elif name == "local":
+                _backends[name] = LocalEmbeddingBackend(os.environ.get("LOCAL_EMBEDDING_MODEL", "minishlab/potion-base-8M"))
+            else:
+                raise ValueError(f"Unknown embedding backend {name!r}. Expected one of {available_backends()}")
+        return _backends[name]
+
+
+def available_backends() -> List[str]:
+    """Names accepted by `get_embedding_backend`"""
+    return list(BACKEND_CLASSES)
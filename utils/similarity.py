@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Helper utilities for finding near-duplicate items in a matrix of embeddings"""
+# Python Built-Ins:
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# External Dependencies:
+import numpy as np
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of `embeddings` in place so dot products become cosine similarities
+
+    Rows with a zero norm are left untouched (they will never match anything).
+    """
+    norms = np.linalg.norm(embeddings, axis=1)
+    norms[norms == 0] = 1.0
+    embeddings /= norms[:, np.newaxis]
+    return embeddings
+
+
+def iter_similar_pairs(
+    embeddings: np.ndarray,
+    threshold: float,
+    block_size: int = 2048,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield every pair of rows whose cosine similarity is at least `threshold`
+
+    The similarity matrix is never materialized: it is computed one `block_size` x `block_size`
+    tile at a time, and only tiles on or above the diagonal are visited, so peak extra memory
+    is a single float32 tile regardless of the number of rows.
+
+    Parameters
+    ----------
+    embeddings :
+        Array of shape (n, d). It must already be L2-normalized (see `normalize_rows`).
+    threshold :
+        Minimum cosine similarity for a pair to be reported.
+    block_size :
+        Number of rows per tile. 2048 rows gives a 16 MiB float32 tile.
+
+    Yields
+    ------
+    Tuples of (left row indices, right row indices, similarities) for one tile, with
+    left < right for every pair.
+    """
+    n = embeddings.shape[0]
+    for left_start in range(0, n, block_size):
+        left = embeddings[left_start:left_start + block_size]
+        for right_start in range(left_start, n, block_size):
+            right = embeddings[right_start:right_start + block_size]
+            scores = left @ right.T
+            if right_start == left_start:
+                # Diagonal tile: keep the strict upper triangle only (no self or mirrored pairs)
+                scores = np.triu(scores, k=1)
+            rows, cols = np.nonzero(scores >= threshold)
+            if len(rows):
+                yield rows + left_start, cols + right_start, scores[rows, cols]
+
+
+def cluster_pairs(pairs: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    """Group connected pairs into clusters (connected components) using union-find
+
+    Returns a list of clusters, each a sorted list of at least two indices, largest first.
+    """
+    parent: Dict[int, int] = {}
+
+    def find(x: int) -> int:
+        parent.setdefault(x, x)
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters: Dict[int, List[int]] = {}
+    for x in parent:
+        clusters.setdefault(find(x), []).append(x)
+
+    return sorted((sorted(members) for members in clusters.values()), key=len, reverse=True)
@@ -0,0 +1,116 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Incremental extraction of <tag>...</tag> blocks from streamed LLM output"""
+# Python Built-Ins:
+from typing import Callable, Iterable, List, Optional
+
+
+class TagStreamParser:
+    """Find the contents of every `<tag>...</tag>` block in text that arrives in chunks
+
+    Every character is scanned once: after each chunk only the text that could still be the
+    start of an opening or closing tag is kept for the next one, so parsing is linear in the
+    length of the response whatever the chunk sizes.
+
+    Parameters
+    ----------
+    tag :
+        Tag name without brackets, for example "query".
+    on_block :
+        Optional callback run with the contents of each block as soon as its closing tag has
+        been fed. If it returns True, `done` is set so the caller can stop reading the stream.
+    """
+
+    def __init__(self, tag: str, on_block: Optional[Callable[[str], Optional[bool]]] = None):
+        self.open_tag = "<" + tag + ">"
+        self.close_tag = "</" + tag + ">"
+        self.on_block = on_block
+        self.blocks: List[str] = []
+        self.done = False
+        self._inside = False
+        self._pending = ""
+        self._block_parts: List[str] = []
+
+    def feed(self, chunk: str) -> List[str]:
+        """Consume the next chunk of text, returning the blocks it completed"""
+        completed = []
+        text = self._pending + chunk
+        position = 0
+        while True:
+            marker = self.close_tag if self._inside else self.open_tag
+            found = text.find(marker, position)
+            if found == -1:
+                break
+            if self._inside:
+                self._block_parts.append(text[position:found])
+                block = "".join(self._block_parts)
+                self._block_parts = []
+                self.blocks.append(block)
+                completed.append(block)
+                if self.on_block is not None and self.on_block(block):
+                    self.done = True
+            self._inside = not self._inside
+            position = found + len(marker)
+
+        # Hold back a tail that may be the first characters of the next marker
+        marker = self.close_tag if self._inside else self.open_tag
+        keep = 0
+        for length in range(min(len(marker) - 1, len(text) - position), 0, -1):
+            if marker.startswith(text[len(text) - length:]):
+                keep = length
+                break
+        if self._inside:
+            self._block_parts.append(text[position:len(text) - keep])
+        self._pending = text[len(text) - keep:] if keep else ""
+        return completed
+
+    def close(self) -> List[str]:
+        """End of the stream: a block that was opened but never closed runs to the end of the text"""
+        if self._inside:
+            block = "".join(self._block_parts) + self._pending
+            self._block_parts, self._pending, self._inside = [], "", False
+            self.blocks.append(block)
+            return [block]
+        return []
+
+
+def extract_tags(text: str, tag: str) -> List[str]:
+    """Contents of all `<tag>...</tag>` blocks in a complete text"""
+    parser = TagStreamParser(tag)
+    parser.feed(text)
+    parser.close()
+    return parser.blocks
+
+
+def read_until_tag(chunks: Iterable[str], tag: str) -> str:
+    """Read a stream of text chunks until the first `<tag>...</tag>` block is complete
+
+    The stream is closed at that point, which cancels the rest of the generation when `chunks`
+    is a streaming LLM response. Returns all the text read, ending with the closing tag if it
+    was found.
+
+    Parameters
+    ----------
+    chunks :
+        Iterable of text chunks, for example `llm.stream(prompt)`.
+    tag :
+        Tag name without brackets, for example "query".
+    """
+    parser = TagStreamParser(tag, on_block=lambda block: True)
+    parts = []
+    iterator = iter(chunks)
+    try:
+        for chunk in iterator:
+            parts.append(chunk)
+            parser.feed(chunk)
+            if parser.done:
+                break
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+    text = "".join(parts)
+    if parser.done:
+        # Drop whatever arrived after the closing tag in the same chunk
+        text = text[:text.find(parser.close_tag, text.find(parser.open_tag)) + len(parser.close_tag)]
+    return text